@@ -1,3 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
+from .models import ScannerPool
+
+#Scanner pools are managed here; scanners and scans are assigned to them from their own forms.
+admin.site.register(ScannerPool)
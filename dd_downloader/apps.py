@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DdDownloaderConfig(AppConfig):
     name = 'dd_downloader'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,315 @@
+import csv
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, IntegrityError
+from .models import Scanner, Scan
+from .findings import iter_json_array
+from . import events
+
+#Bulk creation of scans from CSV or JSON documents, for registering scans from other tools (see views.bulk_scan_create_endpoint and the bulk_create_scans management command).
+#Rows are validated as they are read, and inserted in chunks of CHUNK_SIZE rows, one transaction per chunk. Invalid rows are reported by row number and skipped.
+#Also bulk deletion of scans, for the batch delete command (see delete_scans).
+import logging
+logger = logging.getLogger(__name__)
+
+#Number of rows inserted per transaction.
+CHUNK_SIZE = 1000
+#Maximum number of row errors that are reported individually.
+MAX_REPORTED_ERRORS = 1000
+#Number of scans deleted per statement by delete_scans().
+DELETE_CHUNK_SIZE = 500
+
+CSV		= 'csv'
+JSON	= 'json'
+FORMATS = [CSV, JSON]
+
+"""
+Returns the format of a document from its file name or content type, or None.
+"""
+def guess_format(name=None, content_type=None):
+	name = (name or '').lower()
+	content_type = (content_type or '').lower()
+	if name.endswith('.csv') or content_type == 'text/csv':
+		return CSV
+	if name.endswith('.json') or content_type == 'application/json':
+		return JSON
+	return None
+
+"""
+Yields the rows of a document read from a text stream, as dicts. CSV documents should have a header row, and JSON documents should be an array of objects.
+"""
+def iter_rows(stream, fmt):
+	if fmt == CSV:
+		return csv.DictReader(stream)
+	return iter_json_array(stream)
+
+class BulkCreateResult:
+	def __init__(self):
+		self.created = 0
+		self.error_count = 0
+		#List of (row number, message) tuples, with at most MAX_REPORTED_ERRORS entries.
+		self.errors = []
+		#Error that stopped the document from being read to the end, if any.
+		self.parse_error = None
+	def add_error(self, row_number, message):
+		self.error_count += 1
+		if len(self.errors) < MAX_REPORTED_ERRORS:
+			self.errors.append((row_number, message))
+	def to_json(self):
+		resp = {
+			'status': 'failure' if (self.error_count or self.parse_error) else 'success',
+			'created': self.created,
+			'error_count': self.error_count,
+			'errors': [{'row': row_number, 'error': message} for row_number, message in sorted(self.errors)],
+		}
+		if self.parse_error:
+			resp['parse_error'] = self.parse_error
+		return resp
+
+"""
+Creates a scan for every valid row. Each row names its scanner (by PK or name) under "scanner", and gives the fields of the scanner type's scan creation form (e.g. scan_name, endpoints, auto_create, auto_start, auto_retrieve), which are validated by the form's fields.
+Rows are numbered from 1, not counting a CSV header.
+"""
+def create_scans(rows, chunk_size=None):
+	result = BulkCreateResult()
+	scanners = {}
+	names = set()
+	chunk = []
+	try:
+		for row_number, row in enumerate(rows, 1):
+			try:
+				scan_obj = build_scan(row, scanners)
+			except ValidationError as e:
+				result.add_error(row_number, ' '.join(e.messages))
+				continue
+			if scan_obj.scan_name in names:
+				result.add_error(row_number, f"scan_name: {scan_obj.scan_name!r} appears more than once")
+				continue
+			names.add(scan_obj.scan_name)
+			chunk.append((row_number, scan_obj))
+			if len(chunk) >= (chunk_size or CHUNK_SIZE):
+				insert_chunk(chunk, result)
+				chunk = []
+	except (ValueError, csv.Error) as e:
+		#JSON and encoding errors are ValueErrors. The rows read before the error are still created.
+		logger.warning(f"Bulk scan creation stopped at a malformed document: {e}")
+		result.parse_error = str(e)
+	insert_chunk(chunk, result)
+	return result
+
+"""
+Validates a row and returns an unsaved scan of its scanner's type. Raises ValidationError if the row is invalid.
+Scanners are looked up once per distinct reference, and cached in "scanners".
+"""
+def build_scan(row, scanners):
+	if not isinstance(row, dict):
+		raise ValidationError("Rows should be objects.")
+	if None in row:
+		#csv.DictReader puts the values of extra columns under None.
+		raise ValidationError("The row has more values than the header.")
+	scanner_ref = str(row.get('scanner') or '').strip()
+	if scanner_ref not in scanners:
+		query = {'pk': int(scanner_ref)} if scanner_ref.isdigit() else {'scanner_name': scanner_ref}
+		scanners[scanner_ref] = Scanner.objects.filter(**query).first()
+	scanner_obj = scanners[scanner_ref]
+	if scanner_obj is None:
+		raise ValidationError(f"scanner: {scanner_ref!r} does not exist.")
+
+	form_class = scanner_obj.get_scan_create_form_class()
+	unknown = set(row) - set(form_class.base_fields) - {'scanner'}
+	if unknown:
+		raise ValidationError(f"Unknown field(s): {', '.join(sorted(unknown))}.")
+	cleaned = {}
+	errors = []
+	for name, field in form_class.base_fields.items():
+		value = row.get(name)
+		try:
+			cleaned[name] = field.clean(value if value != '' else None)
+		except ValidationError as e:
+			errors.append(f"{name}: {' '.join(e.messages)}")
+	if errors:
+		raise ValidationError(errors)
+	scan_obj = form_class._meta.model(scanner=scanner_obj, **cleaned)
+	#Checks that span fields, e.g. that the pool has scanners of the scan's type.
+	scan_obj.clean()
+	return scan_obj
+
+"""
+Inserts a chunk of validated scans in one transaction, skipping the scans whose names are already taken.
+If the chunk hits an integrity error anyway (e.g. a scan of the same name was created meanwhile), its scans are saved one at a time to find the offending rows.
+"""
+def insert_chunk(chunk, result):
+	if not chunk:
+		return
+	taken = set(Scan.objects.filter(scan_name__in=[scan_obj.scan_name for row_number, scan_obj in chunk]).values_list('scan_name', flat=True))
+	rows = []
+	for row_number, scan_obj in chunk:
+		if scan_obj.scan_name in taken:
+			result.add_error(row_number, f"scan_name: A scan named {scan_obj.scan_name!r} already exists.")
+		else:
+			rows.append((row_number, scan_obj))
+	if can_bulk_insert():
+		try:
+			with transaction.atomic():
+				bulk_insert_scans([scan_obj for row_number, scan_obj in rows])
+		except IntegrityError as e:
+			logger.warning(f"Bulk insert failed, saving scans one at a time: {e}")
+		else:
+			result.created += len(rows)
+			return
+	for row_number, scan_obj in rows:
+		scan_obj.id = None
+		scan_obj.pk = None
+		try:
+			with transaction.atomic():
+				scan_obj.save()
+		except IntegrityError as e:
+			result.add_error(row_number, str(e))
+		else:
+			result.created += 1
+
+"""
+Whether the PKs of bulk inserted scans can be found, which bulk_insert_scans() needs to insert the scanner types' child rows.
+"""
+def can_bulk_insert():
+	return connection.features.can_return_ids_from_bulk_insert or connection.vendor == 'sqlite'
+
+"""
+Inserts scans of any scanner types with one bulk INSERT into the Scan table, and one into each scanner type's table. QuerySet.bulk_create() doesn't support multi-table inheritance, so the scanner types' rows are inserted directly.
+No post_save signals are sent, so the scans' creation is published to the event stream with one event per scanner.
+Should be called in a transaction.
+"""
+def bulk_insert_scans(scan_objs):
+	ctype_pks = {}
+	for scan_obj in scan_objs:
+		scan_class = type(scan_obj)
+		if scan_class not in ctype_pks:
+			ctype_pks[scan_class] = ContentType.objects.get_for_model(scan_class, for_concrete_model=False).pk
+		scan_obj.polymorphic_ctype_id = ctype_pks[scan_class]
+	base_fields = [field for field in Scan._meta.concrete_fields if not field.primary_key]
+
+	if connection.features.can_return_ids_from_bulk_insert:
+		parents = [Scan(**{field.attname: getattr(scan_obj, field.attname) for field in base_fields}) for scan_obj in scan_objs]
+		Scan.objects.bulk_create(parents)
+		pks = [parent.pk for parent in parents]
+	else:
+		#SQLite doesn't return the PKs of bulk inserted rows, so they are allocated here. Should another writer take any of them first, the INSERT fails on the primary key, and the scans are saved one at a time instead.
+		#bulk_create() would compile a statement per few dozen rows, so the rows are inserted with one prepared statement instead.
+		first_pk = next_sqlite_pk(Scan)
+		pks = range(first_pk, first_pk + len(scan_objs))
+		for scan_obj, pk in zip(scan_objs, pks):
+			scan_obj.id = pk
+		insert_rows(Scan, [Scan._meta.pk] + base_fields, scan_objs)
+	for scan_obj, pk in zip(scan_objs, pks):
+		scan_obj.id = pk
+		scan_obj.pk = pk
+
+	for scan_class in ctype_pks:
+		insert_rows(scan_class, scan_class._meta.local_concrete_fields, [scan_obj for scan_obj in scan_objs if type(scan_obj) is scan_class])
+	created = {}
+	for scan_obj in scan_objs:
+		scan_obj._state.adding = False
+		created.setdefault(scan_obj.scanner_id, []).append(scan_obj.pk)
+	for scanner_pk, scan_pks in created.items():
+		events.publish_created(scanner_pk, scan_pks)
+
+"""
+Returns the PK that SQLite would give the next row of a model's table: one more than the highest PK that the table has ever used, since AUTOINCREMENT doesn't reuse the PKs of deleted rows either (which DeletedObject relies on).
+"""
+def next_sqlite_pk(model):
+	quote_name = connection.ops.quote_name
+	with connection.cursor() as cursor:
+		cursor.execute('SELECT MAX({}) FROM {}'.format(quote_name(model._meta.pk.column), quote_name(model._meta.db_table)))
+		highest = cursor.fetchone()[0] or 0
+		cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [model._meta.db_table])
+		row = cursor.fetchone()
+	return max(highest, row[0] if row else 0) + 1
+
+#Internal types of the fields whose values are passed to the database as they are, once they have been cleaned by a form field.
+PLAIN_FIELD_TYPES = {
+	'AutoField', 'BigIntegerField', 'BooleanField', 'CharField', 'FloatField', 'ForeignKey',
+	'IntegerField', 'OneToOneField', 'PositiveIntegerField', 'PositiveSmallIntegerField', 'SmallIntegerField', 'TextField',
+}
+
+"""
+Returns a function that prepares the values of a field for the database, as get_db_prep_save() would. The values of fields in PLAIN_FIELD_TYPES are left as they are, and those of other fields are prepared once per distinct value, since most of them are the same for every row (e.g. None, or the creation date).
+"""
+def column_preparer(field):
+	if field.get_internal_type() in PLAIN_FIELD_TYPES:
+		return lambda value: value
+	prepared = {}
+	def prepare(value):
+		try:
+			return prepared[value]
+		except KeyError:
+			prepared[value] = field.get_db_prep_save(value, connection)
+			return prepared[value]
+		except TypeError:
+			return field.get_db_prep_save(value, connection)
+	return prepare
+
+"""
+Inserts the given fields of objects into a model's table, in order, with a single executemany().
+Fields that are set when the objects are saved (auto_now and auto_now_add) get the same value for every row, as with bulk_create().
+"""
+def insert_rows(model, fields, objs):
+	if not objs:
+		return
+	quote_name = connection.ops.quote_name
+	sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+		quote_name(model._meta.db_table),
+		', '.join(quote_name(field.column) for field in fields),
+		', '.join(['%s'] * len(fields)),
+	)
+	columns = []
+	for field in fields:
+		if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+			value = field.pre_save(objs[0], True)
+			for obj in objs:
+				setattr(obj, field.attname, value)
+		columns.append((field.attname, column_preparer(field)))
+	params = [[prepare(getattr(obj, attname)) for attname, prepare in columns] for obj in objs]
+	with connection.cursor() as cursor:
+		cursor.executemany(sql, params)
+
+"""
+Deletes the scans of a queryset, and returns the PKs of the deleted scans.
+QuerySet.delete() would load every scan and send post_delete for each of them, whose receiver records, publishes and releases the result of one scan at a time (see signals.scan_deleted). Here the same is done in bulk: the scans' rows, findings and diffs are deleted DELETE_CHUNK_SIZE scans per statement, the deletions are recorded with one bulk insert, every result blob is released once for all of its references, and a single event is published.
+"""
+def delete_scans(scans):
+	from collections import Counter
+	from .class_directory import get_scanner_types
+	from .models import DeletedObject, ResultBlob, ScanDiff, Finding
+	scan_classes = [classes['scan'] for classes in get_scanner_types().values()]
+	with transaction.atomic():
+		rows = list(scans.order_by().values_list('pk', 'scanner_id', 'result_id'))
+		blob_refs = Counter(result_pk for pk, scanner_pk, result_pk in rows if result_pk is not None)
+		for start in range(0, len(rows), DELETE_CHUNK_SIZE):
+			pks = [pk for pk, scanner_pk, result_pk in rows[start:start + DELETE_CHUNK_SIZE]]
+			blob_refs.update(ScanDiff.objects.filter(scan_id__in=pks, changes__isnull=False).values_list('changes_id', flat=True))
+			ScanDiff.objects.filter(previous_scan_id__in=pks).update(previous_scan=None)
+			delete_rows(ScanDiff, ScanDiff._meta.get_field('scan'), pks)
+			delete_rows(Finding, Finding._meta.get_field('scan'), pks)
+			#The scanner types' rows go first, since they refer to the Scan rows.
+			for scan_class in scan_classes:
+				delete_rows(scan_class, scan_class._meta.pk, pks)
+			delete_rows(Scan, Scan._meta.pk, pks)
+		DeletedObject.objects.bulk_create([DeletedObject(model_name=DeletedObject.SCAN, object_pk=pk, scanner_pk=scanner_pk) for pk, scanner_pk, result_pk in rows])
+		for blob_pk, count in blob_refs.items():
+			ResultBlob.release(blob_pk, count)
+		if rows:
+			events.publish_deleted([(pk, scanner_pk) for pk, scanner_pk, result_pk in rows])
+	return [pk for pk, scanner_pk, result_pk in rows]
+
+"""
+Deletes the rows of a model's table whose value of a field is one of the given values, with a single statement. No signals are sent, and no related rows are deleted.
+"""
+def delete_rows(model, field, values):
+	quote_name = connection.ops.quote_name
+	sql = 'DELETE FROM {} WHERE {} IN ({})'.format(
+		quote_name(model._meta.db_table),
+		quote_name(field.column),
+		', '.join(['%s'] * len(values)),
+	)
+	with connection.cursor() as cursor:
+		cursor.execute(sql, values)
@@ -1,39 +1,300 @@
 #from celery import Celery
 from dd_scanner.celery import app
-from dd_downloader.models import Scanner, Scan
+from dd_downloader.models import Scanner, Scan, DeletedObject, ScanDiff
 from celery.utils.log import get_task_logger
+from celery.signals import task_postrun
+import functools
 logger = get_task_logger(__name__)
 
+#Delay (in seconds) before a retrieval step that found its scan leased is tried again.
+RETRIEVE_STEP_DEFER = 10
+#Time (in seconds) after which a dispatched poll that never ran is dispatched again. Polls that do run schedule the next one themselves (see Scan.schedule_next_poll).
+POLL_DISPATCH_TIMEOUT = 5 * 60
+#Time (in seconds) that a retrieval step may be overdue (see Scan.retrieve_step_at) before its task is taken to be lost, and the step is dispatched again.
+RETRIEVE_STEP_TIMEOUT = 5 * 60
+
+"""
+Writes out the outcomes of API calls that the worker process has recorded but held back (see health.py and circuit.py) once they are due, after every task.
+"""
+@task_postrun.connect
+def flush_call_records(**kwargs):
+	from dd_downloader import circuit, health
+	health.flush_due()
+	circuit.flush_due()
+
+"""
+Decorator for tasks that work on a single scan. The task first takes the scan's lease (see Scan.acquire_lease), and is skipped if another task already holds a live lease on the scan, since that task is working on the scan already (e.g. a slow poll that outlasted the beat interval).
+Tasks chained by Scan.chain_next_step are given the lease token of the task that queued them as "handoff_token", and take that lease over.
+"""
+def scan_lease_required(task):
+	@functools.wraps(task)
+	def wrapper(scan_pk, *args, handoff_token=None, **kwargs):
+		token = Scan.acquire_lease(scan_pk, handoff=handoff_token)
+		if token is None:
+			logger.info(f"Scan {scan_pk} is leased by another task, skipping")
+			return
+		try:
+			return task(scan_pk, *args, **kwargs)
+		finally:
+			Scan.release_leases(token)
+	return wrapper
+
+"""
+Returns whether the circuit of a scan's scanner is open (see circuit.py), in which case the task is queued again for when the circuit lets calls through, instead of failing on the scanner.
+Only needed by tasks that the scheduler doesn't queue again by itself, such as manual commands.
+"""
+def deferred_for_circuit(task, scan_obj):
+	from dd_downloader import circuit
+	retry_after = circuit.retry_after(scan_obj.scanner_id)
+	if retry_after is None:
+		return False
+	logger.info(f"Circuit of scanner {scan_obj.scanner_id} is open, deferring {task.name} of {scan_obj} by {retry_after:.0f}s")
+	task.apply_async((scan_obj.pk,), countdown=retry_after)
+	return True
+
+"""
+Returns a queryset of the scans that currently have something for process_scan to do: scans with a queued manual command, scans waiting to be automatically created, started or retrieved, and scans in progress that are due for a poll (see Scan.next_poll_at).
+Retrievals whose next step is overdue by RETRIEVE_STEP_TIMEOUT are included as well, since the task that was queued for the step was lost.
+Only the base Scan table is queried (non-polymorphic), so this resolves to a single query. Every branch of the filter is served by one of the scheduler's indexes (see Scan.Meta), so the database looks up the matching rows of each branch instead of scanning the table. Scans that a task holds a live lease on are left out, since they are being worked on already, and so are scans whose action is waiting to be retried (see Scan.retry_later).
+Scans are ordered by priority, then queued commands before automatic work, then oldest first, which is the order in which work is released when a scanner is at its limits.
+"""
+def actionable_scans(scanner_pk=None):
+	from datetime import timedelta
+	from django.db.models import Q, F
+	from django.utils import timezone
+	from dd_downloader.models import ScannerHealth
+	now = timezone.now()
+	#Pooled scans that are bound to an unreachable scanner are selected whatever their flags, so that they are failed over (see Scan.fail_over).
+	unreachable_pks = ScannerHealth.objects.filter(ScannerHealth.unreachable_q()).values('scanner_id')
+	scan_list = Scan.objects.non_polymorphic().filter(
+		#Queued commands are matched by value rather than with IS NOT NULL, which SQLite can't look up in the index.
+		Q(queued_action__in=[action for action, name in Scan.ACTION_CHOICES]) |
+		Q(pool__isnull=False, status__in=(Scan.NEW, Scan.CREATED), scanner_id__in=unreachable_pks) |
+		Q(status=Scan.NEW, auto_create=True) |
+		Q(status=Scan.CREATED, auto_start=True) |
+		Q(status=Scan.FINISHED, auto_retrieve=True) |
+		Q(status=Scan.IN_PROGRESS, next_poll_at__isnull=True) |
+		Q(status=Scan.IN_PROGRESS, next_poll_at__lte=now) |
+		Q(status=Scan.RETRIEVING, retrieve_step_at__lte=now - timedelta(seconds=RETRIEVE_STEP_TIMEOUT))
+	).filter(Scan.unleased_q()).exclude(retry_at__gt=now).order_by('-priority', F('queued_at').asc(nulls_last=True), 'pk')
+	if scanner_pk is not None:
+		scan_list = scan_list.filter(scanner_id=scanner_pk)
+	return scan_list
+
+"""
+Returns the action that process_scan would run on a scan: its queued command, or the automatic action for its status. Returns None for scans that only need polling.
+"""
+def scan_action(status, queued_action):
+	if queued_action is not None:
+		return queued_action
+	return {
+		Scan.NEW: Scan.ACTION_CREATE,
+		Scan.CREATED: Scan.ACTION_START,
+		Scan.FINISHED: Scan.ACTION_RETRIEVE,
+	}.get(status)
+
+"""
+Returns the free capacity of every scanner that has limits, as a dictionary of scanner PKs to [free running slots, free task slots], with None for unlimited.
+Running slots are taken by scans in Scan.RUNNING_STATUSES. Task slots (max_concurrent_calls) are taken by scans that a task holds a lease on, since each of those tasks makes API calls to the scanner.
+"""
+def scanner_capacity():
+	from django.db.models import Q, Count
+	from django.utils import timezone
+	scanner_list = Scanner.objects.non_polymorphic().filter(
+		Q(max_running_scans__isnull=False) | Q(max_concurrent_calls__isnull=False)
+	).annotate(
+		running=Count('scan', filter=Q(scan__status__in=Scan.RUNNING_STATUSES)),
+		busy=Count('scan', filter=Q(scan__lease_expires__gt=timezone.now())),
+	)
+	capacity = {}
+	for scanner_pk, max_running, max_calls, running, busy in scanner_list.values_list('pk', 'max_running_scans', 'max_concurrent_calls', 'running', 'busy'):
+		capacity[scanner_pk] = [
+			None if max_running is None else max_running - running,
+			None if max_calls is None else max_calls - busy,
+		]
+	return capacity
+
+"""
+Returns the free capacity of every scanner pool in the same form as scanner_capacity(), summed over the pool's members, with None where any member is unlimited.
+Pooled scans that are yet to be created are released against the capacity of their pool rather than that of their scanner, since they are only bound to a member when they are created (see Scan.place). Unreachable members are left out.
+"""
+def pool_capacity(capacity, unreachable):
+	pools = {}
+	for scanner_pk, pool_pk in Scanner.objects.non_polymorphic().filter(pool__isnull=False).values_list('pk', 'pool_id'):
+		if scanner_pk in unreachable:
+			continue
+		free = capacity.get(scanner_pk, [None, None])
+		total = pools.setdefault(pool_pk, [0, 0])
+		for i in range(2):
+			if total[i] is not None:
+				total[i] = None if free[i] is None else total[i] + max(free[i], 0)
+	return pools
+
+"""
+Returns the PKs of all scanners whose scanner type provides the Scanner.poll_many() batch hook.
+"""
+def batch_poll_scanner_pks():
+	from django.contrib.contenttypes.models import ContentType
+	from dd_downloader import class_directory
+	scanner_classes = [classes['scanner'] for classes in class_directory.get_scanner_types().values() if classes['scanner'].can_poll_many()]
+	if not scanner_classes:
+		return set()
+	ctypes = ContentType.objects.get_for_models(*scanner_classes, for_concrete_models=False).values()
+	return set(Scanner.objects.non_polymorphic().filter(polymorphic_ctype__in=ctypes).values_list('pk', flat=True))
+
+"""
+Queues the planned work: in-progress scans of scanners that support batch polling are grouped into one "poll-scans" task per scanner, and every other scan gets its own "process-scan" task.
+Actions are only released as far as their scanner's limits allow, in the order of the scan list; the rest stays queued for a later run. Polls are always released, since they are what frees up capacity.
+Dispatched polls have their next_poll_at pushed back by POLL_DISPATCH_TIMEOUT before they are queued, so that later runs don't queue them again while they wait for a worker. Overdue retrieval steps are queued again the same way, and their due time is moved to now.
+Work on scanners that are unreachable (see ScannerHealth) is held back until they are back up, instead of failing on a timeout, and so is work on scanners whose circuit is open (see circuit.py). Once a circuit's cooldown is over, one scan per run is released, whose first call is the circuit's trial call.
+Pooled scans that have yet to be started are still dispatched, so that they can be placed on or failed over to another member. Those bound to an unreachable scanner are dispatched without taking any capacity, as long as their pool has another member to move them to.
 """
-Iterates through all scanners, and queues a "process-scans" Celery task for each one.
+def dispatch_actionable_scans(scan_list):
+	from datetime import timedelta
+	from django.contrib.contenttypes.models import ContentType
+	from django.utils import timezone
+	batch_scanner_pks = batch_poll_scanner_pks()
+	from dd_downloader import circuit
+	from dd_downloader.models import ScannerHealth
+	now = timezone.now()
+	capacity = scanner_capacity()
+	unreachable = ScannerHealth.unreachable_scanner_pks()
+	circuits = circuit.open_circuits()
+	trial_scanner_pks = set()
+	pools = pool_capacity(capacity, unreachable | set(circuits))
+	batch_polls = {}
+	single_polls = []
+	retrieve_steps = []
+	for scan_pk, status, queued_action, scanner_pk, pool_pk, ctype_pk in scan_list.values_list('pk', 'status', 'queued_action', 'scanner_id', 'pool_id', 'polymorphic_ctype_id').iterator():
+		if pool_pk is not None and status in (Scan.NEW, Scan.CREATED):
+			if scanner_pk in unreachable:
+				if pool_pk in pools:
+					process_scan.delay(scan_pk)
+				continue
+		else:
+			if scanner_pk in unreachable:
+				continue
+			if scanner_pk in circuits:
+				if circuits[scanner_pk] > now or scanner_pk in trial_scanner_pks:
+					continue
+				trial_scanner_pks.add(scanner_pk)
+		if status == Scan.RETRIEVING:
+			retrieve_steps.append(scan_pk)
+			continue
+		action = scan_action(status, queued_action)
+		if action is None:
+			if scanner_pk in batch_scanner_pks:
+				batch_polls.setdefault(scanner_pk, []).append(scan_pk)
+			else:
+				single_polls.append(scan_pk)
+			continue
+		free = pools.get(pool_pk) if pool_pk is not None and status == Scan.NEW else capacity.get(scanner_pk)
+		if free is not None:
+			if free[1] is not None and free[1] <= 0:
+				continue
+			if free[0] is not None and action in ContentType.objects.get_for_id(ctype_pk).model_class().RUNNING_ACTIONS:
+				if free[0] <= 0:
+					continue
+				free[0] -= 1
+			if free[1] is not None:
+				free[1] -= 1
+		process_scan.delay(scan_pk)
+	poll_pks = single_polls + [scan_pk for scan_pks in batch_polls.values() for scan_pk in scan_pks]
+	if poll_pks:
+		Scan._base_manager.filter(pk__in=poll_pks).update(next_poll_at=now + timedelta(seconds=POLL_DISPATCH_TIMEOUT))
+	for scan_pk in single_polls:
+		process_scan.delay(scan_pk)
+	for scanner_pk, scan_pks in batch_polls.items():
+		poll_scans.delay(scanner_pk, scan_pks)
+	if retrieve_steps:
+		Scan._base_manager.filter(pk__in=retrieve_steps).update(retrieve_step_at=now)
+	for scan_pk in retrieve_steps:
+		logger.warning(f"Retrieval step of scan {scan_pk} is overdue, dispatching it again")
+		continue_scan_retrieval.delay(scan_pk, step_at=now.timestamp())
+
+"""
+Runs an action on a scan if its scanner has capacity for it, and queues it otherwise. Queued commands are taken off the queue once they run.
+"""
+def run_scan_action(scan_obj, action):
+	if not scan_obj.has_capacity_for(action):
+		logger.info(f"{scan_obj} is at its scanner's running scan limit, queueing {action}")
+		if scan_obj.queued_action != action:
+			scan_obj.queue_action(action)
+		return
+	scan_obj.clear_queued_action()
+	if action == Scan.ACTION_CREATE:
+		scan_obj.create()
+	elif action == Scan.ACTION_START:
+		scan_obj.start()
+	elif action == Scan.ACTION_RETRIEVE:
+		scan_obj.retrieve()
+
+"""
+Plans the work for all scanners with a single query, and only queues Celery tasks for the scans that have an action pending.
 """
 @app.task(name='process-all-scanners')
 def process_all_scanners():
-	scanner_list = Scanner.objects.all()
-	for scanner_obj in scanner_list:
-		process_scans.delay(scanner_obj.pk)
+	dispatch_actionable_scans(actionable_scans())
 
 """
-Iterates through all scans under a scanner, and queues a "process-scan" Celery task for each one.
+Queues Celery tasks for the scans under a scanner that have an action pending.
 """
 @app.task(name='process-scans')
 def process_scans(scanner_pk):
-	scan_list = Scanner.objects.get(pk=scanner_pk).scan_set.all()
-	for scan_obj in scan_list:
-		process_scan.delay(scan_obj.pk)
+	dispatch_actionable_scans(actionable_scans(scanner_pk))
+
+"""
+Polls many in-progress scans under one scanner at once through the scanner's poll_many() batch hook.
+"""
+@app.task(name='poll-scans')
+def poll_scans(scanner_pk, scan_pks):
+	from dd_downloader import circuit
+	#Polls that find the circuit open are dispatched again by a later run.
+	if circuit.retry_after(scanner_pk) is not None:
+		return
+	scanner_obj = Scanner.objects.get(pk=scanner_pk)
+	#Scans that another task holds the lease of are left to that task.
+	token, leased_pks = Scan.acquire_leases(scan_pks)
+	try:
+		scan_list = list(Scan.objects.filter(pk__in=leased_pks, scanner=scanner_obj, status=Scan.IN_PROGRESS))
+		if not scan_list:
+			return
+		for scan_obj in scan_list:
+			scan_obj.scanner = scanner_obj
+		scanner_obj.poll_many(scan_list)
+	finally:
+		Scan.release_leases(token)
 
 """
 Automation task. Checks a scan's status, and depending on the status and whether it is eligible for automatic creation/starting/retrieval, it will call the corresponding action.
+Pooled scans are placed on a member of their pool first, or failed over to another member if their scanner has become unreachable, in which case the task chained by the failover creates them again.
 """
 @app.task(name='process-scan')
+@scan_lease_required
 def process_scan(scan_pk):
 	scan_obj = Scan.objects.get(pk=scan_pk)
-	if scan_obj.status == Scan.NEW:
-		if scan_obj.auto_create and scan_obj.can_create(auto=True):
+	if scan_obj.fail_over():
+		logger.info(f"Failed {scan_obj} over to scanner {scan_obj.scanner_id}")
+		return
+	if scan_obj.place():
+		logger.info(f"Placed {scan_obj} on scanner {scan_obj.scanner_id}")
+	from dd_downloader import circuit
+	#Scans whose scanner's circuit is open are dispatched again by a later run.
+	if circuit.retry_after(scan_obj.scanner_id) is not None:
+		logger.info(f"Circuit of scanner {scan_obj.scanner_id} is open, skipping {scan_obj}")
+		return
+	if scan_obj.is_retry_pending():
+		logger.info(f"{scan_obj} is waiting to be retried, skipping")
+		return
+	if scan_obj.queued_action is not None:
+		logger.info(f"Running queued {scan_obj.queued_action} on {scan_obj}")
+		run_scan_action(scan_obj, scan_obj.queued_action)
+	elif scan_obj.status == Scan.NEW:
+		if scan_obj.auto_create and scan_obj.can_create(auto=True) and scan_obj.has_capacity_for(Scan.ACTION_CREATE):
 			logger.info(f"Automatically creating {scan_obj}")
 			scan_obj.create()
 	elif scan_obj.status == Scan.CREATED:
-		if scan_obj.auto_start and scan_obj.can_start(auto=True):
+		if scan_obj.auto_start and scan_obj.can_start(auto=True) and scan_obj.has_capacity_for(Scan.ACTION_START):
 			logger.info(f"Automatically starting {scan_obj}")
 			scan_obj.start()
 	elif scan_obj.status == Scan.FINISHED:
@@ -46,28 +307,101 @@ def process_scan(scan_pk):
 #		logger.warning(f"Error: {scan_obj}")
 
 """
-Manual scan command tasks.
+Runs the next step of a multi-step retrieval. Queued by Scan.schedule_retrieve_step() with a countdown, or by the scheduler for a step that is overdue, with the due time of the step as "step_at".
+"""
+@app.task(name='continue-scan-retrieval')
+def continue_scan_retrieval(scan_pk, step_at=None):
+	from dd_downloader import circuit
+	token = Scan.acquire_lease(scan_pk)
+	if token is None:
+		#The scheduler only queues steps again once they are overdue, so a step that finds the scan leased is deferred instead of skipped.
+		logger.info(f"Scan {scan_pk} is leased by another task, deferring retrieval step")
+		continue_scan_retrieval.apply_async((scan_pk,), {'step_at': step_at}, countdown=RETRIEVE_STEP_DEFER)
+		return
+	try:
+		scan_obj = Scan.objects.get(pk=scan_pk)
+		if step_at is not None and not scan_obj.is_current_retrieve_step(step_at):
+			logger.info(f"Retrieval step of {scan_obj} was superseded, skipping")
+			return
+		retry_after = circuit.retry_after(scan_obj.scanner_id)
+		if retry_after is not None:
+			logger.info(f"Circuit of scanner {scan_obj.scanner_id} is open, deferring retrieval step of {scan_obj} by {retry_after:.0f}s")
+			scan_obj.schedule_retrieve_step(retry_after)
+		else:
+			scan_obj.continue_retrieve()
+	finally:
+		Scan.release_leases(token)
+
+"""
+Rebuilds the findings index of a retrieved scan from its result, and compares the findings with those of the scan's previous run. Queued by Scan.chain_next_step() once a retrieval is committed.
+"""
+@app.task(name='ingest-scan-findings')
+@scan_lease_required
+def ingest_scan_findings(scan_pk):
+	scan_obj = Scan.objects.get(pk=scan_pk)
+	if scan_obj.status != Scan.RETRIEVED:
+		return
+	count = scan_obj.ingest_findings()
+	logger.info(f"Indexed {count} findings of {scan_obj}")
+	diff = ScanDiff.compute(scan_obj)
+	if diff is not None:
+		logger.info(f"Compared findings of {diff}")
+
+"""
+Queues a health probe of every scanner whose scanner type provides Scanner.probe(), one task per scanner, so that a scanner that is down doesn't hold up the probes of the others.
 """
-@app.task(name='manual-create-scan')
-def manual_create_scan(scan_pk):
-	Scan.objects.get(pk=scan_pk).create()
+@app.task(name='probe-all-scanners')
+def probe_all_scanners():
+	from django.contrib.contenttypes.models import ContentType
+	from dd_downloader import class_directory
+	scanner_classes = [classes['scanner'] for classes in class_directory.get_scanner_types().values() if classes['scanner'].can_probe()]
+	if not scanner_classes:
+		return
+	ctypes = ContentType.objects.get_for_models(*scanner_classes, for_concrete_models=False).values()
+	for scanner_pk in Scanner.objects.non_polymorphic().filter(polymorphic_ctype__in=ctypes).values_list('pk', flat=True):
+		probe_scanner.delay(scanner_pk)
 
-@app.task(name='manual-start-scan')
-def manual_start_scan(scan_pk):
-	Scan.objects.get(pk=scan_pk).start()
+"""
+Probes a scanner and stores its health snapshot (see health.probe_scanner).
+"""
+@app.task(name='probe-scanner')
+def probe_scanner(scanner_pk):
+	from dd_downloader import health
+	scanner_obj = Scanner.objects.filter(pk=scanner_pk).first()
+	if scanner_obj is None:
+		return
+	if not health.probe_scanner(scanner_obj):
+		logger.warning(f"Scanner {scanner_obj} is down")
+
+"""
+Deletes the records of deleted scans/scanners that are older than DeletedObject.DELETED_OBJECT_RETENTION.
+"""
+@app.task(name='prune-deleted-objects')
+def prune_deleted_objects():
+	from datetime import timedelta
+	from django.utils import timezone
+	DeletedObject.objects.filter(deleted_at__lt=timezone.now() - timedelta(seconds=DeletedObject.DELETED_OBJECT_RETENTION)).delete()
 
+"""
+Manual scan command tasks. Commands that need capacity on the scanner (create, start, retrieve) have no task of their own: they are queued on the scan (see Scan.queue_action), and run by process_scan once the scheduler releases them.
+"""
 @app.task(name='manual-pause-scan')
+@scan_lease_required
 def manual_pause_scan(scan_pk):
-	Scan.objects.get(pk=scan_pk).pause()
+	scan_obj = Scan.objects.get(pk=scan_pk)
+	if not deferred_for_circuit(manual_pause_scan, scan_obj):
+		scan_obj.pause()
 
 @app.task(name='manual-resume-scan')
+@scan_lease_required
 def manual_resume_scan(scan_pk):
-	Scan.objects.get(pk=scan_pk).resume()
+	scan_obj = Scan.objects.get(pk=scan_pk)
+	if not deferred_for_circuit(manual_resume_scan, scan_obj):
+		scan_obj.resume()
 
 @app.task(name='manual-stop-scan')
+@scan_lease_required
 def manual_stop_scan(scan_pk):
-	Scan.objects.get(pk=scan_pk).stop()
-
-@app.task(name='manual-retrieve-scan')
-def manual_retrieve_scan(scan_pk):
-	Scan.objects.get(pk=scan_pk).retrieve()
\ No newline at end of file
+	scan_obj = Scan.objects.get(pk=scan_pk)
+	if not deferred_for_circuit(manual_stop_scan, scan_obj):
+		scan_obj.stop()
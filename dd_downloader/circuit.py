@@ -0,0 +1,159 @@
+import time
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, When, F, Value
+from django.utils import timezone
+from .models import ScannerCircuit
+
+#Circuit breakers around the scanners' API calls (see ScannerCircuit), shared by every worker process through the database.
+#Calls to a scanner whose circuit is open fail at once with CircuitOpenError instead of waiting out their timeout, and the tasks that would have made them are rescheduled.
+import logging
+logger = logging.getLogger(__name__)
+
+#A closed circuit opens once at least FAILURE_RATE of the calls in its window have failed, over at least MIN_CALLS calls. Windows last WINDOW seconds.
+FAILURE_RATE = 0.5
+MIN_CALLS = 5
+WINDOW = 60
+#Bounds (in seconds) of the cooldown of an open circuit.
+COOLDOWN_MIN = 30
+COOLDOWN_MAX = 10 * 60
+#Time (in seconds) after which a trial call that never reported back (e.g. its worker died) is given up on, and another one is let through.
+TRIAL_TIMEOUT = 2 * 60
+#Time (in seconds) for which each process trusts its cached view of a closed circuit, so that calls to healthy scanners don't each read the shared state.
+CLOSED_CACHE_TTL = 1.0
+#Successful calls through closed circuits are counted in the current process, and written out along with the process's next failed call to the scanner, or at most FLUSH_INTERVAL seconds later, so that calls to healthy scanners don't each write the shared state.
+#Failed calls and trial calls are written at once, since they decide whether the circuit opens or closes.
+FLUSH_INTERVAL = 5.0
+
+class CircuitOpenError(Exception):
+	def __init__(self, scanner_pk, retry_after):
+		super().__init__(f"Circuit of scanner {scanner_pk} is open, retry in {retry_after:.0f}s")
+		self.scanner_pk = scanner_pk
+		self.retry_after = retry_after
+
+"""
+Cache of the circuits' states in the current process, as a dictionary of scanner PKs to (time.monotonic() until which the entry holds, whether the circuit is open). Open circuits are cached until their cooldown ends, so calls to a scanner that is down fail without a query.
+"""
+_cache = {}
+
+"""
+Successful calls counted in the current process that are yet to be written, as a dictionary of scanner PKs to [time.monotonic() of the first of them, their number].
+"""
+_pending = {}
+
+def cache_state(scanner_pk, is_open, duration):
+	_cache[scanner_pk] = (time.monotonic() + duration, is_open)
+
+"""
+Returns how many seconds to wait before calls to a scanner can go through, or None if they can go through now (including as the trial call of a circuit whose cooldown is over).
+"""
+def retry_after(scanner_pk):
+	cached = _cache.get(scanner_pk)
+	if cached is not None and cached[0] > time.monotonic():
+		return cached[0] - time.monotonic() if cached[1] else None
+	circuit_obj = ScannerCircuit.objects.filter(scanner_id=scanner_pk).first()
+	if circuit_obj is None or circuit_obj.state == ScannerCircuit.CLOSED:
+		cache_state(scanner_pk, False, CLOSED_CACHE_TTL)
+		return None
+	remaining = (circuit_obj.open_until - timezone.now()).total_seconds()
+	if remaining <= 0:
+		return None
+	cache_state(scanner_pk, True, remaining)
+	return remaining
+
+"""
+Checks a scanner's circuit before a call. Raises CircuitOpenError if the call may not go ahead. Returns True if the call is the trial call of a circuit whose cooldown is over, whose outcome decides whether the circuit closes again.
+"""
+def before_call(scanner_pk):
+	wait = retry_after(scanner_pk)
+	if wait is not None:
+		raise CircuitOpenError(scanner_pk, wait)
+	cached = _cache.get(scanner_pk)
+	if cached is not None and cached[0] > time.monotonic():
+		return False
+	#The cooldown is over: the first caller to claim the trial goes ahead, and the others wait for its outcome.
+	now = timezone.now()
+	claimed = ScannerCircuit.objects.exclude(state=ScannerCircuit.CLOSED).filter(scanner_id=scanner_pk, open_until__lte=now).update(
+		state=ScannerCircuit.HALF_OPEN, open_until=now + timedelta(seconds=TRIAL_TIMEOUT)
+	)
+	if not claimed:
+		raise CircuitOpenError(scanner_pk, COOLDOWN_MIN)
+	logger.info(f"Circuit of scanner {scanner_pk} is half-open, letting a trial call through")
+	return True
+
+"""
+Records the outcome of a call that before_call() let through. Calls that got no response, or a 5xx response, are failures.
+"""
+def record_call(scanner_pk, ok, trial=False):
+	now = timezone.now()
+	if trial:
+		finish_trial(scanner_pk, ok, now)
+		return
+	if ok:
+		entry = _pending.setdefault(scanner_pk, [time.monotonic(), 0])
+		entry[1] += 1
+		if time.monotonic() - entry[0] >= FLUSH_INTERVAL:
+			flush(scanner_pk)
+		return
+	entry = _pending.pop(scanner_pk, None)
+	count_calls(scanner_pk, 1 + (entry[1] if entry else 0), 1, now)
+	tripped = ScannerCircuit.objects.filter(
+		scanner_id=scanner_pk, state=ScannerCircuit.CLOSED, window_calls__gte=MIN_CALLS, window_failures__gte=F('window_calls') * FAILURE_RATE
+	).update(state=ScannerCircuit.OPEN, open_until=now + timedelta(seconds=COOLDOWN_MIN), cooldown=COOLDOWN_MIN)
+	if tripped:
+		logger.warning(f"Circuit of scanner {scanner_pk} opened for {COOLDOWN_MIN}s")
+		cache_state(scanner_pk, True, COOLDOWN_MIN)
+
+"""
+Adds calls to the window of a scanner's closed circuit, with a single UPDATE.
+"""
+def count_calls(scanner_pk, calls, failures, now):
+	expired = {'window_start__lt': now - timedelta(seconds=WINDOW)}
+	#The window is restarted with these calls once it has expired. Every Case is evaluated against the row as it was, so window_start is changed last.
+	updated = ScannerCircuit.objects.filter(scanner_id=scanner_pk, state=ScannerCircuit.CLOSED).update(
+		window_calls=Case(When(**expired, then=Value(calls)), default=F('window_calls') + calls),
+		window_failures=Case(When(**expired, then=Value(failures)), default=F('window_failures') + failures),
+		window_start=Case(When(**expired, then=Value(now)), default=F('window_start')),
+	)
+	if not updated:
+		ScannerCircuit.objects.get_or_create(scanner_id=scanner_pk, defaults={'window_start': now, 'window_calls': calls, 'window_failures': failures})
+
+"""
+Writes out the successful calls to a scanner that are pending in the current process.
+"""
+def flush(scanner_pk):
+	entry = _pending.pop(scanner_pk, None)
+	if entry is not None:
+		count_calls(scanner_pk, entry[1], 0, timezone.now())
+
+"""
+Writes out the pending successful calls that have waited for FLUSH_INTERVAL. Run after every Celery task, like health.flush_due().
+"""
+def flush_due():
+	for scanner_pk, entry in list(_pending.items()):
+		if time.monotonic() - entry[0] >= FLUSH_INTERVAL:
+			flush(scanner_pk)
+
+"""
+Closes a half-open circuit if its trial call succeeded, and reopens it for twice its last cooldown otherwise.
+"""
+def finish_trial(scanner_pk, ok, now):
+	if ok:
+		ScannerCircuit.objects.filter(scanner_id=scanner_pk, state=ScannerCircuit.HALF_OPEN).update(
+			state=ScannerCircuit.CLOSED, window_start=now, window_calls=0, window_failures=0, open_until=None
+		)
+		_cache.pop(scanner_pk, None)
+		logger.info(f"Circuit of scanner {scanner_pk} closed")
+		return
+	with transaction.atomic():
+		circuit_obj = ScannerCircuit.objects.select_for_update().get(scanner_id=scanner_pk)
+		cooldown = min(max(circuit_obj.cooldown * 2, COOLDOWN_MIN), COOLDOWN_MAX)
+		ScannerCircuit.objects.filter(scanner_id=scanner_pk).update(state=ScannerCircuit.OPEN, open_until=now + timedelta(seconds=cooldown), cooldown=cooldown)
+	logger.warning(f"Trial call to scanner {scanner_pk} failed, circuit reopened for {cooldown:.0f}s")
+	cache_state(scanner_pk, True, cooldown)
+
+"""
+Returns the circuits that are not closed, as a dictionary of scanner PKs to the end of their cooldown.
+"""
+def open_circuits():
+	return dict(ScannerCircuit.objects.exclude(state=ScannerCircuit.CLOSED).values_list('scanner_id', 'open_until'))
@@ -0,0 +1,247 @@
+import re
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from .models import Scan
+from .serializers import annotate_scanners
+
+#Helpers for the DataTables server-side processing protocol (https://datatables.net/manual/server-side).
+#The list pages send their paging, ordering and search state, which is translated into ORM queries, so only the visible page of rows is ever serialized.
+
+#Upper limit on the page size that a client can ask for.
+MAX_PAGE_LENGTH = 1000
+
+"""
+Mapping of DataTables column names (the "data" attribute of each column) to the model field that the column is ordered by.
+"""
+SCAN_ORDER_FIELDS = {
+	'PK': 'pk',
+	'Scan Name': 'scan_name',
+	'Status': 'status',
+	'Automation': 'auto_create',
+	'Parent Scanner': 'scanner__scanner_name',
+	'Created On': 'create_date',
+	'Started On': 'start_date',
+	'Ended On': 'end_date',
+}
+SCANNER_ORDER_FIELDS = {
+	'PK': 'pk',
+	'Scanner Name': 'scanner_name',
+	'# of Child Scans': 'scan_count',
+	'Health': 'health__reachable',
+	'Created On': 'create_date',
+}
+
+#Date range filters that the list pages send alongside the DataTables parameters, mapped to the field they filter.
+SCAN_DATE_FILTERS = {
+	'create_date': 'create_date',
+	'start_date': 'start_date',
+	'end_date': 'end_date',
+}
+SCANNER_DATE_FILTERS = {
+	'create_date': 'create_date',
+}
+
+"""
+Returns True if the request was sent by a DataTable in serverSide mode. Other requests get the full list, as before.
+"""
+def is_server_side(request):
+	return 'draw' in request.GET
+
+def parse_bool(value):
+	return str(value).lower() == 'true'
+
+"""
+Returns a Q object matching a text search against a field, either as a case-insensitive substring or as a case-insensitive regex. Returns None for an invalid regex, which matches nothing.
+"""
+def text_q(field, value, regex):
+	if regex:
+		try:
+			re.compile(value)
+		except re.error:
+			return None
+		return Q(**{f"{field}__iregex": value})
+	return Q(**{f"{field}__icontains": value})
+
+"""
+Returns a Q object matching a PK search. Only exact PKs can be searched for.
+"""
+def pk_q(value, field='pk'):
+	return Q(**{field: int(value)}) if value.strip().isdigit() else None
+
+"""
+Returns a Q object matching the scan statuses whose display names match the search.
+"""
+def status_q(value, regex):
+	if regex:
+		try:
+			pattern = re.compile(value, re.IGNORECASE)
+		except re.error:
+			return None
+		codes = [code for code, name in Scan.SCAN_STATUS_CHOICES if pattern.search(name)]
+	else:
+		codes = [code for code, name in Scan.SCAN_STATUS_CHOICES if value.lower() in name.lower()]
+	return Q(status__in=codes) if codes else None
+
+"""
+Returns a Q object matching the automation column, which is rendered as the letters C, S and R for auto_create, auto_start and auto_retrieve. Every letter in the search requires its flag to be set.
+"""
+def automation_q(value):
+	flags = {'C': 'auto_create', 'S': 'auto_start', 'R': 'auto_retrieve'}
+	q = Q()
+	for letter in value.upper():
+		if letter in flags:
+			q &= Q(**{flags[letter]: True})
+		elif not letter.isspace():
+			return None
+	return q
+
+"""
+Returns a Q object for a search on one scan column, or None if nothing can match.
+"""
+def scan_column_q(column, value, regex):
+	if column == 'PK':
+		return pk_q(value)
+	elif column == 'Scan Name':
+		return text_q('scan_name', value, regex)
+	elif column == 'Status':
+		return status_q(value, regex)
+	elif column == 'Automation':
+		return automation_q(value)
+	elif column == 'Parent Scanner':
+		return text_q('scanner__scanner_name', value, regex)
+	return Q()
+
+"""
+Returns a Q object for a search on one scanner column, or None if nothing can match.
+"""
+def scanner_column_q(column, value, regex):
+	if column == 'PK':
+		return pk_q(value)
+	elif column == 'Scanner Name':
+		return text_q('scanner_name', value, regex)
+	elif column == '# of Child Scans':
+		return pk_q(value, field='scan_count')
+	return Q()
+
+"""
+Returns a Q object for the global search box, which matches a row if any of the given columns matches.
+"""
+def global_q(column_q, columns, value, regex):
+	q = None
+	for column in columns:
+		column_match = column_q(column, value, regex)
+		if column_match is not None and column_match != Q():
+			q = column_match if q is None else (q | column_match)
+	return q
+
+"""
+Returns the conditions of the DataTables search parameters (global search, per-column searches) and the date range filters in "params". A condition of None matches nothing.
+"""
+def search_conditions(params, column_q, columns, date_filters):
+	conditions = []
+	search = params.get('search[value]', '')
+	if search:
+		conditions.append(global_q(column_q, columns, search, parse_bool(params.get('search[regex]'))))
+
+	i = 0
+	while f"columns[{i}][data]" in params:
+		value = params.get(f"columns[{i}][search][value]", '')
+		if value:
+			conditions.append(column_q(params[f"columns[{i}][data]"], value, parse_bool(params.get(f"columns[{i}][search][regex]"))))
+		i += 1
+
+	for name, field in date_filters.items():
+		start = parse_datetime(params.get(f"{name}_start", '') or '')
+		end = parse_datetime(params.get(f"{name}_end", '') or '')
+		if start is not None:
+			conditions.append(Q(**{f"{field}__gte": start}))
+		if end is not None:
+			conditions.append(Q(**{f"{field}__lte": end}))
+	return conditions
+
+"""
+Applies the DataTables search parameters and the date range filters in "params" to a queryset (see search_conditions).
+"""
+def apply_search(queryset, params, column_q, columns, date_filters):
+	for condition in search_conditions(params, column_q, columns, date_filters):
+		if condition is None:
+			return queryset.none()
+		queryset = queryset.filter(condition)
+	return queryset
+
+"""
+Applies the DataTables ordering parameters to a queryset. Rows are always ordered by PK last, so that paging is stable.
+"""
+def apply_order(queryset, params, order_fields):
+	ordering = []
+	i = 0
+	while f"order[{i}][column]" in params:
+		column = params.get(f"columns[{params[f'order[{i}][column]']}][data]")
+		field = order_fields.get(column)
+		if field is not None:
+			ordering.append(('-' if params.get(f"order[{i}][dir]") == 'desc' else '') + field)
+		i += 1
+	if 'pk' not in ordering and '-pk' not in ordering:
+		ordering.append('pk')
+	return queryset.order_by(*ordering)
+
+"""
+Applies the DataTables paging parameters to a queryset.
+"""
+def apply_paging(queryset, params):
+	try:
+		start = max(int(params.get('start', 0)), 0)
+		length = int(params.get('length', 10))
+	except ValueError:
+		start, length = 0, 10
+	if length < 0 or length > MAX_PAGE_LENGTH:
+		length = MAX_PAGE_LENGTH
+	return queryset[start:start + length]
+
+"""
+Runs a DataTables server-side request against a queryset. Returns the page of rows to serialize, and the response fields that DataTables expects alongside the data.
+"""
+def process(params, queryset, column_q, columns, order_fields, date_filters):
+	filtered = apply_search(queryset, params, column_q, columns, date_filters)
+	page = apply_paging(apply_order(filtered, params, order_fields), params)
+	try:
+		draw = int(params.get('draw', 0))
+	except ValueError:
+		draw = 0
+	return page, {
+		'draw': draw,
+		'recordsTotal': queryset.count(),
+		'recordsFiltered': filtered.count(),
+	}
+
+def process_scans(params, queryset):
+	queryset = queryset.non_polymorphic()
+	return process(params, queryset, scan_column_q, SCAN_ORDER_FIELDS.keys(), SCAN_ORDER_FIELDS, SCAN_DATE_FILTERS)
+
+def process_scanners(params, queryset):
+	queryset = annotate_scanners(queryset)
+	return process(params, queryset, scanner_column_q, SCANNER_ORDER_FIELDS.keys(), SCANNER_ORDER_FIELDS, SCANNER_DATE_FILTERS)
+
+"""
+Returns the scans matched by the filters of a scan list page: its search parameters and date range filters, as sent with its last DataTables request, and "scanner" on a scanner's page. Ordering and paging are ignored.
+Batch actions use this to target an entire filtered view, however many of its rows the browser has loaded.
+"""
+def filter_scans(params, queryset):
+	scanner_pk = params.get('scanner', '')
+	if scanner_pk:
+		if not scanner_pk.isdigit():
+			return queryset.none()
+		queryset = queryset.filter(scanner_id=int(scanner_pk))
+	return apply_search(queryset, params, scan_column_q, SCAN_ORDER_FIELDS.keys(), SCAN_DATE_FILTERS)
+
+def filter_scanners(params, queryset):
+	return apply_search(annotate_scanners(queryset), params, scanner_column_q, SCANNER_ORDER_FIELDS.keys(), SCANNER_DATE_FILTERS)
+
+"""
+Whether the filters of a list page narrow down its rows at all, i.e. whether filter_scans() or filter_scanners() would return anything less than the whole queryset.
+"""
+def has_scan_filters(params):
+	return bool(params.get('scanner', '')) or bool(search_conditions(params, scan_column_q, SCAN_ORDER_FIELDS.keys(), SCAN_DATE_FILTERS))
+
+def has_scanner_filters(params):
+	return bool(search_conditions(params, scanner_column_q, SCANNER_ORDER_FIELDS.keys(), SCANNER_DATE_FILTERS))
@@ -0,0 +1,151 @@
+import json, threading, collections
+from django.conf import settings
+from django.db import transaction
+
+#Publish/subscribe channel for scan status events, which are pushed to browsers through the server-sent event stream (views.event_stream_endpoint).
+#In production events go through Redis, so that transitions made by Celery workers reach every web process. The in-memory broker is a stand-in for tests and single-process deployments.
+import logging
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'dd_downloader:events'
+
+class MemoryBroker:
+	"""Keeps the latest events of this process in a ring buffer. Subscribers wait on a condition for events newer than the last one they have seen."""
+	def __init__(self, buffer_size: int = 1000):
+		self.condition = threading.Condition()
+		self.events = collections.deque(maxlen=buffer_size)
+		self.last_id = 0
+
+	def publish(self, event: dict):
+		with self.condition:
+			self.last_id += 1
+			self.events.append((self.last_id, event))
+			self.condition.notify_all()
+
+	def subscribe(self):
+		return MemorySubscription(self)
+
+class MemorySubscription:
+	def __init__(self, broker: MemoryBroker):
+		self.broker = broker
+		self.position = broker.last_id
+
+	#Returns the events published since the last call, waiting up to "timeout" seconds for one.
+	def get(self, timeout: float):
+		with self.broker.condition:
+			if self.broker.last_id == self.position:
+				self.broker.condition.wait(timeout)
+			events = [event for event_id, event in self.broker.events if event_id > self.position]
+			self.position = self.broker.last_id
+		return events
+
+	def close(self):
+		pass
+
+class RedisBroker:
+	def __init__(self, url: str):
+		import redis
+		self.client = redis.Redis.from_url(url)
+
+	def publish(self, event: dict):
+		self.client.publish(CHANNEL, json.dumps(event))
+
+	def subscribe(self):
+		return RedisSubscription(self.client)
+
+class RedisSubscription:
+	def __init__(self, client):
+		self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+		self.pubsub.subscribe(CHANNEL)
+
+	#Returns the events published since the last call, waiting up to "timeout" seconds for one.
+	def get(self, timeout: float):
+		events = []
+		message = self.pubsub.get_message(timeout=timeout)
+		while message is not None:
+			events.append(json.loads(message['data']))
+			message = self.pubsub.get_message()
+		return events
+
+	def close(self):
+		self.pubsub.close()
+
+_broker = None
+_broker_config = None
+_broker_lock = threading.Lock()
+
+"""
+Returns the broker configured by the EVENT_BACKEND ('redis' or 'memory') and EVENT_REDIS_URL settings. Falls back to the in-memory broker if the redis package is not installed.
+"""
+def get_broker():
+	global _broker, _broker_config
+	config = (getattr(settings, 'EVENT_BACKEND', 'memory'), getattr(settings, 'EVENT_REDIS_URL', None))
+	with _broker_lock:
+		if _broker is None or _broker_config != config:
+			if config[0] == 'redis':
+				try:
+					_broker = RedisBroker(config[1])
+				except ImportError:
+					logger.warning('EVENT_BACKEND is redis but the redis package is not installed, falling back to in-memory events: event streams will only see events published by their own process')
+					_broker = MemoryBroker()
+			else:
+				_broker = MemoryBroker()
+			_broker_config = config
+		return _broker
+
+"""
+Publishes an event. Events are best-effort: a failure to publish is logged, and never interrupts the scan lifecycle.
+"""
+def publish(event: dict):
+	try:
+		get_broker().publish(event)
+	except Exception as e:
+		logger.exception('Publishing event failed')
+
+"""
+Whether an event concerns the given scan and scanner, either of which may be None to match any. Events about several scans list them under "pks", and their scanners under "scanner_pks".
+"""
+def event_matches(event: dict, scan_pk, scanner_pk):
+	if scan_pk is not None and scan_pk not in event.get('pks', [event.get('pk')]):
+		return False
+	if scanner_pk is not None and scanner_pk not in event.get('scanner_pks', [event.get('scanner_pk')]):
+		return False
+	return True
+
+def scan_event(scan, deleted: bool = False):
+	return {
+		'type': 'deleted' if deleted else 'status',
+		'pk': scan.pk,
+		'scanner_pk': scan.scanner_id,
+		'status': scan.status,
+	}
+
+"""
+Publishes a scan's current status once the current transaction (if any) commits, so that subscribers never see a change that was rolled back.
+"""
+def publish_scan(scan, deleted: bool = False):
+	event = scan_event(scan, deleted)
+	transaction.on_commit(lambda: publish(event))
+
+"""
+Publishes the creation of scans that were inserted without being saved one at a time (see bulk.bulk_insert_scans), once the current transaction commits.
+Bulk inserts don't send post_save, so a single event per scanner stands in for the status events of its new scans.
+"""
+def publish_created(scanner_pk, scan_pks):
+	event = {
+		'type': 'created',
+		'scanner_pk': scanner_pk,
+		'pks': list(scan_pks),
+	}
+	transaction.on_commit(lambda: publish(event))
+
+"""
+Publishes the deletion of scans that were deleted without sending post_delete (see bulk.delete_scans) as a single event, once the current transaction commits. Takes (scan PK, scanner PK) tuples.
+"""
+def publish_deleted(scans):
+	event = {
+		'type': 'deleted',
+		'pks': [scan_pk for scan_pk, scanner_pk in scans],
+		'scanner_pks': sorted({scanner_pk for scan_pk, scanner_pk in scans}),
+	}
+	transaction.on_commit(lambda: publish(event))
@@ -0,0 +1,95 @@
+import json
+
+#Helpers for parsing large documents as streams, such as retrieved results in the scanner_types modules' Scan.parse_findings().
+
+#Size of the chunks (in characters) in which results are read.
+READ_SIZE = 64 * 1024
+
+"""
+Yields the elements of the JSON array stored under "key" in a JSON document, one at a time, while reading the document from a text stream in chunks. Only one element is held in memory at a time, however long the array is.
+The array is located by the first occurrence of the key, so this is meant for documents where the key is not expected to appear in any earlier value (e.g. "issue_events" in a Burp Suite scan result). Yields nothing if the key is missing.
+With no key, the document itself should be the array.
+"""
+def iter_json_array(stream, key=None):
+	decoder = json.JSONDecoder()
+	marker = json.dumps(key) if key is not None else None
+	buffer = ''
+	eof = False
+
+	def read():
+		nonlocal buffer, eof
+		chunk = stream.read(READ_SIZE)
+		if not chunk:
+			eof = True
+		buffer += chunk
+
+	#Find the opening bracket of the array.
+	while key is None:
+		rest = buffer.lstrip()
+		if rest.startswith('['):
+			buffer = rest[1:]
+			break
+		if rest or eof:
+			raise json.JSONDecodeError("Expecting '['", rest, 0)
+		read()
+	while key is not None:
+		index = buffer.find(marker)
+		if index >= 0:
+			rest = buffer[index + len(marker):].lstrip()
+			if rest.startswith(':'):
+				rest = rest[1:].lstrip()
+				if rest.startswith('['):
+					buffer = rest[1:]
+					break
+				if rest or eof:
+					return
+			elif rest or eof:
+				#The key appeared as a value; keep looking after it.
+				buffer = buffer[index + len(marker):]
+				continue
+		elif eof:
+			return
+		else:
+			#Keep enough of the buffer to match a key split across chunks.
+			buffer = buffer[-len(marker):]
+		read()
+
+	while True:
+		buffer = buffer.lstrip().lstrip(',').lstrip()
+		if buffer.startswith(']'):
+			return
+		try:
+			element, end = decoder.raw_decode(buffer)
+		except json.JSONDecodeError:
+			if eof:
+				raise
+			read()
+			continue
+		yield element
+		buffer = buffer[end:]
+
+#Changes between the findings of two results, as reported by merge_findings().
+NEW			= 'N'
+RESOLVED	= 'R'
+UNCHANGED	= 'U'
+
+"""
+Matches the findings of a previous and a current result in a single merge pass. Both iterables must yield rows sorted by hash key, which must be the first item of each row.
+Yields a tuple of the change (NEW, RESOLVED or UNCHANGED) and the row: the current row for new and unchanged findings, the previous row for resolved ones. Only one row of each side is held in memory at a time.
+"""
+def merge_findings(previous, current):
+	previous = iter(previous)
+	current = iter(current)
+	previous_row = next(previous, None)
+	current_row = next(current, None)
+	while previous_row is not None or current_row is not None:
+		if current_row is None or (previous_row is not None and previous_row[0] < current_row[0]):
+			yield RESOLVED, previous_row
+			previous_row = next(previous, None)
+		elif previous_row is None or current_row[0] < previous_row[0]:
+			yield NEW, current_row
+			current_row = next(current, None)
+		else:
+			yield UNCHANGED, current_row
+			previous_row = next(previous, None)
+			current_row = next(current, None)
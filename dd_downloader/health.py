@@ -0,0 +1,126 @@
+import time
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.utils import timezone
+from .models import ScannerHealth
+
+#Recording of the health of the scanners' APIs (see ScannerHealth): the Transport records every call, and the periodic health probe keeps a snapshot of each scanning tool's state.
+import logging
+logger = logging.getLogger(__name__)
+
+#Successful calls are recorded in the current process and written out at most every FLUSH_INTERVAL seconds per scanner, so that API calls don't each write their scanner's health row.
+#Failures, and the first success of a scanner that has none recorded or has failures, are written at once, since they decide whether the scanner is reachable.
+FLUSH_INTERVAL = 5.0
+
+"""
+Successful calls recorded in the current process that are yet to be written, as a dictionary of scanner PKs to [time.monotonic() of the first of them, their latencies in order, the time of the last of them].
+"""
+_pending = {}
+
+"""
+Updates a scanner's health row with a single UPDATE, creating the row on the scanner's first call.
+"""
+def update_health(scanner_pk, defaults, **fields):
+	if not ScannerHealth.objects.filter(scanner_id=scanner_pk).update(**fields):
+		_, created = ScannerHealth.objects.get_or_create(scanner_id=scanner_pk, defaults=defaults)
+		if not created:
+			ScannerHealth.objects.filter(scanner_id=scanner_pk).update(**fields)
+
+"""
+Records a call that got a response from the scanner (whatever its status code), and took "latency" seconds.
+"""
+def record_success(scanner_pk, latency):
+	entry = _pending.get(scanner_pk)
+	if entry is None:
+		entry = _pending[scanner_pk] = [time.monotonic(), [], None]
+		urgent = not ScannerHealth.objects.filter(scanner_id=scanner_pk, consecutive_failures=0).exists()
+	else:
+		urgent = False
+	entry[1].append(latency)
+	entry[2] = timezone.now()
+	if urgent or time.monotonic() - entry[0] >= FLUSH_INTERVAL:
+		flush(scanner_pk)
+
+"""
+Writes out the successful calls to a scanner that are pending in the current process, with a single UPDATE. The latencies are folded into the moving average in the order they were recorded, as if each had been written on its own.
+"""
+def flush(scanner_pk):
+	entry = _pending.pop(scanner_pk, None)
+	if entry is None:
+		return
+	_, latencies, last_success_at = entry
+	weight = ScannerHealth.LATENCY_WEIGHT
+	decay = (1 - weight) ** len(latencies)
+	recent = sum(latency * weight * (1 - weight) ** (len(latencies) - 1 - i) for i, latency in enumerate(latencies))
+	update_health(
+		scanner_pk,
+		{'latency': latencies[0] * decay + recent, 'last_success_at': last_success_at},
+		latency=Coalesce(F('latency'), Value(latencies[0])) * decay + Value(recent),
+		consecutive_failures=0,
+		last_success_at=last_success_at,
+	)
+
+"""
+Writes out the pending successful calls that have waited for FLUSH_INTERVAL. Run after every Celery task, so that workers that go idle don't hold on to them.
+"""
+def flush_due():
+	for scanner_pk, entry in list(_pending.items()):
+		if time.monotonic() - entry[0] >= FLUSH_INTERVAL:
+			flush(scanner_pk)
+
+"""
+Records a call that failed to reach the scanner (a connection error or a timeout).
+"""
+def record_failure(scanner_pk):
+	#Earlier successes are written first, so that they don't clear this failure.
+	flush(scanner_pk)
+	now = timezone.now()
+	update_health(
+		scanner_pk,
+		{'consecutive_failures': 1, 'last_failure_at': now},
+		consecutive_failures=F('consecutive_failures') + 1,
+		last_failure_at=now,
+	)
+	logger.warning(f"Call to scanner {scanner_pk} failed to reach it")
+
+"""
+Returns the p-th percentile (0 to 100) of a non-empty list of samples, by the nearest-rank method.
+"""
+def percentile(samples, p):
+	import math
+	ranked = sorted(samples)
+	return ranked[max(math.ceil(p / 100 * len(ranked)), 1) - 1]
+
+"""
+Probes a scanner (see Scanner.probe) and stores the result as its health snapshot. Returns whether the scanner is up.
+The scanner's updated_at is bumped when it goes up or down, so that the scanner lists pick up the change.
+"""
+def probe_scanner(scanner_obj):
+	import json
+	from .models import Scanner
+	now = timezone.now()
+	ScannerHealth.objects.get_or_create(scanner_id=scanner_obj.pk)
+	try:
+		report = scanner_obj.probe()
+	except Exception as e:
+		logger.warning(f"Health probe of scanner {scanner_obj.pk} failed: {e}")
+		fields = {'reachable': False, 'probe_error': str(e)[:200]}
+	else:
+		fields = {
+			'reachable': True,
+			'probe_error': '',
+			'running_scans': report.get('running_scans', scanner_obj.running_scan_count()),
+			'licence_limit': report.get('licence_limit'),
+			'licence_expires': report.get('licence_expires'),
+		}
+	with transaction.atomic():
+		snapshot = ScannerHealth.objects.select_for_update().get(scanner_id=scanner_obj.pk)
+		changed = snapshot.reachable != fields['reachable']
+		if fields['reachable']:
+			samples = json.loads(snapshot.latency_samples)[-(ScannerHealth.PROBE_LATENCY_WINDOW - 1):] + [report['latency']]
+			fields.update(latency_samples=json.dumps(samples), latency_p50=percentile(samples, 50), latency_p95=percentile(samples, 95))
+		ScannerHealth.objects.filter(scanner_id=scanner_obj.pk).update(probed_at=now, **fields)
+		if changed:
+			Scanner.objects.non_polymorphic().filter(pk=scanner_obj.pk).update(updated_at=now)
+	return fields['reachable']
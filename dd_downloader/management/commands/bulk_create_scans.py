@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from dd_downloader import bulk
+
+class Command(BaseCommand):
+	help = "Creates scans in bulk from a CSV or JSON file. Each row names its scanner (by PK or name) under \"scanner\", and gives the fields of the scanner type's scan creation form (e.g. scan_name, endpoints, auto_create, auto_start, auto_retrieve)."
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help='CSV file with a header row, or JSON file holding an array of objects.')
+		parser.add_argument('--format', choices=bulk.FORMATS, help='Format of the file. Guessed from its extension by default.')
+		parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE, help='Number of rows inserted per transaction.')
+
+	def handle(self, *args, **options):
+		fmt = options['format'] or bulk.guess_format(options['path'])
+		if fmt is None:
+			raise CommandError('Could not guess the format of the file, use --format.')
+		try:
+			with open(options['path'], encoding='utf-8', newline='') as stream:
+				result = bulk.create_scans(bulk.iter_rows(stream, fmt), options['chunk_size'])
+		except OSError as e:
+			raise CommandError(f"Could not read {options['path']}: {e}")
+		for row_number, message in result.errors:
+			self.stderr.write(f"Row {row_number}: {message}")
+		if result.error_count > len(result.errors):
+			self.stderr.write(f"... and {result.error_count - len(result.errors)} more invalid rows")
+		if result.parse_error:
+			self.stderr.write(f"Stopped reading the file: {result.parse_error}")
+		self.stdout.write(f"Created {result.created} scans, {result.error_count} rows were invalid.")
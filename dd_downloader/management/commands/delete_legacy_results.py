@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from dd_downloader.models import Scan
+
+class Command(BaseCommand):
+	help = "Deletes the uncompressed result files that were kept when results were moved to compressed blobs. Run once the migrations have succeeded."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help='List the files that would be deleted, without deleting them.')
+
+	def handle(self, *args, **options):
+		deleted = 0
+		kept = 0
+		for scan_obj in Scan.objects.non_polymorphic().exclude(legacy_result='').only('pk', 'result', 'legacy_result').iterator():
+			storage = scan_obj.legacy_result.storage
+			name = scan_obj.legacy_result.name
+			#Files that exist but never made it into a blob are left alone.
+			if scan_obj.result_id is None and storage.exists(name):
+				self.stderr.write(f"Scan {scan_obj.pk}: {name} has no blob, keeping it")
+				kept += 1
+				continue
+			if options['dry_run']:
+				self.stdout.write(f"Scan {scan_obj.pk}: would delete {name}")
+				continue
+			storage.delete(name)
+			Scan._base_manager.filter(pk=scan_obj.pk).update(legacy_result='')
+			deleted += 1
+		self.stdout.write(f"Deleted {deleted} legacy result files, kept {kept}.")
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['status', 'auto_create', 'auto_start', 'auto_retrieve'], name='scan_status_auto_idx'),
+        ),
+    ]
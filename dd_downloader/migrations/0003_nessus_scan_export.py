@@ -0,0 +1,28 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0002_scan_status_auto_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nessus_scan',
+            name='export_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='nessus_scan',
+            name='export_step',
+            field=models.CharField(blank=True, choices=[('ES', 'Waiting for export'), ('ED', 'Downloading export')], default=None, max_length=2, null=True),
+        ),
+        migrations.AddField(
+            model_name='nessus_scan',
+            name='export_token',
+            field=models.CharField(blank=True, default=None, max_length=200, null=True),
+        ),
+    ]
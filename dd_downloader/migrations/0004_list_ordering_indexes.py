@@ -0,0 +1,33 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0003_nessus_scan_export'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scan',
+            name='create_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Date Created'),
+        ),
+        migrations.AlterField(
+            model_name='scan',
+            name='end_date',
+            field=models.DateTimeField(db_index=True, null=True, verbose_name='Date Ended'),
+        ),
+        migrations.AlterField(
+            model_name='scan',
+            name='start_date',
+            field=models.DateTimeField(db_index=True, null=True, verbose_name='Date Started'),
+        ),
+        migrations.AlterField(
+            model_name='scanner',
+            name='create_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Date Created'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0004_list_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(choices=[('scan', 'Scan'), ('scanner', 'Scanner')], max_length=20)),
+                ('object_pk', models.IntegerField()),
+                ('scanner_pk', models.IntegerField(default=None, null=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Date Updated'),
+        ),
+        migrations.AddField(
+            model_name='scanner',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Date Updated'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0005_updated_at_and_deleted_objects'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='lease_token',
+            field=models.CharField(blank=True, default=None, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:33
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0006_scan_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScannerThrottle',
+            fields=[
+                ('scanner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='throttle', serialize=False, to='dd_downloader.Scanner')),
+                ('tokens', models.FloatField(default=0)),
+                ('refilled_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='priority',
+            field=models.SmallIntegerField(choices=[(0, 'Low'), (1, 'Normal'), (2, 'High')], default=1, verbose_name='Priority'),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='queued_action',
+            field=models.CharField(blank=True, choices=[('CR', 'Create'), ('ST', 'Start'), ('RT', 'Retrieve')], default=None, max_length=2, null=True),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanner',
+            name='max_concurrent_calls',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Maximum concurrent API calls (optional)'),
+        ),
+        migrations.AddField(
+            model_name='scanner',
+            name='max_running_scans',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Maximum running scans (optional)'),
+        ),
+        migrations.AddField(
+            model_name='scanner',
+            name='requests_per_second',
+            field=models.FloatField(blank=True, default=None, null=True, validators=[django.core.validators.MinValueValidator(0.01)], verbose_name='Maximum API requests per second (optional)'),
+        ),
+        migrations.CreateModel(
+            name='ScannerCall',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('scanner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dd_downloader.Scanner')),
+            ],
+        ),
+    ]
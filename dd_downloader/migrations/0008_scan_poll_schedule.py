@@ -0,0 +1,27 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0007_scanner_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='progress',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['status', 'next_poll_at'], name='scan_status_poll_idx'),
+        ),
+    ]
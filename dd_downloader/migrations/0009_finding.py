@@ -0,0 +1,46 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0008_scan_poll_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Finding',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=255)),
+                ('port', models.PositiveIntegerField(default=None, null=True)),
+                ('protocol', models.CharField(blank=True, max_length=10)),
+                ('plugin_id', models.CharField(max_length=100)),
+                ('name', models.CharField(blank=True, max_length=500)),
+                ('path', models.CharField(blank=True, max_length=1000)),
+                ('cve', models.CharField(blank=True, max_length=50)),
+                ('severity', models.SmallIntegerField(choices=[(0, 'Info'), (1, 'Low'), (2, 'Medium'), (3, 'High'), (4, 'Critical')], default=0)),
+                ('hash_key', models.CharField(max_length=64)),
+                ('scan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='findings', to='dd_downloader.Scan')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['plugin_id', 'host'], name='finding_plugin_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['host', 'port'], name='finding_host_port_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['cve'], name='finding_cve_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['scan', 'hash_key'], name='finding_scan_hash_idx'),
+        ),
+    ]
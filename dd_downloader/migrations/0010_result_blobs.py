@@ -0,0 +1,96 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:42
+
+import django.core.files.storage
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_results_to_blobs(apps, schema_editor):
+    """
+    Compresses the existing result files into content-addressed blobs. The uncompressed files are kept, under Scan.legacy_result, so that nothing is lost if the migration fails after this step. They are deleted by the delete_legacy_results command once the migration has succeeded.
+    """
+    import gzip, hashlib
+    from django.core.files.uploadedfile import TemporaryUploadedFile
+    Scan = apps.get_model('dd_downloader', 'Scan')
+    ResultBlob = apps.get_model('dd_downloader', 'ResultBlob')
+    for scan in Scan.objects.exclude(result='').exclude(result__isnull=True).iterator():
+        storage = scan.result.storage
+        if not storage.exists(scan.result.name):
+            continue
+        digest = hashlib.sha256()
+        size = 0
+        with TemporaryUploadedFile('result.gz', 'application/gzip', 0, None) as temp_file:
+            with storage.open(scan.result.name, 'rb') as src, gzip.GzipFile(fileobj=temp_file, mode='wb', mtime=0) as gzip_file:
+                for chunk in src.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    gzip_file.write(chunk)
+            temp_file.flush()
+            temp_file.size = temp_file.tell()
+            temp_file.seek(0)
+            sha256 = digest.hexdigest()
+            blob = ResultBlob.objects.filter(sha256=sha256).first()
+            if blob is None:
+                blob = ResultBlob(sha256=sha256, size=size, ref_count=0)
+                blob.file.save(f"results/{sha256[:2]}/{sha256}.gz", temp_file, save=False)
+                blob.save()
+        ResultBlob.objects.filter(pk=blob.pk).update(ref_count=models.F('ref_count') + 1)
+        Scan.objects.filter(pk=scan.pk).update(result_blob=blob)
+
+
+def restore_result_files(apps, schema_editor):
+    """
+    Points the scans back at their uncompressed result files, writing the files out again from their blobs where delete_legacy_results has deleted them already.
+    """
+    import gzip
+    from django.core.files import File
+    Scan = apps.get_model('dd_downloader', 'Scan')
+    for scan in Scan.objects.exclude(result_blob__isnull=True).select_related('result_blob').iterator():
+        storage = scan.result.storage
+        if scan.result and storage.exists(scan.result.name):
+            continue
+        with scan.result_blob.file.open('rb') as src, gzip.GzipFile(fileobj=src, mode='rb') as gzip_file:
+            name = storage.save(scan.result.name or f"result_{scan.pk}", File(gzip_file))
+        Scan.objects.filter(pk=scan.pk).update(result=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0009_finding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(storage=django.core.files.storage.FileSystemStorage(), upload_to='')),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='Date Created')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='result_blob',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='dd_downloader.ResultBlob', verbose_name='Scan Result'),
+        ),
+        migrations.RunPython(move_results_to_blobs, restore_result_files),
+        migrations.RenameField(
+            model_name='scan',
+            old_name='result',
+            new_name='legacy_result',
+        ),
+        migrations.AlterField(
+            model_name='scan',
+            name='legacy_result',
+            field=models.FileField(blank=True, storage=django.core.files.storage.FileSystemStorage(), upload_to='', verbose_name='Legacy Scan Result'),
+        ),
+        migrations.RenameField(
+            model_name='scan',
+            old_name='result_blob',
+            new_name='result',
+        ),
+    ]
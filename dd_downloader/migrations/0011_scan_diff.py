@@ -0,0 +1,27 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0010_result_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanDiff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('new_count', models.PositiveIntegerField(default=0)),
+                ('resolved_count', models.PositiveIntegerField(default=0)),
+                ('unchanged_count', models.PositiveIntegerField(default=0)),
+                ('compute_date', models.DateTimeField(auto_now=True, verbose_name='Date Computed')),
+                ('changes', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='dd_downloader.ResultBlob')),
+                ('previous_scan', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dd_downloader.Scan')),
+                ('scan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='diff', to='dd_downloader.Scan')),
+            ],
+        ),
+    ]
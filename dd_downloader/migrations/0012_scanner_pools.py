@@ -0,0 +1,43 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0011_scan_diff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScannerHealth',
+            fields=[
+                ('scanner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='health', serialize=False, to='dd_downloader.Scanner')),
+                ('latency', models.FloatField(default=None, null=True)),
+                ('consecutive_failures', models.IntegerField(default=0)),
+                ('last_success_at', models.DateTimeField(default=None, null=True)),
+                ('last_failure_at', models.DateTimeField(default=None, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScannerPool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pool_name', models.CharField(max_length=200, unique=True, verbose_name='Pool Name')),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='Date Created')),
+                ('notes', models.TextField(blank=True, verbose_name='Notes (optional)')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='pool',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scans', to='dd_downloader.ScannerPool', verbose_name='Run on any scanner of pool (optional)'),
+        ),
+        migrations.AddField(
+            model_name='scanner',
+            name='pool',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='dd_downloader.ScannerPool', verbose_name='Pool (optional)'),
+        ),
+    ]
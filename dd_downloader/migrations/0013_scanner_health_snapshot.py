@@ -0,0 +1,58 @@
+# Generated by Django 2.2.24 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0012_scanner_pools'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='latency_p50',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='latency_p95',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='latency_samples',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='licence_expires',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='licence_limit',
+            field=models.IntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='probe_error',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='probed_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='reachable',
+            field=models.BooleanField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scannerhealth',
+            name='running_scans',
+            field=models.IntegerField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0013_scanner_health_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScannerCircuit',
+            fields=[
+                ('scanner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='circuit', serialize=False, to='dd_downloader.Scanner')),
+                ('state', models.CharField(choices=[('CL', 'Closed'), ('OP', 'Open'), ('HO', 'Half-open')], default='CL', max_length=2)),
+                ('window_start', models.DateTimeField()),
+                ('window_calls', models.IntegerField(default=0)),
+                ('window_failures', models.IntegerField(default=0)),
+                ('open_until', models.DateTimeField(default=None, null=True)),
+                ('cooldown', models.FloatField(default=0)),
+            ],
+        ),
+    ]
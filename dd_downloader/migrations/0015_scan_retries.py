@@ -0,0 +1,23 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0014_scanner_circuits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='retry_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+def split_stopped_scans(apps, schema_editor):
+    """
+    STOPPED used to share the code 'ST' with STARTING. STARTING is only held by a task that has the scan's lease, so 'ST' scans without a live lease are stopped scans (or starts whose worker died, which would otherwise hold a running slot forever).
+    """
+    from django.db.models import Q
+    from django.utils import timezone
+    Scan = apps.get_model('dd_downloader', 'Scan')
+    Scan.objects.filter(Q(lease_expires__isnull=True) | Q(lease_expires__lte=timezone.now()), status='ST').update(status='SP')
+
+
+def merge_stopped_scans(apps, schema_editor):
+    Scan = apps.get_model('dd_downloader', 'Scan')
+    Scan.objects.filter(status='SP').update(status='ST')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0015_scan_retries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scan',
+            name='status',
+            field=models.CharField(choices=[('NW', 'New'), ('CR', 'Creating'), ('CD', 'Created'), ('ST', 'Starting'), ('IP', 'In progress'), ('PD', 'Paused'), ('SP', 'Stopped'), ('FI', 'Finished'), ('RG', 'Retrieving'), ('RD', 'Retrieved'), ('ER', 'Error occurred')], default='NW', max_length=2),
+        ),
+        migrations.RunPython(split_stopped_scans, merge_stopped_scans),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0016_scan_stopped_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='retrieve_step_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
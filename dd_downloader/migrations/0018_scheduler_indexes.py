@@ -0,0 +1,21 @@
+# Generated by Django 2.2.24 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dd_downloader', '0017_scan_retrieve_step_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['queued_action'], name='scan_queued_action_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['status', 'retrieve_step_at'], name='scan_status_step_idx'),
+        ),
+    ]
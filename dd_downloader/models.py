@@ -1,7 +1,8 @@
 from django.db import models
 from polymorphic.models import PolymorphicModel
 from django.core.files.storage import FileSystemStorage
-from django.core.validators import RegexValidator
+from django.core.validators import RegexValidator, MinValueValidator
+from contextlib import contextmanager
 
 """
 Base Scanner/Scan classes
@@ -10,9 +11,21 @@ class Scanner(PolymorphicModel):
 	#Custom name for this scanner.
 	scanner_name = models.CharField('Scanner Name',max_length=200, unique=True)
 	#Date when the scanner was initially created.
-	create_date = models.DateTimeField('Date Created', auto_now_add=True)
+	create_date = models.DateTimeField('Date Created', auto_now_add=True, db_index=True)
+	#Date when the scanner was last changed. Used by the list endpoints to only send what changed since a client's last request.
+	updated_at = models.DateTimeField('Date Updated', auto_now=True, db_index=True)
 	#Any notes that the user may wish to add
 	notes = models.TextField('Notes (optional)',blank=True)
+
+	#Limits on the work sent to the scanning tool. Empty limits are unlimited.
+	#Maximum number of this scanner's scans running on the scanning tool at once (see Scan.RUNNING_STATUSES). Scans over the limit stay queued until a running scan finishes.
+	max_running_scans = models.PositiveIntegerField('Maximum running scans (optional)',null=True,blank=True,default=None,validators=[MinValueValidator(1)])
+	#Maximum number of API calls in flight to the scanning tool at once, across all workers.
+	max_concurrent_calls = models.PositiveIntegerField('Maximum concurrent API calls (optional)',null=True,blank=True,default=None,validators=[MinValueValidator(1)])
+	#Maximum rate of API calls to the scanning tool, across all workers.
+	requests_per_second = models.FloatField('Maximum API requests per second (optional)',null=True,blank=True,default=None,validators=[MinValueValidator(0.01)])
+	#Pool of interchangeable scanners that this scanner belongs to, if any (see ScannerPool).
+	pool = models.ForeignKey('ScannerPool', verbose_name='Pool (optional)', null=True, blank=True, default=None, on_delete=models.SET_NULL, related_name='members')
 	
 	"""
 	Should return the filepath to the template HTML file for the scanner's detail page. The root of the path is "<root directory>/dd_downloader/templates/"
@@ -39,6 +52,54 @@ class Scanner(PolymorphicModel):
 	def get_scan_create_form_class():
 		raise NotImplementedError
 	"""
+	Optional batch hook for polling many of this scanner's IN_PROGRESS scans at once, e.g. with a single status listing request instead of one request per scan. It receives a list of this scanner's scans, and should update each of them the same way that Scan.poll() would.
+	Scanner types that do not override this are polled one scan at a time through Scan.poll().
+	"""
+	def poll_many(self, scan_list):
+		raise NotImplementedError
+	"""
+	Whether this scanner type provides poll_many().
+	"""
+	@classmethod
+	def can_poll_many(cls):
+		return cls.poll_many is not Scanner.poll_many
+	"""
+	Optional health probe, run periodically by Celery (see health.probe_scanner). It should check that the scanning tool is up with as few API calls as possible, and return a dict with the "latency" (in seconds) of one lightweight call, along with whatever the tool reports of:
+	"running_scans", the number of scans running on the tool (including scans not started from here), "licence_limit", the number of targets that its licence allows, and "licence_expires", a datetime.
+	It should raise an exception if the tool is down. Scanner types that do not override this are only checked through their API calls (see ScannerHealth).
+	"""
+	def probe(self):
+		raise NotImplementedError
+	"""
+	Whether this scanner type provides probe().
+	"""
+	@classmethod
+	def can_probe(cls):
+		return cls.probe is not Scanner.probe
+	"""
+	Keyword arguments for the Transport of this scanner's API calls, which enforces the API call limits.
+	"""
+	def get_transport_limits(self):
+		return {'requests_per_second': self.requests_per_second, 'max_concurrent_calls': self.max_concurrent_calls}
+	def running_scan_count(self):
+		return Scan.objects.non_polymorphic().filter(scanner_id=self.pk, status__in=Scan.RUNNING_STATUSES).count()
+	"""
+	Whether another scan can be started on this scanner without going over max_running_scans.
+	"""
+	def has_running_capacity(self):
+		return self.max_running_scans is None or self.running_scan_count() < self.max_running_scans
+	"""
+	Checks that the scanner's pool only has scanners of the same scanner type, since pooled scans are only ever placed on members of their own scanner's type.
+	"""
+	def clean(self):
+		from django.contrib.contenttypes.models import ContentType
+		from django.core.exceptions import ValidationError
+		if self.pool_id is None:
+			return
+		ctype_pk = ContentType.objects.get_for_model(self, for_concrete_model=False).pk
+		if self.pool.member_types(exclude_pk=self.pk) - {ctype_pk}:
+			raise ValidationError({'pool': f"Pool \"{self.pool}\" has scanners of another scanner type."})
+	"""
 	For debugging purposes.
 	"""
 	def __str__(self):
@@ -56,21 +117,76 @@ class Scan(PolymorphicModel):
 	#Custom name for this scan.
 	scan_name = models.CharField('Scan Name',max_length=200,unique=True)
 	#Date when the scan was initially created.
-	create_date = models.DateTimeField('Date Created', auto_now_add=True)
+	create_date = models.DateTimeField('Date Created', auto_now_add=True, db_index=True)
 	#Date when the scan was last started.
-	start_date = models.DateTimeField('Date Started', null=True)
+	start_date = models.DateTimeField('Date Started', null=True, db_index=True)
 	#Date when the scan was last finished.
-	end_date = models.DateTimeField('Date Ended', null=True)
+	end_date = models.DateTimeField('Date Ended', null=True, db_index=True)
+	#Date when the scan was last changed. Code that changes scans with QuerySet.update() must set this as well, since auto_now only applies to save().
+	updated_at = models.DateTimeField('Date Updated', auto_now=True, db_index=True)
 	#Any notes that the user may wish to add
 	notes = models.TextField('Notes (optional)', blank=True)
-	#The results of the scan can be stored here.
-	result = models.FileField('Scan Result',storage=fs)
+	#The results of the scan can be stored here, as a compressed blob that may be shared with other scans that got the same result (see ResultBlob).
+	result = models.ForeignKey('ResultBlob', verbose_name='Scan Result', null=True, blank=True, default=None, on_delete=models.PROTECT, related_name='+')
+	#Uncompressed result file from before results were stored as blobs, kept by the migration that moved them until the delete_legacy_results command deletes it.
+	legacy_result = models.FileField('Legacy Scan Result', storage=fs, blank=True)
+	#Pool that the scan may run on any member of. Pooled scans are bound to a member of the pool when they are created (see place), and "scanner" only holds the member they are currently bound to.
+	pool = models.ForeignKey('ScannerPool', verbose_name='Run on any scanner of pool (optional)', null=True, blank=True, default=None, on_delete=models.SET_NULL, related_name='scans')
 
 	#Flags that determine whether this scan can be automatically created, started, or retrieved by Celery.
 	auto_create = models.BooleanField('Automatically create scan',default=False)
 	auto_start = models.BooleanField('Automatically start scan',default=False)
 	auto_retrieve = models.BooleanField('Automatically retrieve scan',default=False)
 
+	#Priority of the scan's queued work. When a scanner is at its limits, queued work is released highest priority first, then oldest first.
+	LOW		= 0
+	NORMAL	= 1
+	HIGH	= 2
+	PRIORITY_CHOICES = [
+		(LOW, 'Low'),
+		(NORMAL, 'Normal'),
+		(HIGH, 'High'),
+	]
+	priority = models.SmallIntegerField('Priority',choices=PRIORITY_CHOICES,default=NORMAL)
+
+	#Actions that are queued on a scan, and the time they were queued.
+	ACTION_CREATE	= 'CR'
+	ACTION_START	= 'ST'
+	ACTION_RETRIEVE	= 'RT'
+	ACTION_CHOICES = [
+		(ACTION_CREATE, 'Create'),
+		(ACTION_START, 'Start'),
+		(ACTION_RETRIEVE, 'Retrieve'),
+	]
+	#Actions that start a scan on the scanning tool, and so need one of the scanner's running slots. Overridden by scanner types whose create() also starts the scan.
+	RUNNING_ACTIONS = [ACTION_START]
+	#A manual command that is waiting for the scheduler to release it within the scanner's limits.
+	queued_action = models.CharField(max_length=2,choices=ACTION_CHOICES,null=True,blank=True,default=None)
+	queued_at = models.DateTimeField(null=True,blank=True,default=None)
+
+	#When an IN_PROGRESS scan is next due for a poll, and the progress (0 to 1) that the scanning tool last reported for it, if any.
+	next_poll_at = models.DateTimeField(null=True,blank=True,default=None)
+	progress = models.FloatField(null=True,blank=True,default=None)
+	#Bounds (in seconds) of the delay between polls.
+	POLL_INTERVAL_MIN = 15
+	POLL_INTERVAL_MAX = 15 * 60
+	#When the next step of a RETRIEVING scan's retrieval is due (see schedule_retrieve_step). The scheduler dispatches overdue steps again, in case the task that was queued for them was lost.
+	retrieve_step_at = models.DateTimeField(null=True,blank=True,default=None)
+
+	#Number of transient failures (see transport.is_transient) that the scan's current step has been retried after, and when an action that failed that way is next due (see retry_later).
+	retry_count = models.IntegerField(default=0)
+	retry_at = models.DateTimeField(null=True,blank=True,default=None)
+	#Retries are backed off from RETRY_BACKOFF_MIN, doubling up to RETRY_BACKOFF_MAX seconds, and the scan goes to ERRORS once MAX_RETRIES retries have failed.
+	RETRY_BACKOFF_MIN = 30
+	RETRY_BACKOFF_MAX = 30 * 60
+	MAX_RETRIES = 8
+
+	#Lease held by the Celery task that is currently working on this scan. A lease is live until it expires, so the lease of a worker that died is taken over once LEASE_DURATION has passed.
+	lease_token = models.CharField(max_length=32,null=True,blank=True,default=None)
+	lease_expires = models.DateTimeField(null=True,blank=True,default=None,db_index=True)
+	#Longest time (in seconds) that a task is expected to work on a scan.
+	LEASE_DURATION = 15 * 60
+
 	"""
 	Condition for whether a scan be created. Can be overridden in the extension class.
 	"""
@@ -91,6 +207,69 @@ class Scan(PolymorphicModel):
 	def poll(self):
 		raise NotImplementedError
 	"""
+	Returns the delay (in seconds) until the next poll of an in-progress scan. The delay grows with the time that the scan has been running, since a scan that has run for hours is unlikely to finish in the next few seconds, and shrinks again as the reported progress nears completion.
+	Short scans are noticed within POLL_INTERVAL_MIN of finishing, and long scans are polled at most every POLL_INTERVAL_MAX.
+	"""
+	def next_poll_delay(self, now):
+		elapsed = max((now - self.start_date).total_seconds(), 0) if self.start_date else 0
+		delay = elapsed / 10
+		if self.progress is not None and 0 < self.progress < 1:
+			#Half of the remaining time, estimated from the rate of progress so far.
+			delay = min(delay, elapsed * (1 - self.progress) / self.progress / 2)
+		return min(max(delay, Scan.POLL_INTERVAL_MIN), Scan.POLL_INTERVAL_MAX)
+	"""
+	Whether the progress reported by a poll can shorten the delay until the next one, i.e. whether the scan has run long enough for its delay to grow past POLL_INTERVAL_MIN. Lets batch polls skip fetching the progress of scans that are polled as often as possible anyway.
+	"""
+	def wants_progress(self, now):
+		elapsed = max((now - self.start_date).total_seconds(), 0) if self.start_date else 0
+		return elapsed / 10 > Scan.POLL_INTERVAL_MIN
+	"""
+	Records the progress of a poll that found the scan still in progress, and schedules its next poll. The poll got through, so the retries of earlier polls are reset.
+	"""
+	def schedule_next_poll(self, progress=None):
+		from datetime import timedelta
+		from django.utils import timezone
+		now = timezone.now()
+		if progress is not None:
+			self.progress = progress
+		self.transition(Scan.IN_PROGRESS, progress=self.progress, next_poll_at=now + timedelta(seconds=self.next_poll_delay(now)), retry_count=0)
+	"""
+	Returns the fields to write along with a transition to IN_PROGRESS, so that the first poll happens after POLL_INTERVAL_MIN.
+	"""
+	@staticmethod
+	def first_poll_fields():
+		from datetime import timedelta
+		from django.utils import timezone
+		return {'progress': None, 'next_poll_at': timezone.now() + timedelta(seconds=Scan.POLL_INTERVAL_MIN)}
+	"""
+	Handles a transient failure of the scan's current step (see transport.TransientScannerError) by moving the scan back to "status", the status it had before the step, and retrying the step after a backoff:
+	polls (IN_PROGRESS) are retried through next_poll_at, retrieval steps (RETRIEVING) through schedule_retrieve_step(), and actions through a queued "action" that the scheduler holds back until retry_at.
+	Once MAX_RETRIES retries have failed, the scan goes to ERRORS with "error_fields" instead. Returns whether the step will be retried.
+	"""
+	def retry_later(self, status, action=None, **error_fields):
+		from datetime import timedelta
+		from django.utils import timezone
+		if self.retry_count >= Scan.MAX_RETRIES:
+			self.transition(Scan.ERRORS, **error_fields)
+			return False
+		now = timezone.now()
+		delay = min(Scan.RETRY_BACKOFF_MIN * 2 ** self.retry_count, Scan.RETRY_BACKOFF_MAX)
+		fields = {'retry_count': self.retry_count + 1}
+		if status == Scan.IN_PROGRESS:
+			fields['next_poll_at'] = now + timedelta(seconds=delay)
+		elif status != Scan.RETRIEVING:
+			fields['retry_at'] = now + timedelta(seconds=delay)
+			if action is not None:
+				fields.update(queued_action=action, queued_at=now)
+		if not self.transition(status, **fields):
+			return False
+		if status == Scan.RETRIEVING:
+			self.schedule_retrieve_step(delay)
+		return True
+	def is_retry_pending(self):
+		from django.utils import timezone
+		return self.retry_at is not None and self.retry_at > timezone.now()
+	"""
 	Condition for whether a scan be paused. Can be overridden in the extension class.
 	"""
 	def can_pause(self):
@@ -118,6 +297,27 @@ class Scan(PolymorphicModel):
 		return self.status == Scan.FINISHED
 	def retrieve(self):
 		raise NotImplementedError
+	"""
+	Runs the next step of a retrieval that was split into several steps, while the scan is in the RETRIEVING stage. Only needs to be implemented by scanner types whose retrieve() calls schedule_retrieve_step().
+	"""
+	def continue_retrieve(self):
+		raise NotImplementedError
+	"""
+	Queues continue_retrieve() to be run by Celery after the given number of seconds, so that no worker is kept busy while the scanning tool prepares the result.
+	The step's due time is stored in retrieve_step_at and passed to the task, so that a task for a step that has since been superseded (e.g. one that was only late when the scheduler dispatched it again) does nothing.
+	"""
+	def schedule_retrieve_step(self, countdown):
+		from datetime import timedelta
+		from django.utils import timezone
+		from dd_downloader.celery_tasks import continue_scan_retrieval
+		self.retrieve_step_at = timezone.now() + timedelta(seconds=countdown)
+		Scan._base_manager.filter(pk=self.pk).update(retrieve_step_at=self.retrieve_step_at)
+		continue_scan_retrieval.apply_async((self.pk,), {'step_at': self.retrieve_step_at.timestamp()}, countdown=countdown)
+	"""
+	Whether a retrieval step task that was queued for the step due at "step_at" (a timestamp) is still the scan's current step.
+	"""
+	def is_current_retrieve_step(self, step_at):
+		return self.retrieve_step_at is None or abs(self.retrieve_step_at.timestamp() - step_at) < 1
 
 	NEW			= 'NW' #Nothing has happened on the scanning tool.
 	CREATING	= 'CR' #Mutex stage prior to CREATED.
@@ -125,7 +325,7 @@ class Scan(PolymorphicModel):
 	STARTING	= 'ST' #Mutex stage prior to IN_PROGRESS.
 	IN_PROGRESS	= 'IP' #Scan is 'in progress' and poll() will be called periodically until the function changes the scan's state to something else.
 	PAUSED		= 'PD' #Scan is temporarily paused, and can be restored to IN_PROGRESS by resuming
-	STOPPED		= 'ST' #Scan is terminated, with no intention of being resumed in the future.	
+	STOPPED		= 'SP' #Scan is terminated, with no intention of being resumed in the future.
 	FINISHED	= 'FI' #Scan completed, but results not retrieved yet.
 	RETRIEVING	= 'RG' #Mutex stage prior to RETRIEVED.
 	RETRIEVED	= 'RD' #Result successfully retrieved from the scanning tool, and stored in the "result" attribute.
@@ -145,6 +345,13 @@ class Scan(PolymorphicModel):
 		(ERRORS, 'Error occurred')
 	]
 
+	#Mutex stages, which a worker claims before it calls the scanning tool.
+	MUTEX_STATUSES = [CREATING, STARTING, RETRIEVING]
+	#Statuses in which a scan takes up one of its scanner's running slots.
+	RUNNING_STATUSES = [STARTING, IN_PROGRESS, PAUSED]
+	#Statuses in which a scan is bound to its scanner: it exists on the scanning tool and has yet to finish there. Used to weigh the load of pool members.
+	PLACED_STATUSES = [CREATING, CREATED] + RUNNING_STATUSES
+
 	#The current status of the scan.
 	status = models.CharField(
 		max_length=2,
@@ -153,24 +360,277 @@ class Scan(PolymorphicModel):
 	)
 
 	"""
-	Helper function for creating a ContentFile and saving it to the "result" attribute.
+	Queues an action, to be run by the scheduler once the scanner has capacity for it.
+	"""
+	def queue_action(self, action):
+		from django.utils import timezone
+		self.queued_action = action
+		self.queued_at = timezone.now()
+		Scan._base_manager.filter(pk=self.pk).update(queued_action=self.queued_action, queued_at=self.queued_at, updated_at=self.queued_at)
+	"""
+	Queues an action on the given scans with a single UPDATE, which only applies to the scans that are still in the status they were checked in and that no task holds a lease on, since either may have changed since they were fetched. Returns the PKs of the scans that were queued.
+	"""
+	@staticmethod
+	def queue_actions(scan_objs, action):
+		from django.db.models import Q
+		from django.utils import timezone
+		if not scan_objs:
+			return set()
+		now = timezone.now()
+		pks_by_status = {}
+		for scan_obj in scan_objs:
+			pks_by_status.setdefault(scan_obj.status, []).append(scan_obj.pk)
+		unchanged = Q()
+		for status, scan_pks in pks_by_status.items():
+			unchanged |= Q(status=status, pk__in=scan_pks)
+		queued = Scan._base_manager.filter(unchanged).filter(Scan.unleased_q()).update(queued_action=action, queued_at=now, updated_at=now)
+		scan_pks = [scan_obj.pk for scan_obj in scan_objs]
+		if queued == len(scan_pks):
+			return set(scan_pks)
+		return set(Scan._base_manager.filter(pk__in=scan_pks, queued_action=action, queued_at=now).values_list('pk', flat=True))
+	def clear_queued_action(self):
+		if self.queued_action is not None:
+			self.queued_action = None
+			self.queued_at = None
+			Scan._base_manager.filter(pk=self.pk).update(queued_action=None, queued_at=None)
+	"""
+	Whether the scanner has capacity for the given action on this scan right now.
+	"""
+	def has_capacity_for(self, action):
+		return action not in self.RUNNING_ACTIONS or self.scanner.has_running_capacity()
+
+	"""
+	Binds a pooled scan that has yet to be created to the least-loaded reachable member of its pool (see ScannerPool.pick_member), so that scans are spread over the pool when they are created rather than when they are added. Returns whether the scan was moved to another scanner.
+	"""
+	def place(self):
+		if self.pool_id is None or self.status != Scan.NEW:
+			return False
+		scanner_obj = self.pool.pick_member(self.scanner.polymorphic_ctype_id)
+		if scanner_obj is None or scanner_obj.pk == self.scanner_id:
+			return False
+		return self.transition(Scan.NEW, scanner=scanner_obj)
+	"""
+	Moves a pooled scan that was created on a scanner that has since become unreachable to another reachable member of its pool. The scan goes back to NEW with a queued create, so that it is created again on its new scanner, and then carries on as before. Returns whether the scan was moved.
+	"""
+	def fail_over(self):
+		from django.utils import timezone
+		if self.pool_id is None or self.status != Scan.CREATED or ScannerHealth.is_reachable(self.scanner_id):
+			return False
+		scanner_obj = self.pool.pick_member(self.scanner.polymorphic_ctype_id, exclude_pk=self.scanner_id)
+		if scanner_obj is None:
+			return False
+		return self.transition(Scan.NEW, scanner=scanner_obj, queued_action=Scan.ACTION_CREATE, queued_at=timezone.now())
+
+	"""
+	Checks that the scan's pool has members of its scanner's type, which it could be placed on or failed over to.
+	"""
+	def clean(self):
+		from django.core.exceptions import ValidationError
+		if self.pool_id is None or self.scanner_id is None:
+			return
+		if self.scanner.polymorphic_ctype_id not in self.pool.member_types():
+			raise ValidationError({'pool': f"Pool \"{self.pool}\" has no scanners of this scan's scanner type."})
+
+	"""
+	Returns a Q object matching the scans that have no live lease.
+	"""
+	@staticmethod
+	def unleased_q():
+		from django.db.models import Q
+		from django.utils import timezone
+		return Q(lease_expires__isnull=True) | Q(lease_expires__lte=timezone.now())
+	def is_leased(self):
+		from django.utils import timezone
+		return self.lease_expires is not None and self.lease_expires > timezone.now()
+	"""
+	Takes the lease of every scan in "scan_pks" that has no live lease, with a single UPDATE. Returns the lease token, and the set of PKs that were leased with it.
+	A lease that is still held under "handoff" is taken over as well, which lets a task pass its lease on to the task that it chains (see chain_next_step).
+	"""
+	@staticmethod
+	def acquire_leases(scan_pks, duration=None, handoff=None):
+		import uuid
+		from datetime import timedelta
+		from django.utils import timezone
+		token = uuid.uuid4().hex
+		expires = timezone.now() + timedelta(seconds=duration or Scan.LEASE_DURATION)
+		available = Scan.unleased_q()
+		if handoff is not None:
+			available |= models.Q(lease_token=handoff)
+		leased = Scan._base_manager.filter(available, pk__in=scan_pks).update(lease_token=token, lease_expires=expires)
+		if not leased:
+			return token, set()
+		return token, set(Scan._base_manager.filter(lease_token=token).values_list('pk', flat=True))
+	"""
+	Takes the lease of a single scan. Returns the lease token, or None if the scan already has a live lease.
+	"""
+	@staticmethod
+	def acquire_lease(scan_pk, duration=None, handoff=None):
+		token, leased = Scan.acquire_leases([scan_pk], duration, handoff)
+		return token if leased else None
+	@staticmethod
+	def release_leases(token):
+		Scan._base_manager.filter(lease_token=token).update(lease_token=None, lease_expires=None)
+
+	"""
+	Atomically moves the scan from the status it was loaded with to "status", and writes the given fields along with it. Returns True if the transition was claimed; otherwise the scan was changed by someone else in the meantime, and the instance is left as it was.
+	The claim is a single conditional UPDATE that only matches while the row still has the old status, so when two workers race for the same transition (e.g. a beat tick and a manual command), exactly one of them wins. Transitions to the same status can be used to update fields only while the scan is still in that status.
+	Only the status, updated_at and the given fields are written. Fields of the scanner type's own table are written by a second UPDATE in the same transaction.
+	A change of status that isn't a retry (see retry_later) or the claim of a mutex stage means that the scan's current step is over, so its retries are reset along with it. So does a transition within a mutex stage (e.g. to the next retrieval step), which is only made once the previous step has succeeded.
+	"""
+	def transition(self, status, **fields):
+		from django.db import transaction
+		from django.utils import timezone
+		from . import events
+		now = timezone.now()
+		step_over = status not in Scan.MUTEX_STATUSES if status != self.status else status in Scan.MUTEX_STATUSES
+		if (self.retry_count or self.retry_at is not None) and step_over and 'retry_count' not in fields:
+			fields = dict(fields, retry_count=0, retry_at=None)
+		base_fields = {}
+		child_fields = {}
+		for name, value in fields.items():
+			if self._meta.get_field(name).model is Scan:
+				base_fields[name] = value
+			else:
+				child_fields[name] = value
+		with transaction.atomic():
+			claimed = Scan._base_manager.filter(pk=self.pk, status=self.status).update(status=status, updated_at=now, **base_fields)
+			if not claimed:
+				return False
+			if child_fields:
+				type(self)._base_manager.filter(pk=self.pk).update(**child_fields)
+		previous_status = self.status
+		self.status = status
+		self.updated_at = now
+		for name, value in fields.items():
+			setattr(self, name, value)
+		#QuerySet.update() doesn't send post_save, so the event is published here.
+		events.publish_scan(self)
+		if status != previous_status:
+			self.chain_next_step(previous_status)
+		return True
+
+	"""
+	Whether the scan's current status has an automated step for process_scan to run.
+	"""
+	def has_automated_step(self):
+		return self.queued_action is not None or \
+			(self.status == Scan.NEW and self.auto_create) or \
+			(self.status == Scan.CREATED and self.auto_start) or \
+			(self.status == Scan.FINISHED and self.auto_retrieve)
+	"""
+	Queues the scan's next automated step as soon as a transition is committed, instead of leaving it for the next scheduler run, which only remains as a safety net. Retrieved results are queued for indexing (see ingest_findings).
+	The lease that the current task holds on the scan is handed off to the chained task. A scan that gives up a running slot also releases the queued work of its scanner.
+	"""
+	def chain_next_step(self, previous_status):
+		from django.db import transaction
+		from dd_downloader.celery_tasks import process_scan, process_scans
+		if self.has_automated_step():
+			#Steps that are waiting to be retried are left for the scheduler to run once their retry is due.
+			if not self.is_retry_pending():
+				scan_pk, token = self.pk, self.lease_token
+				transaction.on_commit(lambda: process_scan.delay(scan_pk, handoff_token=token))
+		elif self.status == Scan.RETRIEVED and self.can_parse_findings():
+			from dd_downloader.celery_tasks import ingest_scan_findings
+			scan_pk, token = self.pk, self.lease_token
+			transaction.on_commit(lambda: ingest_scan_findings.delay(scan_pk, handoff_token=token))
+		if previous_status in Scan.RUNNING_STATUSES and self.status not in Scan.RUNNING_STATUSES and self.scanner.max_running_scans is not None:
+			scanner_pk = self.scanner_id
+			transaction.on_commit(lambda: process_scans.delay(scanner_pk))
+
+	"""
+	Should yield the findings in a retrieved result, as dicts of Finding fields (host, port, protocol, plugin_id, name, path, cve, severity), read from the text stream returned by open_result().
+	Results should be parsed as a stream, so that memory usage stays flat no matter how big the result is. Scanner types that don't override this are not indexed.
+	"""
+	def parse_findings(self, stream):
+		raise NotImplementedError
+	@classmethod
+	def can_parse_findings(cls):
+		return cls.parse_findings is not Scan.parse_findings
+	"""
+	Rebuilds the findings of the scan from its result, inserting them in batches of FINDING_BATCH_SIZE. Returns the number of findings.
+	"""
+	def ingest_findings(self):
+		from django.db import transaction
+		if self.result_id is None or not self.can_parse_findings():
+			return 0
+		count = 0
+		batch = []
+		with transaction.atomic():
+			Finding.objects.filter(scan_id=self.pk).delete()
+			with self.open_result() as stream:
+				for fields in self.parse_findings(stream):
+					batch.append(Finding.from_fields(self.pk, fields))
+					if len(batch) >= Scan.FINDING_BATCH_SIZE:
+						Finding.objects.bulk_create(batch)
+						count += len(batch)
+						batch = []
+			Finding.objects.bulk_create(batch)
+			count += len(batch)
+		return count
+	FINDING_BATCH_SIZE = 1000
+	#Name of the field that holds the scan's targets, which scanner types with recurring scans should set. Scans of the same scanner with the same targets are runs of the same recurring scan, and their findings are compared (see ScanDiff).
+	TARGET_FIELD = None
+	"""
+	Returns the previous run of this scan: the latest other retrieved scan of the same scanner and targets that ended before this one, or None.
+	"""
+	def previous_run(self):
+		if self.TARGET_FIELD is None or self.end_date is None:
+			return None
+		return type(self).objects.filter(
+			scanner_id=self.scanner_id,
+			status=Scan.RETRIEVED,
+			end_date__lte=self.end_date,
+			**{self.TARGET_FIELD: getattr(self, self.TARGET_FIELD)}
+		).exclude(pk=self.pk).order_by('-end_date', '-pk').first()
+	"""
+	Opens the stored result as a text stream.
+	"""
+	def open_result(self):
+		import io
+		return io.TextIOWrapper(self.result.open(), encoding='utf-8', errors='replace', newline='')
+
+	"""
+	Helper function for saving a result to the "result" attribute. The file can be given as a str/bytes, or as an iterable of str/bytes chunks (e.g. a streamed HTTP response body), which is compressed into a temporary file chunk by chunk and then stored as a ResultBlob, so memory usage stays flat no matter how big the result is.
+	Carriage returns are stripped while streaming.
 	"""
 	def save_result(self,file):
-		from os.path import join
-		self.delete_result()
-		from django.core.files.base import ContentFile
-		from django.utils.text import slugify
-		cf = ContentFile(file)
-		
-		fp = join(slugify(self.scanner.scanner_name),slugify(self.scan_name))
-		print(fp)
-		self.result.save(fp, cf, save=True)
+		from django.db import transaction
+		if isinstance(file, (str, bytes)):
+			file = [file]
+
+		def strip(chunks):
+			for chunk in chunks:
+				if isinstance(chunk, str):
+					chunk = chunk.encode()
+				yield chunk.replace(b'\r', b'')
+
+		with ResultBlob.compress(strip(file)) as compressed:
+			#The previous result is only released once the new one has been received in full.
+			with transaction.atomic():
+				previous_pk = self.result_id
+				self.result = ResultBlob.acquire(*compressed)
+				#Only the result is written, so that a concurrent transition is never overwritten.
+				self.save(update_fields=['result', 'updated_at'])
+				if previous_pk is not None:
+					ResultBlob.release(previous_pk)
 	"""
-	Helper function for deleting the file in the "result" attribute.
+	Helper function for removing the scan's result. The blob itself is deleted once no other scan refers to it.
 	"""
 	def delete_result(self):
-		if self.result:
-			self.result.delete()
+		from django.db import transaction
+		if self.result_id is not None:
+			with transaction.atomic():
+				previous_pk = self.result_id
+				self.result = None
+				self.save(update_fields=['result', 'updated_at'])
+				ResultBlob.release(previous_pk)
+	"""
+	Returns a name for the scan's result, for downloads and archives.
+	"""
+	def result_filename(self):
+		from os.path import join
+		from django.utils.text import slugify
+		return join(slugify(self.scanner.scanner_name), f"{slugify(self.scan_name)}-{self.pk}")
 
 	"""
 	For debugging purposes.
@@ -178,6 +638,388 @@ class Scan(PolymorphicModel):
 	def __str__(self):
 		return f"{self.pk}, {self.status}, \"{self.scan_name}\""
 
+	class Meta(PolymorphicModel.Meta):
+		#Supports the scheduler's lookup of scans that have an automated action pending (see celery_tasks.actionable_scans).
+		indexes = [
+			models.Index(fields=['status', 'auto_create', 'auto_start', 'auto_retrieve'], name='scan_status_auto_idx'),
+			#Supports the scheduler's lookup of in-progress scans that are due for a poll.
+			models.Index(fields=['status', 'next_poll_at'], name='scan_status_poll_idx'),
+			#Support the scheduler's lookups of scans with a queued command, and of retrievals whose next step is overdue.
+			models.Index(fields=['queued_action'], name='scan_queued_action_idx'),
+			models.Index(fields=['status', 'retrieve_step_at'], name='scan_status_step_idx'),
+		]
+
+"""
+A compressed scan result. Results are stored gzip-compressed and addressed by the SHA-256 of their uncompressed content, so identical results (e.g. re-retrievals of an unchanged scan) are stored once and shared by every scan that got them.
+Blobs are reference-counted by the scans that point to them, and deleted along with their file once the last reference is released.
+"""
+class ResultBlob(models.Model):
+	#SHA-256 of the uncompressed content, in hex.
+	sha256 = models.CharField(max_length=64, unique=True)
+	#The gzip-compressed content.
+	file = models.FileField(storage=fs)
+	#Size of the uncompressed content, in bytes.
+	size = models.BigIntegerField()
+	#Number of scans whose result is this blob.
+	ref_count = models.PositiveIntegerField(default=0)
+	create_date = models.DateTimeField('Date Created', auto_now_add=True)
+
+	#Size of the chunks (in bytes) in which blobs are decompressed.
+	CHUNK_SIZE = 64 * 1024
+
+	"""
+	Compresses an iterable of bytes chunks into a temporary file, hashing the content on the way. Yields a tuple of the temporary file, the SHA-256 and the uncompressed size, to be passed on to acquire().
+	"""
+	@staticmethod
+	@contextmanager
+	def compress(chunks):
+		import gzip, hashlib
+		from django.core.files.uploadedfile import TemporaryUploadedFile
+		digest = hashlib.sha256()
+		size = 0
+		with TemporaryUploadedFile('result.gz', 'application/gzip', 0, None) as temp_file:
+			#mtime is fixed so that the compressed file only depends on the content.
+			with gzip.GzipFile(fileobj=temp_file, mode='wb', mtime=0) as gzip_file:
+				for chunk in chunks:
+					digest.update(chunk)
+					size += len(chunk)
+					gzip_file.write(chunk)
+			temp_file.flush()
+			temp_file.size = temp_file.tell()
+			temp_file.seek(0)
+			yield temp_file, digest.hexdigest(), size
+
+	"""
+	Takes a reference to the blob with the given content, storing the compressed file if no blob has that content yet. Should be called in the same transaction that makes a scan refer to the blob.
+	"""
+	@staticmethod
+	def acquire(temp_file, sha256, size):
+		from django.db import transaction, IntegrityError
+		with transaction.atomic():
+			blob = ResultBlob.objects.select_for_update().filter(sha256=sha256).first()
+			if blob is None:
+				blob = ResultBlob(sha256=sha256, size=size)
+				blob.file.save(f"results/{sha256[:2]}/{sha256}.gz", temp_file, save=False)
+				try:
+					with transaction.atomic():
+						blob.save()
+				except IntegrityError:
+					#Another worker stored the same content first.
+					blob.file.delete(save=False)
+					blob = ResultBlob.objects.select_for_update().get(sha256=sha256)
+			ResultBlob.objects.filter(pk=blob.pk).update(ref_count=models.F('ref_count') + 1)
+			blob.ref_count += 1
+		return blob
+
+	"""
+	Releases "count" references to a blob, deleting it (and its file, once the transaction commits) if they were the last ones. Should be called once no scan refers to the blob anymore.
+	"""
+	@staticmethod
+	def release(blob_pk, count=1):
+		from django.db import transaction
+		from django.db.models.functions import Greatest
+		with transaction.atomic():
+			ResultBlob.objects.filter(pk=blob_pk, ref_count__gt=0).update(ref_count=Greatest(models.F('ref_count') - count, 0))
+			for blob in ResultBlob.objects.select_for_update().filter(pk=blob_pk, ref_count=0):
+				blob.delete()
+				transaction.on_commit(lambda name=blob.file.name: fs.delete(name))
+
+	"""
+	Opens the uncompressed content as a binary stream.
+	"""
+	def open(self):
+		import gzip
+		return gzip.open(self.file.path, 'rb')
+
+	"""
+	Yields the uncompressed content in chunks of CHUNK_SIZE bytes.
+	"""
+	def chunks(self):
+		with self.open() as f:
+			while True:
+				chunk = f.read(ResultBlob.CHUNK_SIZE)
+				if not chunk:
+					return
+				yield chunk
+
+	def __str__(self):
+		return f"{self.pk}, {self.sha256}, {self.ref_count} references"
+
+"""
+The differences between the findings of a scan and those of its previous run (see Scan.previous_run()), matched by hash key.
+Only the counts are kept in the database; the new and resolved findings themselves are stored as a compressed CSV blob, so a diff takes little space however many findings the scans have.
+"""
+class ScanDiff(models.Model):
+	scan = models.OneToOneField(Scan, on_delete=models.CASCADE, related_name='diff')
+	previous_scan = models.ForeignKey(Scan, null=True, on_delete=models.SET_NULL, related_name='+')
+	new_count = models.PositiveIntegerField(default=0)
+	resolved_count = models.PositiveIntegerField(default=0)
+	unchanged_count = models.PositiveIntegerField(default=0)
+	#CSV of the new and resolved findings.
+	changes = models.ForeignKey(ResultBlob, null=True, on_delete=models.PROTECT, related_name='+')
+	compute_date = models.DateTimeField('Date Computed', auto_now=True)
+
+	#Fields of the findings that are compared, starting with the hash key that they are matched by, and the CSV columns that they are written to.
+	ROW_FIELDS = ['hash_key', 'host', 'port', 'protocol', 'plugin_id', 'name', 'cve', 'path', 'severity']
+	CSV_COLUMNS = ['Change', 'Host', 'Port', 'Protocol', 'Plugin ID', 'Name', 'CVE', 'Path', 'Severity']
+	#Number of findings fetched from the database at a time, and size (in bytes) of the CSV chunks that are compressed.
+	FETCH_SIZE = 2000
+	CHUNK_SIZE = 64 * 1024
+
+	"""
+	Compares the findings of a scan with those of its previous run in one merge pass over both, sorted by hash key, and stores the result. Memory usage stays flat no matter how many findings the scans have.
+	Returns the diff, or None (deleting any earlier diff) if the scan has no previous run.
+	"""
+	@staticmethod
+	def compute(scan_obj):
+		import csv, io
+		from django.db import transaction
+		from .findings import merge_findings, NEW, RESOLVED, UNCHANGED
+		previous_scan = scan_obj.previous_run()
+		if previous_scan is None:
+			ScanDiff.objects.filter(scan_id=scan_obj.pk).delete()
+			return None
+
+		def rows(scan_pk):
+			return Finding.objects.filter(scan_id=scan_pk).order_by('hash_key').values_list(*ScanDiff.ROW_FIELDS).iterator(chunk_size=ScanDiff.FETCH_SIZE)
+
+		counts = {NEW: 0, RESOLVED: 0, UNCHANGED: 0}
+		change_names = {NEW: 'New', RESOLVED: 'Resolved'}
+		severity_names = dict(Finding.SEVERITY_CHOICES)
+		def changes():
+			buffer = io.StringIO()
+			writer = csv.writer(buffer)
+			writer.writerow(ScanDiff.CSV_COLUMNS)
+			for change, row in merge_findings(rows(previous_scan.pk), rows(scan_obj.pk)):
+				counts[change] += 1
+				if change == UNCHANGED:
+					continue
+				writer.writerow([change_names[change], *row[1:-1], severity_names.get(row[-1], row[-1])])
+				if buffer.tell() >= ScanDiff.CHUNK_SIZE:
+					yield buffer.getvalue().encode()
+					buffer.seek(0)
+					buffer.truncate()
+			yield buffer.getvalue().encode()
+
+		with ResultBlob.compress(changes()) as compressed:
+			with transaction.atomic():
+				diff = ScanDiff.objects.select_for_update().filter(scan_id=scan_obj.pk).first() or ScanDiff(scan_id=scan_obj.pk)
+				previous_changes_pk = diff.changes_id
+				diff.previous_scan_id = previous_scan.pk
+				diff.new_count = counts[NEW]
+				diff.resolved_count = counts[RESOLVED]
+				diff.unchanged_count = counts[UNCHANGED]
+				diff.changes = ResultBlob.acquire(*compressed)
+				diff.save()
+				if previous_changes_pk is not None:
+					ResultBlob.release(previous_changes_pk)
+		return diff
+
+	def __str__(self):
+		return f"{self.scan_id} against {self.previous_scan_id}, {self.new_count} new, {self.resolved_count} resolved"
+
+"""
+A finding from a retrieved scan result, normalized across scanner types, so that questions like "which hosts have plugin X?" are answered by indexed queries instead of downloading and searching result files.
+Findings are rebuilt from the result whenever a scan is retrieved (see Scan.ingest_findings).
+"""
+class Finding(models.Model):
+	scan = models.ForeignKey(Scan, on_delete=models.CASCADE, related_name='findings')
+	host = models.CharField(max_length=255)
+	port = models.PositiveIntegerField(null=True, default=None)
+	protocol = models.CharField(max_length=10, blank=True)
+	#Nessus plugin ID, or Burp Suite issue type.
+	plugin_id = models.CharField(max_length=100)
+	name = models.CharField(max_length=500, blank=True)
+	#Path of the affected URL, for web application scanners.
+	path = models.CharField(max_length=1000, blank=True)
+	cve = models.CharField(max_length=50, blank=True)
+
+	INFO		= 0
+	LOW			= 1
+	MEDIUM		= 2
+	HIGH		= 3
+	CRITICAL	= 4
+	SEVERITY_CHOICES = [
+		(INFO, 'Info'),
+		(LOW, 'Low'),
+		(MEDIUM, 'Medium'),
+		(HIGH, 'High'),
+		(CRITICAL, 'Critical'),
+	]
+	severity = models.SmallIntegerField(choices=SEVERITY_CHOICES, default=INFO)
+	#Hash of the fields that identify a finding (host, port, protocol, plugin, CVE and path), which is equal for the same finding in different scans.
+	hash_key = models.CharField(max_length=64)
+
+	"""
+	Returns a Finding from the dict of fields yielded by Scan.parse_findings(), with text fields cut to their maximum length and the hash key filled in.
+	"""
+	@staticmethod
+	def from_fields(scan_pk, fields):
+		import hashlib
+		finding = Finding(scan_id=scan_pk, **fields)
+		for name in ['host', 'protocol', 'plugin_id', 'name', 'path', 'cve']:
+			value = getattr(finding, name) or ''
+			setattr(finding, name, value[:Finding._meta.get_field(name).max_length])
+		identity = '|'.join([finding.host, str(finding.port), finding.protocol, finding.plugin_id, finding.cve, finding.path])
+		finding.hash_key = hashlib.sha256(identity.encode()).hexdigest()
+		return finding
+
+	def __str__(self):
+		return f"{self.host}:{self.port}, {self.plugin_id} \"{self.name}\""
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['plugin_id', 'host'], name='finding_plugin_host_idx'),
+			models.Index(fields=['host', 'port'], name='finding_host_port_idx'),
+			models.Index(fields=['cve'], name='finding_cve_idx'),
+			models.Index(fields=['scan', 'hash_key'], name='finding_scan_hash_idx'),
+		]
+
+"""
+Shared state of a scanner's API call limits. "tokens" is the token bucket that enforces requests_per_second; it is refilled lazily, based on the time since "refilled_at", whenever a call takes a token.
+The row is locked while a call takes a token, so the bucket is shared by every worker process.
+"""
+class ScannerThrottle(models.Model):
+	scanner = models.OneToOneField(Scanner, on_delete=models.CASCADE, primary_key=True, related_name='throttle')
+	tokens = models.FloatField(default=0)
+	refilled_at = models.DateTimeField()
+
+"""
+Shared state of a scanner's circuit breaker (see circuit.py). While the circuit is CLOSED, the outcomes of the scanner's API calls are counted in a window that starts at "window_start".
+Once too many of them fail, the circuit is OPEN until "open_until", and calls fail without reaching the scanner. After that, one trial call is let through, and the circuit is HALF_OPEN while it runs: it closes again if the call succeeds, and reopens for twice as long if it fails.
+"""
+class ScannerCircuit(models.Model):
+	CLOSED		= 'CL'
+	OPEN		= 'OP'
+	HALF_OPEN	= 'HO'
+	STATE_CHOICES = [
+		(CLOSED, 'Closed'),
+		(OPEN, 'Open'),
+		(HALF_OPEN, 'Half-open'),
+	]
+	scanner = models.OneToOneField(Scanner, on_delete=models.CASCADE, primary_key=True, related_name='circuit')
+	state = models.CharField(max_length=2, choices=STATE_CHOICES, default=CLOSED)
+	window_start = models.DateTimeField()
+	window_calls = models.IntegerField(default=0)
+	window_failures = models.IntegerField(default=0)
+	#End of the cooldown while OPEN, or the time after which a trial call that never reported back is given up on while HALF_OPEN.
+	open_until = models.DateTimeField(null=True, default=None)
+	#Length (in seconds) of the last cooldown, which doubles every time a trial call fails.
+	cooldown = models.FloatField(default=0)
+
+"""
+An API call in flight to a scanner, which takes up one of its max_concurrent_calls. Slots expire, so that the slot of a worker that died during a call is reclaimed.
+"""
+class ScannerCall(models.Model):
+	scanner = models.ForeignKey(Scanner, on_delete=models.CASCADE, related_name='+')
+	expires_at = models.DateTimeField(db_index=True)
+
+"""
+A group of interchangeable scanners of the same scanner type, e.g. several Nessus appliances. Scans that target a pool are bound to one of its members when they are created, instead of being tied to the scanner they were added under.
+"""
+class ScannerPool(models.Model):
+	pool_name = models.CharField('Pool Name', max_length=200, unique=True)
+	create_date = models.DateTimeField('Date Created', auto_now_add=True)
+	notes = models.TextField('Notes (optional)', blank=True)
+
+	"""
+	Returns the member of the given scanner type (by content type PK) that a scan should be placed on, or None if no member is reachable.
+	Members are ranked by whether they have a free running slot, then by how many scans are bound to them (see Scan.PLACED_STATUSES), then by their recent API latency. Members whose circuit is open (see circuit.py) are left out as well.
+	"""
+	def pick_member(self, ctype_pk, exclude_pk=None):
+		from django.db.models import Q, Count
+		from django.utils import timezone
+		members = Scanner.objects.non_polymorphic().filter(pool_id=self.pk, polymorphic_ctype_id=ctype_pk).exclude(pk=exclude_pk).annotate(
+			placed=Count('scan', filter=Q(scan__status__in=Scan.PLACED_STATUSES)),
+			running=Count('scan', filter=Q(scan__status__in=Scan.RUNNING_STATUSES)),
+		).values_list('pk', 'max_running_scans', 'placed', 'running', 'health__latency', 'health__consecutive_failures', 'health__reachable', 'circuit__open_until')
+		now = timezone.now()
+		ranked = []
+		for scanner_pk, max_running, placed, running, latency, failures, reachable, open_until in members:
+			if reachable is False or (failures is not None and failures >= ScannerHealth.UNREACHABLE_FAILURES):
+				continue
+			if open_until is not None and open_until > now:
+				continue
+			full = max_running is not None and running >= max_running
+			ranked.append((full, placed, latency or 0, scanner_pk))
+		if not ranked:
+			return None
+		return Scanner.objects.get(pk=min(ranked)[-1])
+
+	"""
+	Returns the content type PKs of the scanner types that the pool has members of.
+	"""
+	def member_types(self, exclude_pk=None):
+		return set(Scanner.objects.non_polymorphic().filter(pool_id=self.pk).exclude(pk=exclude_pk).values_list('polymorphic_ctype_id', flat=True))
+
+	def __str__(self):
+		return self.pool_name
+
+"""
+Health of a scanner's API (see health.py). The Transport records every call: a moving average of the call latency, and the number of calls in a row that failed to reach the scanner.
+The periodic health probe keeps a snapshot of the scanning tool's state, so that the scheduler and the scanner pages can tell whether a scanner is up without making any API calls of their own.
+"""
+class ScannerHealth(models.Model):
+	scanner = models.OneToOneField(Scanner, on_delete=models.CASCADE, primary_key=True, related_name='health')
+	#Exponentially weighted moving average of the call latency, in seconds.
+	latency = models.FloatField(null=True, default=None)
+	consecutive_failures = models.IntegerField(default=0)
+	last_success_at = models.DateTimeField(null=True, default=None)
+	last_failure_at = models.DateTimeField(null=True, default=None)
+
+	#Snapshot of the last health probe. "reachable" is None until the scanner has been probed.
+	reachable = models.BooleanField(null=True, default=None)
+	probed_at = models.DateTimeField(null=True, default=None)
+	probe_error = models.CharField(max_length=200, blank=True, default='')
+	#Probe latencies (in seconds) of the last PROBE_LATENCY_WINDOW successful probes, as a JSON list, and their percentiles.
+	latency_samples = models.TextField(default='[]')
+	latency_p50 = models.FloatField(null=True, default=None)
+	latency_p95 = models.FloatField(null=True, default=None)
+	#Number of scans running on the scanning tool, as reported by the tool (or counted here, for scanner types that don't report it).
+	running_scans = models.IntegerField(null=True, default=None)
+	licence_limit = models.IntegerField(null=True, default=None)
+	licence_expires = models.DateTimeField(null=True, default=None)
+
+	#Weight of the latest call in the latency average.
+	LATENCY_WEIGHT = 0.2
+	#Number of failed calls in a row after which a scanner is considered unreachable.
+	UNREACHABLE_FAILURES = 3
+	PROBE_LATENCY_WINDOW = 60
+
+	"""
+	Returns a Q object matching the health of scanners that are considered unreachable: their last probe failed, or their last UNREACHABLE_FAILURES calls did. Scanners that have no health recorded yet are considered reachable.
+	"""
+	@staticmethod
+	def unreachable_q():
+		return models.Q(reachable=False) | models.Q(consecutive_failures__gte=ScannerHealth.UNREACHABLE_FAILURES)
+	@staticmethod
+	def is_reachable(scanner_pk):
+		return not ScannerHealth.objects.filter(ScannerHealth.unreachable_q(), scanner_id=scanner_pk).exists()
+	@staticmethod
+	def unreachable_scanner_pks():
+		return set(ScannerHealth.objects.filter(ScannerHealth.unreachable_q()).values_list('scanner_id', flat=True))
+
+"""
+Record of a deleted scan or scanner, so that the list endpoints can tell clients which rows to drop when they ask for changes since an earlier request. Records older than DELETED_OBJECT_RETENTION are pruned periodically; clients whose cursor is older than that have to reload their list.
+"""
+class DeletedObject(models.Model):
+	SCAN = 'scan'
+	SCANNER = 'scanner'
+	MODEL_CHOICES = [
+		(SCAN, 'Scan'),
+		(SCANNER, 'Scanner'),
+	]
+	model_name = models.CharField(max_length=20, choices=MODEL_CHOICES)
+	object_pk = models.IntegerField()
+	#For deleted scans, the PK of the parent scanner (whose child scan count changed).
+	scanner_pk = models.IntegerField(null=True, default=None)
+	deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+	DELETED_OBJECT_RETENTION = 24 * 60 * 60
+
+	def __str__(self):
+		return f"{self.model_name} {self.object_pk}, deleted {self.deleted_at}"
+
 #Loads all scanner modules from scanner_types.
 from . import class_directory
 class_directory.load()
\ No newline at end of file
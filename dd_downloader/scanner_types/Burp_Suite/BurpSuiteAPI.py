@@ -0,0 +1,58 @@
+import requests
+import burpsuite
+from burpsuite.exceptions import BadRequestError, InternalServerError, ConnectionError, AuthorizationError
+from dd_downloader.transport import Transport, ScannerAPIError, iter_response
+
+#Helper class for interacting with the Burp Suite API.
+import logging
+logger = logging.getLogger(__name__)
+
+class BurpSuiteAPI(burpsuite.BurpSuiteApi):
+	"""Same as burpsuite.BurpSuiteApi, except that requests are sent through the shared pooled transport (with a timeout) instead of a new connection per call."""
+	def __init__(self, server_url: str, api_key: str = None, version: str = None, transport: Transport = None):
+		super().__init__(server_url=server_url, api_key=api_key, version=version)
+		self.transport = transport if transport is not None else Transport(None, server_url, api_key)
+
+	def _request(self, method: str, url: str, **kwargs):
+		try:
+			r = self.transport.request(method, url, **kwargs)
+		except requests.exceptions.ConnectionError:
+			raise ConnectionError("The Burp Suite server is not online")
+		logger.debug(f"{method} {url}, {r.status_code}")
+		if r.status_code in (400, 401) or r.status_code >= 500:
+			r.close()
+
+		if r.status_code == 400:
+			raise BadRequestError("Bad request. The Burp Suite server returned a 400 status code")
+		elif r.status_code == 401:
+			raise AuthorizationError("Not authorized. The Burp Suite server returned a 401 response")
+		elif r.status_code == 500:
+			raise InternalServerError("Internal server error. The Burp Suite server returned a 500 status code")
+		elif r.status_code > 500:
+			#The library only knows about 500s, but gateways in front of the server can return any 5xx, which are as transient.
+			raise ScannerAPIError(r.status_code, "The Burp Suite server is unavailable")
+		else:
+			return r
+
+	def _get(self, url, **kwargs):
+		return self._request('GET', url, **kwargs)
+
+	def _post(self, url, **kwargs):
+		return self._request('POST', url, **kwargs)
+
+	def ping(self):
+		""" Requests the root of the API, and returns the time the request took, in seconds. Raises an exception if the Burp Suite server is not online. """
+		endpoint = "{}/{}/".format(self.server_url, self.version)
+		if self.api_key:
+			endpoint = "{}/{}/{}/".format(self.server_url, self.api_key, self.version)
+		r = self._get(endpoint)
+		r.close()
+		return r.elapsed.total_seconds()
+
+	def get_scan_result(self, task_id):
+		""" Same as get_scan(task_id, raw=True), but returns an iterator over the chunks of the response body instead of loading it into memory. """
+		endpoint = "{}/{}/scan/{}".format(self.server_url, self.version, str(task_id))
+		if self.api_key:
+			endpoint = "{}/{}/{}/scan/{}".format(self.server_url, self.api_key, self.version, str(task_id))
+		r = self._get(endpoint, stream=True)
+		return iter_response(r)
@@ -1,11 +1,22 @@
 from django.db import models
-from dd_downloader.models import Scanner, Scan
+from dd_downloader.models import Scanner, Scan, Finding
+from dd_downloader.findings import iter_json_array
 from django.utils import timezone
-import burpsuite
+from dd_downloader.scanner_types.Burp_Suite.BurpSuiteAPI import BurpSuiteAPI
+from dd_downloader import transport
+from dd_downloader.transport import Transport, TransientScannerError, raise_if_transient
+from burpsuite.exceptions import ConnectionError, InternalServerError
 from django import forms
 from django.core.validators import MinValueValidator
 import logging
 logger = logging.getLogger('dd_downloader.scanner_types.Burp_Suite')
+
+"""
+Whether an exception raised by the Burp Suite API is a transient failure (see transport.is_transient), including the burpsuite library's own exceptions for connection errors and 500 responses.
+"""
+def is_transient(e):
+	return isinstance(e, (ConnectionError, InternalServerError)) or transport.is_transient(e)
+
 class Burp_Suite_Scanner(Scanner):
 	@staticmethod
 	def get_scanner_detail_template_path():
@@ -27,39 +38,47 @@ class Burp_Suite_Scanner(Scanner):
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.api_obj = burpsuite.BurpSuiteApi(server_url=self.api_url,api_key=self.api_key)
+		self.api_obj = BurpSuiteAPI(server_url=self.api_url,api_key=self.api_key,transport=Transport(self.pk, self.api_url, self.api_key, **self.get_transport_limits()))
 
 	def create_scan(self, endpoints): #Returns a Burp-specific scan ID.
 		try:
 			scan_id = self.api_obj.initiate_scan({'urls': endpoints})
 		except Exception as e:
+			raise_if_transient(e, is_transient)
 			logger.warning('Create scan API for Burp failed')
 			return None
 		else:
 			return scan_id
 
-	def poll_scan(self, burp_scan_id):
+	def poll_scan(self, burp_scan_id): #Returns whether the scan has succeeded and its progress.
 		try:
 			status_response = self.api_obj.get_scan(burp_scan_id)
 			status = status_response['scan_status']
+			progress = (status_response.get('scan_metrics') or {}).get('crawl_and_audit_progress')
 		except Exception as e:
+			raise_if_transient(e, is_transient)
 			logger.warning('Poll scan API for Burp failed')
 			return None
 		else:
 			if status == 'failed':
 				return None
 			else:
-				return (status == 'succeeded')
+				return (status == 'succeeded'), (progress / 100 if progress is not None else None)
 
 	def retrieve_scan(self, burp_scan_id):
 		try:
-			file = self.api_obj.get_scan(burp_scan_id, raw=True).content.decode()
+			file = self.api_obj.get_scan_result(burp_scan_id)
 		except Exception as e:
+			raise_if_transient(e, is_transient)
 			logger.warning('Retrieve scan API for Burp failed')
 			return None
 		else:
 			return file
 	
+	#The Burp Suite API doesn't list scans or report licence details, so only the latency is probed.
+	def probe(self):
+		return {'latency': self.api_obj.ping()}
+	
 	def __str__(self):
 		return f"{self.pk}, BS \"{self.scanner_name}\" at {self.api_url}, {str(self.create_date)}"
 	class Meta:
@@ -68,7 +87,10 @@ class Burp_Suite_Scanner(Scanner):
 
 class Burp_Suite_Scan(Scan):
 	endpoints = models.TextField()
+	TARGET_FIELD = 'endpoints'
 	scan_id = models.IntegerField(default=None,null=True,validators=[MinValueValidator(1)])
+	#Burp Suite starts scans as soon as they are created.
+	RUNNING_ACTIONS = [Scan.ACTION_CREATE]
 	def can_create(self, auto=False):
 		if auto:
 			return self.status == Scan.NEW
@@ -90,48 +112,100 @@ class Burp_Suite_Scan(Scan):
 		if not self.can_create():
 			logger.warning('Tried to create non-creatable Burp scan')
 			return
-		self.status = Scan.CREATING
-		self.save()
-		scan_id = self.scanner.create_scan(self.endpoints.split(','))
+		previous_status = self.status
+		if not self.transition(Scan.CREATING):
+			logger.warning('Burp scan was claimed by another worker')
+			return
+		try:
+			scan_id = self.scanner.create_scan(self.endpoints.split(','))
+		except TransientScannerError as e:
+			logger.warning(f"Burp start failed, retrying later: {e}")
+			self.retry_later(previous_status, Scan.ACTION_CREATE)
+			return
 		if scan_id is None:
-			self.status = Scan.ERRORS
 			logger.warning('Burp start failed')
+			self.transition(Scan.ERRORS)
 		else:
-			self.scan_id = scan_id
-			self.start_date = timezone.now()
-			self.status = Scan.IN_PROGRESS
-		self.save()
+			self.transition(Scan.IN_PROGRESS, scan_id=scan_id, start_date=timezone.now(), **Scan.first_poll_fields())
 
 	def poll(self):
-		poll = self.scanner.poll_scan(self.scan_id)
-		if poll:
-			logger.info('Burp poll finished')
-			self.status = Scan.FINISHED
-			self.end_date = timezone.now()
-			self.save()
-		elif poll is None:
+		if self.status != Scan.IN_PROGRESS:
+			return
+		try:
+			poll = self.scanner.poll_scan(self.scan_id)
+		except TransientScannerError as e:
+			logger.warning(f"Burp poll failed, retrying later: {e}")
+			self.retry_later(Scan.IN_PROGRESS, next_poll_at=None)
+			return
+		if poll is None:
 			logger.warning('Burp poll ended with error')
-			self.status = Scan.ERRORS
-			self.save()
+			self.transition(Scan.ERRORS, next_poll_at=None)
+		elif poll[0]:
+			logger.info('Burp poll finished')
+			self.transition(Scan.FINISHED, end_date=timezone.now(), progress=1, next_poll_at=None)
 		else:
 			logger.info('Burp poll still in progress')
+			self.schedule_next_poll(poll[1])
 
 	def retrieve(self):
 		if not self.can_retrieve():
 			logger.warning('Tried to retrieve non-retrievable Burp scan')
 			return
-		self.status = Scan.RETRIEVING
-		self.save()
-		file = self.scanner.retrieve_scan(self.scan_id)
-		if file is None:
-			logger.warning('File retrieval failed')
-			self.status = Scan.ERRORS
+		previous_status = self.status
+		if not self.transition(Scan.RETRIEVING):
+			logger.warning('Burp scan was claimed by another worker')
+			return
+		try:
+			file = self.scanner.retrieve_scan(self.scan_id)
+			if file is None:
+				logger.warning('File retrieval failed')
+				self.transition(Scan.ERRORS)
+				return
+			try:
+				self.save_result(file)
+			except Exception as e:
+				raise_if_transient(e, is_transient)
+				logger.exception('Streaming the Burp result failed')
+				self.transition(Scan.ERRORS)
+				return
+		except TransientScannerError as e:
+			logger.warning(f"Burp retrieval failed, retrying later: {e}")
+			self.retry_later(previous_status, Scan.ACTION_RETRIEVE)
 		else:
-			self.save_result(file)
 			logger.info('Retrieval success')
-			self.end_date = timezone.now()
-			self.status = Scan.RETRIEVED
-		self.save()
+			self.transition(Scan.RETRIEVED, end_date=timezone.now())
+
+	#Mapping of Burp Suite issue severities to finding severities.
+	ISSUE_SEVERITIES = {
+		'info': Finding.INFO,
+		'low': Finding.LOW,
+		'medium': Finding.MEDIUM,
+		'high': Finding.HIGH,
+	}
+
+	"""
+	Parses the "issue_found" events of the scan result one at a time.
+	"""
+	def parse_findings(self, stream):
+		from urllib.parse import urlsplit
+		for event in iter_json_array(stream, 'issue_events'):
+			if not isinstance(event, dict) or event.get('type') != 'issue_found' or not event.get('issue'):
+				continue
+			issue = event['issue']
+			origin = urlsplit(issue.get('origin') or '')
+			try:
+				port = origin.port or {'http': 80, 'https': 443}.get(origin.scheme)
+			except ValueError:
+				port = None
+			yield {
+				'host': origin.hostname or '',
+				'port': port,
+				'protocol': 'tcp',
+				'plugin_id': str(issue.get('type_index', '')),
+				'name': issue.get('name') or '',
+				'path': issue.get('path') or '',
+				'severity': Burp_Suite_Scan.ISSUE_SEVERITIES.get(issue.get('severity'), Finding.INFO),
+			}
 
 	class Meta:
 		app_label='dd_downloader'
@@ -139,9 +213,10 @@ class Burp_Suite_Scan(Scan):
 class Burp_Suite_Scanner_Create_Form(forms.ModelForm):
 	class Meta:
 		model = Burp_Suite_Scanner
-		fields = ['scanner_name', 'api_url', 'api_key', 'notes']
+		fields = ['scanner_name', 'api_url', 'api_key', 'max_running_scans', 'max_concurrent_calls', 'requests_per_second', 'pool', 'notes']
 
 class Burp_Suite_Scan_Create_Form(forms.ModelForm):
+	priority = forms.TypedChoiceField(choices=Scan.PRIORITY_CHOICES, coerce=int, initial=Scan.NORMAL, required=False, empty_value=Scan.NORMAL)
 	class Meta:
 		model = Burp_Suite_Scan
-		fields = ['scan_name', 'endpoints', 'auto_create','auto_retrieve','notes']
\ No newline at end of file
+		fields = ['scan_name', 'endpoints', 'auto_create','auto_retrieve','priority','pool','notes']
\ No newline at end of file
@@ -111,4 +111,21 @@ class BurpSuiteTestCase(TestCase):
 		self.assertEquals(scan_obj.auto_create, True)
 		self.assertEquals(scan_obj.auto_start, True)
 		self.assertEquals(scan_obj.auto_retrieve, True)
-		self.assertEquals(scan_obj.notes, 'edit_note')
\ No newline at end of file
+		self.assertEquals(scan_obj.notes, 'edit_note')
+
+	def test_parse_findings(self):
+		import io, json
+		from unittest import mock
+		from dd_downloader.models import Finding
+		result = json.dumps({'scan_status': 'succeeded', 'issue_events': [
+			{'id': '1', 'type': 'issue_found', 'issue': {'name': 'SQL injection', 'type_index': 1049088, 'origin': 'https://demo.testfire1.net', 'path': '/login', 'severity': 'high'}},
+			{'id': '2', 'type': 'issue_found', 'issue': {'name': 'Cookie without HttpOnly flag set', 'type_index': 5244416, 'origin': 'http://demo.testfire1.net:8080', 'path': '/', 'severity': 'low'}},
+		]})
+		scan_obj = Scan.objects.get(pk=self.bs1_pk)
+		#Read the result a few characters at a time, so that elements are split across reads.
+		with mock.patch('dd_downloader.findings.READ_SIZE', 7):
+			findings = list(scan_obj.parse_findings(io.StringIO(result)))
+		self.assertEqual([(f['host'], f['port'], f['plugin_id'], f['path'], f['severity']) for f in findings], [
+			('demo.testfire1.net', 443, '1049088', '/login', Finding.HIGH),
+			('demo.testfire1.net', 8080, '5244416', '/', Finding.LOW),
+		])
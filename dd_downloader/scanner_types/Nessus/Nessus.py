@@ -1,7 +1,8 @@
 from django.db import models
-from dd_downloader.models import Scanner, Scan
+from dd_downloader.models import Scanner, Scan, Finding
 from django.utils import timezone
 from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+from dd_downloader.transport import Transport, TransientScannerError, raise_if_transient
 from django import forms
 from django.core.validators import MinValueValidator
 import logging
@@ -35,7 +36,8 @@ class Nessus_Scanner(Scanner):
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.api_obj = NessusAPI(api_url=self.api_url, access_key=self.access_key, secret_key=self.secret_key, scan_policy_id=self.default_policy_id)
+		transport = Transport(self.pk, self.api_url, self.access_key, self.secret_key, verify=False, **self.get_transport_limits())
+		self.api_obj = NessusAPI(api_url=self.api_url, access_key=self.access_key, secret_key=self.secret_key, scan_policy_id=self.default_policy_id, transport=transport)
 
 
 	def create_scan(self, endpoints, override_policy_id = None): #Returns a Nessus-specific scan ID.
@@ -45,6 +47,7 @@ class Nessus_Scanner(Scanner):
 		try:
 			scan_id = self.api_obj.create_scan(scan_name = f"dd_downloader {self.pk}",targets=endpoints, override_policy_id=policy_id)
 		except Exception as e:
+			raise_if_transient(e)
 			logger.exception('Create scan API for Nessus failed')
 			return None
 		else:
@@ -54,24 +57,107 @@ class Nessus_Scanner(Scanner):
 		try:
 			self.api_obj.launch_scan(nessus_scan_id)
 		except Exception as e:
+			raise_if_transient(e)
 			logger.exception('Start scan API for Nessus failed')
+			return None
 		else:
 			return True
 
-	def poll_scan(self, nessus_scan_id):
+	def poll_scan(self, nessus_scan_id): #Returns whether the scan has completed and its progress.
 		try:
-			poll = self.api_obj.scan_details(nessus_scan_id)
+			poll = self.api_obj.scan_state(nessus_scan_id)
 		except Exception as e:
+			raise_if_transient(e)
 			logger.exception('Poll scan API for Nessus failed')
 			return None
 		else:
 			return poll
 
-	def retrieve_scan(self, nessus_scan_id):
+	def poll_scans(self): #Returns a dictionary of Nessus-specific scan IDs to whether they have completed.
+		try:
+			statuses = self.api_obj.scan_statuses()
+		except Exception as e:
+			raise_if_transient(e)
+			logger.exception('Batch poll scan API for Nessus failed')
+			return None
+		else:
+			return {scan_id: (status == 'completed') for scan_id, status in statuses.items()}
+
+	def poll_many(self, scan_list):
+		try:
+			polls = self.poll_scans()
+		except TransientScannerError as e:
+			logger.warning(f"Batch poll of Nessus failed, retrying later: {e}")
+			for scan_obj in scan_list:
+				scan_obj.retry_later(Scan.IN_PROGRESS, next_poll_at=None)
+			return
+		now = timezone.now()
+		for scan_obj in scan_list:
+			if polls is None:
+				scan_obj.update_poll(None)
+				continue
+			#Scans missing from the listing no longer exist on the scanner.
+			completed = polls.get(scan_obj.scan_id)
+			#The listing doesn't report progress, so it is fetched for the running scans whose next poll it can bring forward.
+			if completed is False and scan_obj.wants_progress(now):
+				try:
+					poll = self.poll_scan(scan_obj.scan_id)
+				except TransientScannerError:
+					poll = None
+				if poll is not None:
+					scan_obj.update_poll(*poll)
+					continue
+			scan_obj.update_poll(completed)
+
+	def probe(self):
+		import datetime
+		from django.conf import settings
+		status, latency = self.api_obj.server_status()
+		if status != 'ready':
+			raise Exception(f"Nessus is {status}")
+		licence = self.api_obj.server_licence()
+		ips = licence.get('ips')
+		expires = licence.get('expiration_date')
+		if isinstance(expires, (int, float)):
+			expires = datetime.datetime.fromtimestamp(expires, datetime.timezone.utc)
+			if not settings.USE_TZ:
+				expires = timezone.make_naive(expires)
+		else:
+			expires = None
+		return {
+			'latency': latency,
+			'running_scans': sum(1 for scan_status in self.api_obj.scan_statuses().values() if scan_status == 'running'),
+			#Unlimited licences report no number of IPs.
+			'licence_limit': ips if isinstance(ips, int) else None,
+			'licence_expires': expires,
+		}
+
+	def request_export(self, nessus_scan_id): #Returns a Nessus-specific export token.
+		try:
+			token = self.api_obj.export_scan(nessus_scan_id)
+		except Exception as e:
+			raise_if_transient(e)
+			logger.exception('Export request API for Nessus failed')
+			return None
+		else:
+			return token
+
+	def export_ready(self, export_token):
 		try:
-			file = self.api_obj.download_scan(nessus_scan_id)
+			ready = self.api_obj.export_ready(export_token)
 		except Exception as e:
-			logger.exception('Retrieve scan API for Nessus failed')
+			raise_if_transient(e)
+			logger.exception('Export status API for Nessus failed')
+			return None
+		else:
+			return ready
+
+	def download_export(self, export_token):
+		try:
+			file = self.api_obj.download_export(export_token)
+		except Exception as e:
+			raise_if_transient(e)
+			logger.exception('Export download API for Nessus failed')
 			return None
 		else:
 			return file
@@ -84,8 +170,27 @@ class Nessus_Scanner(Scanner):
 
 class Nessus_Scan(Scan):
 	endpoints = models.TextField()
+	TARGET_FIELD = 'endpoints'
 	override_policy_id = models.IntegerField(default=None,null=True,blank=True)
 	scan_id = models.IntegerField(null=True,default=None,validators=[MinValueValidator(1)])
+
+	#Retrieval is split into resumable steps (request export, wait for the export to be ready, download), each run as its own Celery task.
+	EXPORT_STATUS	= 'ES' #Export requested, waiting for Nessus to report it as ready.
+	EXPORT_DOWNLOAD	= 'ED' #Export is ready to be downloaded.
+	EXPORT_STEP_CHOICES = [
+		(EXPORT_STATUS, 'Waiting for export'),
+		(EXPORT_DOWNLOAD, 'Downloading export'),
+	]
+	#Export status checks are backed off from EXPORT_BACKOFF_MIN to EXPORT_BACKOFF_MAX seconds, and the retrieval fails after EXPORT_MAX_ATTEMPTS checks.
+	EXPORT_BACKOFF_MIN = 5
+	EXPORT_BACKOFF_MAX = 60
+	EXPORT_MAX_ATTEMPTS = 60
+	export_token = models.CharField(max_length=200,null=True,blank=True,default=None)
+	export_step = models.CharField(max_length=2,choices=EXPORT_STEP_CHOICES,null=True,blank=True,default=None)
+	export_attempts = models.IntegerField(default=0)
+	#Values of the export fields while no retrieval is underway.
+	NO_EXPORT = {'export_token': None, 'export_step': None, 'export_attempts': 0, 'retrieve_step_at': None}
+
 	def can_create(self, auto=False):
 		if auto:
 			return self.status == Scan.NEW
@@ -107,64 +212,168 @@ class Nessus_Scan(Scan):
 		if not self.can_create():
 			logger.warning('Tried to create non-creatable scan')
 			return
-		self.status = Scan.CREATING
-		self.save()
-		created_scan_id = self.scanner.create_scan(self.endpoints, self.override_policy_id)
+		previous_status = self.status
+		if not self.transition(Scan.CREATING):
+			logger.warning('Nessus scan was claimed by another worker')
+			return
+		try:
+			created_scan_id = self.scanner.create_scan(self.endpoints, self.override_policy_id)
+		except TransientScannerError as e:
+			logger.warning(f"Nessus creation failed, retrying later: {e}")
+			self.retry_later(previous_status, Scan.ACTION_CREATE)
+			return
 		if created_scan_id is None:
 			logger.warning('Nessus creation ended with error')
-			self.status = Scan.ERRORS
+			self.transition(Scan.ERRORS)
 		else:
-			self.scan_id = created_scan_id
-			self.status = Scan.CREATED
-		self.save()
+			self.transition(Scan.CREATED, scan_id=created_scan_id)
 	
 	def start(self):
 		if not self.can_start():
 			logger.warning('Tried to start non-startable scan')
-		self.status = Scan.STARTING
-		self.save()
-		start_result = self.scanner.start_scan(self.scan_id)
+			return
+		if not self.transition(Scan.STARTING):
+			logger.warning('Nessus scan was claimed by another worker')
+			return
+		try:
+			start_result = self.scanner.start_scan(self.scan_id)
+		except TransientScannerError as e:
+			logger.warning(f"Nessus start failed, retrying later: {e}")
+			self.retry_later(Scan.CREATED, Scan.ACTION_START)
+			return
 		if not start_result:
 			logger.warning('Nessus start ended with error')
-			self.status = Scan.ERRORS
+			self.transition(Scan.ERRORS)
 		else:
-			self.start_date = timezone.now()
-			self.status = Scan.IN_PROGRESS
-		self.save()
+			self.transition(Scan.IN_PROGRESS, start_date=timezone.now(), **Scan.first_poll_fields())
 
 	def poll(self):
 		if self.status != Scan.IN_PROGRESS:
 			return
-		poll = self.scanner.poll_scan(self.scan_id)
+		try:
+			poll = self.scanner.poll_scan(self.scan_id)
+		except TransientScannerError as e:
+			logger.warning(f"Nessus poll failed, retrying later: {e}")
+			self.retry_later(Scan.IN_PROGRESS, next_poll_at=None)
+			return
+		if poll is None:
+			self.update_poll(None)
+		else:
+			self.update_poll(*poll)
+
+	"""
+	Applies the result of a poll (True if finished, False if still in progress, None on a permanent error) and the reported progress, whether it came from poll() or from the scanner's poll_many().
+	"""
+	def update_poll(self, poll, progress=None):
+		if self.status != Scan.IN_PROGRESS:
+			return
 		if poll:
 			logger.info('Nessus poll finished')
-			self.status = Scan.FINISHED
-			self.end_date = timezone.now()
-			self.save()
+			self.transition(Scan.FINISHED, end_date=timezone.now(), progress=1, next_poll_at=None)
 		elif poll is None:
 			logger.warning('Nessus poll ended with error')
-			self.status = Scan.ERRORS
-			self.save()
+			self.transition(Scan.ERRORS, next_poll_at=None)
 		else:
 			logger.info('Nessus poll still in progress')
+			self.schedule_next_poll(progress)
 			
 
 	def retrieve(self):
 		if not self.can_retrieve():
 			logger.warning('Tried to retrieve non-retrievable scan')
 			return
-		self.status = Scan.RETRIEVING
-		self.save()
-		file = self.scanner.retrieve_scan(self.scan_id)
+		previous_status = self.status
+		if not self.transition(Scan.RETRIEVING):
+			logger.warning('Nessus scan was claimed by another worker')
+			return
+		try:
+			export_token = self.scanner.request_export(self.scan_id)
+		except TransientScannerError as e:
+			logger.warning(f"Nessus export request failed, retrying later: {e}")
+			self.retry_later(previous_status, Scan.ACTION_RETRIEVE, **Nessus_Scan.NO_EXPORT)
+			return
+		if export_token is None:
+			logger.warning('Nessus export request failed')
+			self.fail_retrieve()
+			return
+		if self.transition(Scan.RETRIEVING, export_token=export_token, export_step=Nessus_Scan.EXPORT_STATUS, export_attempts=0):
+			self.schedule_retrieve_step(Nessus_Scan.EXPORT_BACKOFF_MIN)
+
+	"""
+	Runs the current retrieval step. Steps that fail transiently are run again after a backoff (see Scan.retry_later), from the same step.
+	"""
+	def continue_retrieve(self):
+		if self.status != Scan.RETRIEVING or self.export_step is None:
+			return
+		try:
+			self.run_retrieve_step()
+		except TransientScannerError as e:
+			logger.warning(f"Nessus retrieval step failed, retrying later: {e}")
+			self.retry_later(Scan.RETRIEVING, **Nessus_Scan.NO_EXPORT)
+
+	def run_retrieve_step(self):
+		if self.export_step == Nessus_Scan.EXPORT_STATUS:
+			ready = self.scanner.export_ready(self.export_token)
+			if ready is None:
+				logger.warning('Nessus export failed')
+				self.fail_retrieve()
+				return
+			if not ready:
+				if self.export_attempts + 1 >= Nessus_Scan.EXPORT_MAX_ATTEMPTS:
+					logger.warning('Nessus export did not become ready in time')
+					self.fail_retrieve()
+					return
+				if not self.transition(Scan.RETRIEVING, export_attempts=self.export_attempts + 1):
+					return
+				countdown = min(Nessus_Scan.EXPORT_BACKOFF_MIN * 1.5 ** self.export_attempts, Nessus_Scan.EXPORT_BACKOFF_MAX)
+				logger.info(f"Nessus export not ready, checking again in {countdown:.0f}s")
+				self.schedule_retrieve_step(countdown)
+				return
+			if not self.transition(Scan.RETRIEVING, export_step=Nessus_Scan.EXPORT_DOWNLOAD):
+				return
+		file = self.scanner.download_export(self.export_token)
 		if file is None:
 			logger.warning('File retrieval failed')
-			self.status = Scan.ERRORS
-		else:
+			self.fail_retrieve()
+			return
+		try:
 			self.save_result(file)
-			logger.info('Retrieval successful')
-			self.status = Scan.RETRIEVED
-		self.save()
+		except Exception as e:
+			raise_if_transient(e)
+			logger.exception('Streaming the Nessus export failed')
+			self.fail_retrieve()
+			return
+		logger.info('Retrieval successful')
+		self.transition(Scan.RETRIEVED, **Nessus_Scan.NO_EXPORT)
+
+	#Mapping of the "Risk" column of Nessus CSV exports to finding severities.
+	RISK_SEVERITIES = {
+		'None': Finding.INFO,
+		'Low': Finding.LOW,
+		'Medium': Finding.MEDIUM,
+		'High': Finding.HIGH,
+		'Critical': Finding.CRITICAL,
+	}
+
+	"""
+	Parses the CSV export row by row. Nessus exports one row per plugin, host, port and CVE.
+	"""
+	def parse_findings(self, stream):
+		import csv
+		for row in csv.DictReader(stream):
+			port = row.get('Port') or ''
+			yield {
+				'host': row.get('Host') or '',
+				'port': int(port) if port.isdigit() else None,
+				'protocol': row.get('Protocol') or '',
+				'plugin_id': row.get('Plugin ID') or '',
+				'name': row.get('Name') or '',
+				'cve': row.get('CVE') or '',
+				'severity': Nessus_Scan.RISK_SEVERITIES.get(row.get('Risk'), Finding.INFO),
+			}
 
+	def fail_retrieve(self):
+		self.transition(Scan.ERRORS, **Nessus_Scan.NO_EXPORT)
 
 	def __str__(self):
 		return f"{self.pk}, NS \"{self.scan_name}\", {str(self.create_date.time())}"
@@ -178,10 +387,11 @@ Classes for defining the creation forms. Ensure that the fields are in the order
 class Nessus_Scanner_Create_Form(forms.ModelForm):
 	class Meta:
 		model = Nessus_Scanner
-		fields = ['scanner_name', 'api_url', 'access_key', 'secret_key', 'default_policy_id', 'notes']
+		fields = ['scanner_name', 'api_url', 'access_key', 'secret_key', 'default_policy_id', 'max_running_scans', 'max_concurrent_calls', 'requests_per_second', 'pool', 'notes']
 
 
 class Nessus_Scan_Create_Form(forms.ModelForm):
+	priority = forms.TypedChoiceField(choices=Scan.PRIORITY_CHOICES, coerce=int, initial=Scan.NORMAL, required=False, empty_value=Scan.NORMAL)
 	class Meta:
 		model = Nessus_Scan
-		fields = ['scan_name', 'endpoints', 'override_policy_id', 'auto_create','auto_start','auto_retrieve','notes']
+		fields = ['scan_name', 'endpoints', 'override_policy_id', 'auto_create','auto_start','auto_retrieve','priority','pool','notes']
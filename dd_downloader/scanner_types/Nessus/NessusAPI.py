@@ -1,4 +1,5 @@
 import requests, json, time, urllib
+from dd_downloader.transport import Transport, ScannerAPIError, iter_response
 import urllib3
 urllib3.disable_warnings() #Disable insecurerequestwarnings caused from Nessus web portal not having a valid SSL cert
 
@@ -9,7 +10,7 @@ logger = logging.getLogger(__name__)
 class NessusAPI:
 	"""The Nessus API requires that you authenticate with an access key and a secret key."""
 	"""No wrapper library exists for Nessus Professional, so this will need to be updated whenever Nessus's API changes"""
-	def __init__(self, api_url: str, access_key: str = None, secret_key: str = None, username: str = None, password: str = None, scan_completion_interval: int = 10, scan_policy_id: int = None, verify = False, timeout = 5):
+	def __init__(self, api_url: str, access_key: str = None, secret_key: str = None, username: str = None, password: str = None, scan_completion_interval: int = 10, scan_policy_id: int = None, verify = False, timeout = 5, transport: Transport = None):
 		self.api_url = api_url
 		self.session_token = ''
 		self.verify = verify
@@ -24,6 +25,9 @@ class NessusAPI:
 		self.POLICY_ID = scan_policy_id
 		self.TIMEOUT = timeout
 
+		#All requests go through the pooled keep-alive session shared by this worker process.
+		self.transport = transport if transport is not None else Transport(None, api_url, access_key, secret_key, username, password, timeout=timeout, verify=verify)
+
 	#API urls
 	scans_api = '/scans'
 	scans_launch_api = '/scans/{scan_id}/launch'
@@ -32,6 +36,8 @@ class NessusAPI:
 	token_status_api = '/tokens/{token}/status'
 	download_token_api = '/tokens/{token}/download'
 	session_api = '/session'
+	server_status_api = '/server/status'
+	server_properties_api = '/server/properties'
 
 	#Nessus blocks certain API calls for users who are not using Nessus Manager.
 	#To allow the web application to use the API calls, however, the web application includes a secret hard-coded API token into its requests.
@@ -56,7 +62,7 @@ class NessusAPI:
 			raise Exception('Incomplete authentication information provided!')
 
 	def get_session_token(self, username: str, password: str):
-		response = requests.post(
+		response = self.transport.post(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.session_api,
 			json = {
@@ -69,7 +75,7 @@ class NessusAPI:
 		return response
 
 	def scans_list(self):
-		response = requests.get(
+		response = self.transport.get(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.scans_api,
 			headers = self.auth_header(),
@@ -78,6 +84,40 @@ class NessusAPI:
 		logger.debug(f"{self.api_url+self.scans_api}, {response.status_code}")
 		return response
 
+	#Return a dictionary mapping the ID of every scan on the scanner to its status string, from a single scan listing request.
+	def scan_statuses(self):
+		response = self.scans_list()
+		if (response.status_code != 200):
+			logger.error('Nessus scan listing failed')
+			raise ScannerAPIError(response.status_code, 'Scan listing unsuccessful')
+		scans = json.loads(response.content)['scans'] or []
+		return {scan['id']: scan['status'] for scan in scans}
+
+	#Return the status of the Nessus server ('ready' once it can take scans) and the time the request took, in seconds. This request needs no authentication, so it is the cheapest check of whether Nessus is up.
+	def server_status(self):
+		response = self.transport.get(
+			timeout = self.TIMEOUT,
+			url = self.api_url+self.server_status_api,
+			verify = self.verify
+		)
+		logger.debug(f"{self.api_url+self.server_status_api}, {response.status_code}")
+		if (response.status_code != 200):
+			raise ScannerAPIError(response.status_code, 'Server status request unsuccessful')
+		return json.loads(response.content)['status'], response.elapsed.total_seconds()
+
+	#Return the licence details of the Nessus server (e.g. its "type", the number of "ips" it allows, and its "expiration_date").
+	def server_licence(self):
+		response = self.transport.get(
+			timeout = self.TIMEOUT,
+			url = self.api_url+self.server_properties_api,
+			headers = self.auth_header(),
+			verify = self.verify
+		)
+		logger.debug(f"{self.api_url+self.server_properties_api}, {response.status_code}")
+		if (response.status_code != 200):
+			raise ScannerAPIError(response.status_code, 'Server properties request unsuccessful')
+		return json.loads(response.content).get('license') or {}
+
 	#Return ID of scan
 	def create_scan(self, targets: str, scan_name: str, override_policy_id = None):
 		bypass_header = self.auth_header()
@@ -111,7 +151,7 @@ class NessusAPI:
 					'text_targets': targets
 				}
 			}
-		response = requests.post(
+		response = self.transport.post(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.scans_api,
 			data = json.dumps(data),
@@ -121,7 +161,7 @@ class NessusAPI:
 		logger.debug(f"{self.api_url+self.scans_api}, {response.status_code}")
 		if (response.status_code != 200):
 			logger.error('Nessus scan creation failed')
-			return None
+			raise ScannerAPIError(response.status_code, 'Scan creation unsuccessful')
 
 		try:
 			return json.loads(response.content)['scan']['id']
@@ -133,27 +173,40 @@ class NessusAPI:
 	def launch_scan(self, scan_id: int):
 		bypass_header = self.auth_header()
 		bypass_header['X-Api-Token'] = self.BYPASS_TOKEN
-		response = requests.post(
+		response = self.transport.post(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.scans_launch_api.format(scan_id = scan_id),
 			headers = bypass_header,
 			verify = self.verify
 		)
 		logger.debug(f"{self.api_url+self.scans_launch_api.format(scan_id = scan_id)}, {response.status_code}")
-		return (response.status_code == 200)
+		if (response.status_code != 200):
+			logger.error('Nessus scan launch failed')
+			raise ScannerAPIError(response.status_code, 'Scan launch unsuccessful')
+		return True
 
 	def scan_details(self, scan_id: int):
-		response = requests.get(
+		return self.scan_state(scan_id)[0]
+
+	#Return whether the scan has completed, and its progress (0 to 1) summed over its hosts, or None if Nessus doesn't report any.
+	def scan_state(self, scan_id: int):
+		response = self.transport.get(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.scans_details_api.format(scan_id = scan_id),
 			headers = self.auth_header(),
 			verify = self.verify
 		)
 		logger.debug(f"{self.api_url+self.scans_details_api.format(scan_id = scan_id)}, {response.status_code}")
-		return (json.loads(response.content)['info']['status'] == 'completed')
+		if (response.status_code != 200):
+			raise ScannerAPIError(response.status_code, 'Scan details request unsuccessful')
+		details = json.loads(response.content)
+		hosts = details.get('hosts') or []
+		current = sum(host.get('scanprogresscurrent', 0) for host in hosts)
+		total = sum(host.get('scanprogresstotal', 0) for host in hosts)
+		return (details['info']['status'] == 'completed'), (current / total if total else None)
 
 	def export_scan(self, scan_id: str):
-		response = requests.post(
+		response = self.transport.post(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.export_request_api.format(scan_id = scan_id),
 			data = {'format':'csv'},
@@ -161,10 +214,12 @@ class NessusAPI:
 			verify = self.verify
 		)
 		logger.debug(f"{self.api_url+self.export_request_api.format(scan_id = scan_id)}, {response.status_code}")
+		if (response.status_code != 200):
+			raise ScannerAPIError(response.status_code, 'Export request unsuccessful')
 		return json.loads(response.content)['token']
 
 	def export_status(self, token: str):
-		response = requests.get(
+		response = self.transport.get(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.token_status_api.format(token = token),
 			headers = self.auth_header(),
@@ -173,35 +228,35 @@ class NessusAPI:
 		logger.debug(f"{self.api_url+self.token_status_api.format(token = token),}, {response.status_code}")
 		return response
 
-	def download_export_request(self, token: str):
-		response = requests.get(
+	def download_export_request(self, token: str, stream: bool = False):
+		response = self.transport.get(
 			timeout = self.TIMEOUT,
 			url = self.api_url+self.download_token_api.format(token = token),
 			headers = self.auth_header(),
-			verify = self.verify
+			verify = self.verify,
+			stream = stream
 		)
 		logger.debug(f"{self.api_url+self.download_token_api.format(token = token)}, {response.status_code}")
 		return response
 
 
-	def download_scan(self, scan_id: str):
-		download_token = self.export_scan(scan_id)
-		status = ''
-		attempts = 1
-		while (status != 'ready'):
-			time.sleep(10)
-			logger.debug(f"Export progress: poll attempt {attempts}")
-			status_response = self.export_status(download_token)
-			if (status_response.status_code == 200):
-				status = json.loads(status_response.content)['status']
-
-			attempts += 1
+	#Return True once an export requested with export_scan() is ready to be downloaded.
+	#Unsuccessful responses raise ScannerAPIError, so that e.g. an expired token (404) fails the retrieval at once, while 5xx responses are retried as transient failures.
+	def export_ready(self, token: str):
+		status_response = self.export_status(token)
+		if (status_response.status_code != 200):
+			raise ScannerAPIError(status_response.status_code, 'Export status request unsuccessful')
+		status = json.loads(status_response.content)['status']
+		if (status == 'error'):
+			raise ScannerAPIError(status_response.status_code, 'Export failed on the scanner')
+		return (status == 'ready')
 
-		#Download scan
-		download_response = self.download_export_request(download_token)
+	#Download an export that export_ready() reported as ready. Returns an iterator over the chunks of the CSV, so that it never has to be held in memory as a whole.
+	def download_export(self, token: str):
+		download_response = self.download_export_request(token, stream=True)
 		if (download_response.status_code != 200):
+			download_response.close()
 			logger.error('download_response ! 200')
-			raise Exception('Download unsuccessful')
+			raise ScannerAPIError(download_response.status_code, 'Download unsuccessful')
 
-		csv = download_response.content.decode().replace('\r','')
-		return csv
+		return iter_response(download_response)
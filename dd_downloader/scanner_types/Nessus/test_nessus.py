@@ -128,4 +128,162 @@ class NessusTestCase(TestCase):
 		self.assertEquals(scan_obj.auto_start, True)
 		self.assertEquals(scan_obj.auto_retrieve, True)
 		self.assertEquals(scan_obj.override_policy_id, 233)
-		self.assertEquals(scan_obj.notes, 'edit_note')
\ No newline at end of file
+		self.assertEquals(scan_obj.notes, 'edit_note')
+	def test_poll_many(self):
+		#A single scan listing should update every in-progress scan of the scanner.
+		from unittest import mock
+		from dd_downloader.celery_tasks import poll_scans
+		from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+		for ns_pk, scan_id in [(self.ns1_pk, 11), (self.ns2_pk, 12)]:
+			ns = Scan.objects.get(pk=ns_pk)
+			ns.status = Scan.IN_PROGRESS
+			ns.scan_id = scan_id
+			ns.save()
+
+		with mock.patch.object(NessusAPI, 'scan_statuses', return_value={11: 'completed', 12: 'running'}) as scan_statuses:
+			poll_scans(self.n1_pk, [self.ns1_pk, self.ns2_pk])
+		self.assertEqual(scan_statuses.call_count, 1)
+		self.assertEqual(Scan.objects.get(pk=self.ns1_pk).status, Scan.FINISHED)
+		self.assertEqual(Scan.objects.get(pk=self.ns2_pk).status, Scan.IN_PROGRESS)
+
+	def test_batch_poll_progress(self):
+		#Batch polls fetch the progress of long-running scans, so that their next poll is brought forward as they near completion.
+		from datetime import timedelta
+		from unittest import mock
+		from django.utils import timezone
+		from dd_downloader import celery_tasks
+		from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+		now = timezone.now()
+		for ns_pk, scan_id, start_date in [(self.ns1_pk, 11, now - timedelta(hours=1)), (self.ns2_pk, 12, now)]:
+			Scan.objects.filter(pk=ns_pk).update(status=Scan.IN_PROGRESS, start_date=start_date, next_poll_at=now)
+			ns = Scan.objects.get(pk=ns_pk)
+			ns.scan_id = scan_id
+			ns.save()
+
+		with mock.patch.object(celery_tasks.poll_scans, 'delay', side_effect=celery_tasks.poll_scans), \
+			mock.patch.object(NessusAPI, 'scan_statuses', return_value={11: 'running', 12: 'running'}), \
+			mock.patch.object(NessusAPI, 'scan_state', return_value=(False, 0.9)) as scan_state:
+			celery_tasks.dispatch_actionable_scans(celery_tasks.actionable_scans(self.n1_pk))
+		#Only the scan that has run long enough has its progress fetched.
+		scan_state.assert_called_once_with(11)
+		ns = Scan.objects.get(pk=self.ns1_pk)
+		self.assertEqual(ns.progress, 0.9)
+		#An hour in at 90%, the next poll is in half of the estimated remaining 400s, rather than in a tenth of the elapsed time.
+		delay = (ns.next_poll_at - timezone.now()).total_seconds()
+		self.assertTrue(190 < delay <= 200, delay)
+		ns = Scan.objects.get(pk=self.ns2_pk)
+		self.assertEqual((ns.status, ns.progress), (Scan.IN_PROGRESS, None))
+
+	def test_transient_failures_are_retried(self):
+		#Dropped polls and 5xx responses are retried on a backoff, and only permanent failures or exhausted retries end in ERRORS.
+		import requests
+		from datetime import timedelta
+		from unittest import mock
+		from django.utils import timezone
+		from dd_downloader.celery_tasks import actionable_scans
+		from dd_downloader.transport import ScannerAPIError
+		from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+		ns = Scan.objects.get(pk=self.ns1_pk)
+		ns.status = Scan.IN_PROGRESS
+		ns.scan_id = 11
+		ns.start_date = timezone.now()
+		ns.save()
+
+		with mock.patch.object(NessusAPI, 'scan_state', side_effect=[requests.Timeout(), ScannerAPIError(503, 'Unavailable'), (False, 0.5), ScannerAPIError(404, 'Not found')]):
+			ns.poll()
+			self.assertEqual((ns.status, ns.retry_count), (Scan.IN_PROGRESS, 1))
+			self.assertGreater(ns.next_poll_at, timezone.now() + timedelta(seconds=Scan.RETRY_BACKOFF_MIN - 5))
+			ns.poll()
+			self.assertEqual((ns.status, ns.retry_count), (Scan.IN_PROGRESS, 2))
+			ns.poll()
+			self.assertEqual((ns.status, ns.retry_count, ns.progress), (Scan.IN_PROGRESS, 0, 0.5))
+			ns.poll()
+			self.assertEqual(ns.status, Scan.ERRORS)
+
+		ns = Scan.objects.get(pk=self.ns2_pk)
+		ns.auto_create = True
+		ns.save()
+		with mock.patch.object(NessusAPI, 'create_scan', side_effect=requests.ConnectionError()):
+			ns.create()
+			ns = Scan.objects.get(pk=self.ns2_pk)
+			self.assertEqual((ns.status, ns.retry_count, ns.queued_action), (Scan.NEW, 1, Scan.ACTION_CREATE))
+			self.assertFalse(actionable_scans().filter(pk=self.ns2_pk).exists())
+			Scan.objects.filter(pk=self.ns2_pk).update(retry_count=Scan.MAX_RETRIES, retry_at=None)
+			ns = Scan.objects.get(pk=self.ns2_pk)
+			ns.create()
+		ns = Scan.objects.get(pk=self.ns2_pk)
+		self.assertEqual((ns.status, ns.retry_count), (Scan.ERRORS, 0))
+
+		#Retries of a retrieval step are cleared once a step succeeds, so that they don't add up over a long export.
+		Scan.objects.filter(pk=self.ns1_pk).update(status=Scan.RETRIEVING, retry_count=3)
+		ns = Scan.objects.get(pk=self.ns1_pk)
+		ns.export_token, ns.export_step, ns.export_attempts = 'token1', ns.EXPORT_STATUS, 0
+		ns.save()
+		with mock.patch.object(NessusAPI, 'export_ready', return_value=False), mock.patch.object(Scan, 'schedule_retrieve_step'):
+			ns.continue_retrieve()
+		ns = Scan.objects.get(pk=self.ns1_pk)
+		self.assertEqual((ns.status, ns.export_attempts, ns.retry_count), (Scan.RETRIEVING, 1, 0))
+
+	def test_retrieve_steps(self):
+		#Retrieval requests an export, backs off while it is not ready, then downloads it, one Celery task per step.
+		from unittest import mock
+		from dd_downloader.celery_tasks import continue_scan_retrieval
+		from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+		ns = Scan.objects.get(pk=self.ns1_pk)
+		ns.status = Scan.FINISHED
+		ns.scan_id = 11
+		ns.save()
+
+		with mock.patch.object(continue_scan_retrieval, 'apply_async') as apply_async, \
+			mock.patch.object(NessusAPI, 'export_scan', return_value='token1'), \
+			mock.patch.object(NessusAPI, 'export_ready', side_effect=[False, True]), \
+			mock.patch.object(NessusAPI, 'download_export', return_value='Plugin ID,Host\n1,10.0.0.1\n'), \
+			mock.patch.object(Scan, 'save_result') as save_result:
+			ns.retrieve()
+			ns = Scan.objects.get(pk=self.ns1_pk)
+			self.assertEqual((ns.status, ns.export_token, ns.export_step), (Scan.RETRIEVING, 'token1', ns.EXPORT_STATUS))
+			continue_scan_retrieval(self.ns1_pk)
+			self.assertEqual(Scan.objects.get(pk=self.ns1_pk).export_attempts, 1)
+			continue_scan_retrieval(self.ns1_pk)
+		self.assertEqual(apply_async.call_count, 2)
+		save_result.assert_called_once_with('Plugin ID,Host\n1,10.0.0.1\n')
+		ns = Scan.objects.get(pk=self.ns1_pk)
+		self.assertEqual((ns.status, ns.export_token, ns.export_step), (Scan.RETRIEVED, None, None))
+
+	def test_export_status_errors(self):
+		#An unknown or expired export token fails the retrieval at once, while server errors are retried.
+		from unittest import mock
+		from dd_downloader.transport import TransientScannerError
+		from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+		scanner_obj = Scanner.objects.get(pk=self.n1_pk)
+		with mock.patch.object(NessusAPI, 'export_status', return_value=mock.Mock(status_code=404)):
+			self.assertIsNone(scanner_obj.export_ready('token1'))
+		with mock.patch.object(NessusAPI, 'export_status', return_value=mock.Mock(status_code=503)):
+			with self.assertRaises(TransientScannerError):
+				scanner_obj.export_ready('token1')
+		with mock.patch.object(NessusAPI, 'export_status', return_value=mock.Mock(status_code=200, content=b'{"status": "error"}')):
+			self.assertIsNone(scanner_obj.export_ready('token1'))
+
+	def test_health_probe(self):
+		#Probes store a snapshot of the scanner's state, which the scanner pages show without any API calls.
+		from unittest import mock
+		from dd_downloader.celery_tasks import probe_scanner
+		from dd_downloader.models import ScannerHealth
+		from dd_downloader.scanner_types.Nessus.NessusAPI import NessusAPI
+		with mock.patch.object(NessusAPI, 'server_status', side_effect=[('ready', 0.1), ('ready', 0.3), Exception('Connection refused')]), \
+			mock.patch.object(NessusAPI, 'server_licence', return_value={'type': 'home', 'ips': 16, 'expiration_date': 1893456000}), \
+			mock.patch.object(NessusAPI, 'scan_statuses', return_value={11: 'running', 12: 'completed'}):
+			probe_scanner(self.n1_pk)
+			probe_scanner(self.n1_pk)
+			health = ScannerHealth.objects.get(scanner_id=self.n1_pk)
+			self.assertEqual((health.reachable, health.running_scans, health.licence_limit), (True, 1, 16))
+			self.assertEqual((health.latency_p50, health.latency_p95), (0.1, 0.3))
+			self.assertEqual(health.licence_expires.year, 2030)
+			with mock.patch.object(NessusAPI, 'scan_state') as scan_state:
+				resp = self.client.get(f"/dd_downloader/scanner/{self.n1_pk}/")
+				self.assertContains(resp, "p50 0.100s, p95 0.300s")
+				scan_state.assert_not_called()
+			probe_scanner(self.n1_pk)
+		health = ScannerHealth.objects.get(scanner_id=self.n1_pk)
+		self.assertEqual((health.reachable, health.probe_error), (False, 'Connection refused'))
+		self.assertFalse(ScannerHealth.is_reachable(self.n1_pk))
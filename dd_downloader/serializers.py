@@ -0,0 +1,78 @@
+from django.db.models import Count
+from django.urls import reverse
+from django.utils.html import escape
+from .models import Scanner, Scan
+
+#Serialization of the scan/scanner lists for the AJAX endpoints.
+#Rows are read as non-polymorphic .values() projections (so no scanner type classes or API objects are instantiated), related names and counts come from the same query, and detail URLs are built from a prefix computed once per response.
+
+SCAN_LIST_FIELDS = ('pk', 'scan_name', 'status', 'auto_create', 'auto_start', 'auto_retrieve', 'scanner_id', 'scanner__scanner_name', 'create_date', 'start_date', 'end_date')
+SCANNER_LIST_FIELDS = ('pk', 'scanner_name', 'create_date', 'scan_count', 'health__reachable', 'health__latency_p50', 'health__latency_p95', 'health__running_scans', 'health__probed_at')
+
+"""
+Returns a function that builds the absolute URL of a detail page from a PK, reversing the URL only once.
+"""
+def detail_url_builder(request, view_name):
+	url = request.build_absolute_uri(reverse(view_name, args=[0]))
+	prefix, _, suffix = url.rpartition('/0/')
+	return lambda pk: f"{prefix}/{pk}/{suffix}"
+
+def scan_list_to_json(request, scan_list):
+	scan_url = detail_url_builder(request, 'dd_downloader:scan detail page')
+	scanner_url = detail_url_builder(request, 'dd_downloader:scanner detail page')
+	status_names = dict(Scan.SCAN_STATUS_CHOICES)
+	scan_json = {'data':[]}
+	for scan in scan_list.non_polymorphic().values(*SCAN_LIST_FIELDS):
+		scan_json['data'].append ({
+			'PK':scan['pk'],
+			'Scan Name': {
+				'URL': scan_url(scan['pk']),
+				'Name': escape(scan['scan_name'])
+			},
+			'Status':escape(status_names.get(scan['status'], scan['status'])),
+			'Automation': {
+				'Auto Create': scan['auto_create'],
+				'Auto Start': scan['auto_start'],
+				'Auto Retrieve': scan['auto_retrieve'],
+			},
+			'Parent Scanner': {
+				'URL': scanner_url(scan['scanner_id']),
+				'Name': escape(scan['scanner__scanner_name'])
+			},
+			'Created On':scan['create_date'],
+			'Started On':scan['start_date'],
+			'Ended On':scan['end_date']
+		})
+	return scan_json
+
+"""
+Returns a non-polymorphic scanner queryset annotated with each scanner's number of child scans. Must be applied before the queryset is sliced.
+"""
+def annotate_scanners(scanner_list):
+	scanner_list = scanner_list.non_polymorphic()
+	if 'scan_count' not in scanner_list.query.annotations:
+		scanner_list = scanner_list.annotate(scan_count=Count('scan'))
+	return scanner_list
+
+def scanner_list_to_json(request, scanner_list):
+	scanner_url = detail_url_builder(request, 'dd_downloader:scanner detail page')
+	scanner_json = {'data':[]}
+	for scanner in annotate_scanners(scanner_list).values(*SCANNER_LIST_FIELDS):
+		scanner_json['data'].append ({
+			'PK':scanner['pk'],
+			'Scanner Name': {
+				'URL':scanner_url(scanner['pk']),
+				'Name':escape(scanner['scanner_name'])
+			},
+			'# of Child Scans': scanner['scan_count'],
+			#Health snapshot of the last probe (see ScannerHealth). "Reachable" is None for scanners that haven't been probed.
+			'Health': {
+				'Reachable': scanner['health__reachable'],
+				'Latency p50': scanner['health__latency_p50'],
+				'Latency p95': scanner['health__latency_p95'],
+				'Running Scans': scanner['health__running_scans'],
+				'Probed On': scanner['health__probed_at'],
+			},
+			'Created On':scanner['create_date']
+		})
+	return scanner_json
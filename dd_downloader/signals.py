@@ -0,0 +1,36 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Scanner, Scan, DeletedObject, ResultBlob, ScanDiff
+from . import events
+
+"""
+Records deleted scans and scanners, so that the list endpoints can report deletions to clients that only ask for changes.
+The receivers are connected to the base classes, which also receive the signals of deleted scanner type subclasses.
+"""
+@receiver(post_delete, sender=Scan, dispatch_uid='dd_downloader_scan_deleted')
+def scan_deleted(sender, instance, **kwargs):
+	DeletedObject.objects.create(model_name=DeletedObject.SCAN, object_pk=instance.pk, scanner_pk=instance.scanner_id)
+	events.publish_scan(instance, deleted=True)
+	if instance.result_id is not None:
+		ResultBlob.release(instance.result_id)
+
+@receiver(post_delete, sender=Scanner, dispatch_uid='dd_downloader_scanner_deleted')
+def scanner_deleted(sender, instance, **kwargs):
+	DeletedObject.objects.create(model_name=DeletedObject.SCANNER, object_pk=instance.pk)
+
+"""
+Publishes the status of saved scans to the event stream.
+Unlike post_delete, post_save is only sent with the concrete class of the saved object as sender, so this receiver is connected to every sender.
+"""
+@receiver(post_save, dispatch_uid='dd_downloader_scan_saved')
+def scan_saved(sender, instance, **kwargs):
+	if isinstance(instance, Scan):
+		events.publish_scan(instance)
+
+"""
+Releases the change list of deleted scan diffs, including those deleted along with their scan.
+"""
+@receiver(post_delete, sender=ScanDiff, dispatch_uid='dd_downloader_scan_diff_deleted')
+def scan_diff_deleted(sender, instance, **kwargs):
+	if instance.changes_id is not None:
+		ResultBlob.release(instance.changes_id)
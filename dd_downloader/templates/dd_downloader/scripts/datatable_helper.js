@@ -8,30 +8,61 @@ function filterColumn (table, i) {
 	table.column( i ).search(
 		$('#col'+i+'_filter').val(),reg,!reg).draw();
 }
-function batch_download_command() {
+//Batch targets. Batch commands act on the selected rows, or with "Select all filtered" on every row matched by the current filters.
+//Filtered commands send the filters of the table's last request instead of PKs, and the server resolves them, so they don't depend on how many rows are loaded.
+//Pages can add fixed filters to batch_filter_params (e.g. the scanner of a scanner's page).
+var select_filtered = false;
+var batch_filter_params = {};
+function select_all_filtered(table) {
+	table.rows({page: 'current'}).select();
+	select_filtered = true;
+	table.one('user-select deselect', function() {select_filtered = false;});
+}
+//Returns the number of targets and the request parameters that identify them, or null if nothing is selected.
+//Without any filters, "Select all filtered" targets every row, which the server only accepts once the user has confirmed it.
+function batch_targets() {
+	if (select_filtered) {
+		let params = $.extend({}, table.ajax.params(), batch_filter_params, {'scope': 'filter'});
+		if (!has_filters(params)) {
+			if (!confirm("No filters are set, so this targets every row, including those that aren't loaded. Continue?")) return null;
+			params['confirm'] = 'all';
+		}
+		return {'count': table.page.info().recordsDisplay, 'params': params};
+	}
 	arr = table.rows({selected: true}).data();
-	if (arr.length <= 0) return;
+	if (arr.length <= 0) return null;
 	pks = [];
 	for (var i = 0; i < arr.length; i++) {
 		pks.push(arr[i]['PK']);
 	}
-	if (!confirm("You are about to batch-download " + pks.length + " scan(s). Are you sure?")) {
+	return {'count': pks.length, 'params': {'pk_list': pks}};
+}
+function has_filters(params) {
+	if (params['scanner'] || params['search']['value']) return true;
+	for (const column of params['columns']) {
+		if (column['search']['value']) return true;
+	}
+	return Object.keys(params).some(function(name) {return /_(start|end)$/.test(name) && params[name];});
+}
+
+function batch_download_command() {
+	let targets = batch_targets();
+	if (targets === null) return;
+	if (!confirm("You are about to batch-download " + targets.count + " scan(s). Are you sure?")) {
 		return;
 	}
 	var form = $('<form method=post action="{% url "dd_downloader:batch download endpoint" %}">{% csrf_token %}</form>');
-	for (var i = 0; i < pks.length; i++) {
-		form.append($('<input>',{'name':"pk_list[]", 'value':pks[i]}));
+	let fields = $.param(targets.params).split('&');
+	for (var i = 0; i < fields.length; i++) {
+		let field = fields[i].split('=');
+		form.append($('<input>',{'type': 'hidden', 'name': decodeURIComponent(field[0].replace(/\+/g, ' ')), 'value': decodeURIComponent((field[1] || '').replace(/\+/g, ' '))}));
 	}
 	form.appendTo('body').submit().remove();
 }
 
 function scan_batch_command(command) {
-	arr = table.rows({selected: true}).data();
-	if (arr.length <= 0) return;
-	pks = [];
-	for (var i = 0; i < arr.length; i++) {
-		pks.push(arr[i]['PK']);
-	}
+	let targets = batch_targets();
+	if (targets === null) return;
 	let msg = "unknown"
 	switch(command) {
 		case 'CR': msg = "create"; break;
@@ -42,20 +73,24 @@ function scan_batch_command(command) {
 		case 'RT': msg = "retrieve"; break;
 		case 'DL': msg = "delete"; break;
 	}
-	if (!confirm("You are about to batch-" + msg + " " + pks.length + " scan(s). Are you sure?")) {
+	if (!confirm("You are about to batch-" + msg + " " + targets.count + " scan(s). Are you sure?")) {
 		return;
 	}
 	$.post({
 		type: 'POST',
 		url: "{% url 'dd_downloader:batch control ajax' %}",
 		headers: {'X-CSRFToken': '{{ csrf_token }}'},
-		data: {'type': 'scan', 'command': command,'pk_list': pks},
+		data: $.extend({'type': 'scan', 'command': command}, targets.params),
 		success: function(data) {
 			table.ajax.reload(null, false);
 			if (data['status'] == 'success') {alert('Commands successfully issued.');}
 			else if (data['status'] == 'failure') {
 				let msg = "";
-				if ('unsuccessful' in data) {msg += "Command unsuccessful on: " + data['unsuccessful'] + "\n\n";}
+				if ('unsuccessful' in data) {
+					msg += "Command unsuccessful on " + data['unsuccessful_count'] + " scan(s): " + data['unsuccessful'];
+					if (data['unsuccessful_count'] > data['unsuccessful'].length) {msg += ", ...";}
+					msg += "\n\n";
+				}
 				if ('missing' in data) {msg += "Objects not found for PKs: " + data['missing'];}
 				alert(msg);
 			}
@@ -65,25 +100,21 @@ function scan_batch_command(command) {
 }
 
 function scanner_batch_command(command) {
-	arr = table.rows({selected: true}).data();
-	if (arr.length <= 0) return;
-	pks = [];
-	for (var i = 0; i < arr.length; i++) {
-		pks.push(arr[i]['PK']);
-	}
+	let targets = batch_targets();
+	if (targets === null) return;
 	let msg = "unknown"
 	switch(command) {
 		case 'DL':
 			msg = "delete"; break;
 	}
-	if (!confirm("You are about to batch-" + msg + " " + pks.length + " scanner(s). Are you sure?")) {
+	if (!confirm("You are about to batch-" + msg + " " + targets.count + " scanner(s). Are you sure?")) {
 		return;
 	}
 	$.post({
 		type: 'POST',
 		url: "{% url 'dd_downloader:batch control ajax' %}",
 		headers: {'X-CSRFToken': '{{ csrf_token }}'},
-		data: {'type': 'scanner', 'command': command,'pk_list': pks},
+		data: $.extend({'type': 'scanner', 'command': command}, targets.params),
 		success: function(data) {
 			if (data['status'] == 'success') {alert('Success');}
 			else if (data['status'] == 'invalid command') {alert('Invalid command issued');}
@@ -95,16 +126,125 @@ function scanner_batch_command(command) {
 	});
 }
 
+//Creates scans in bulk from a CSV or JSON file picked in input (see bulk_scan_create_endpoint), with the page's CSRF token like the other commands.
+function bulk_create_command(input) {
+	if (input.files.length == 0) return;
+	let data = new FormData();
+	data.append('file', input.files[0]);
+	input.value = '';
+	$.post({
+		url: "{% url 'dd_downloader:bulk scan create' %}",
+		headers: {'X-CSRFToken': '{{ csrf_token }}'},
+		data: data,
+		processData: false,
+		contentType: false,
+		success: function(data) {
+			table.ajax.reload(null, false);
+			let msg = "Created " + data['created'] + " scan(s).";
+			if ('parse_error' in data) {msg += "\n\nThe file could not be read to the end: " + data['parse_error'];}
+			if (data['error_count']) {
+				msg += "\n\n" + data['error_count'] + " row(s) were invalid:";
+				for (const error of data['errors']) {msg += "\nRow " + error['row'] + ": " + error['error'];}
+				if (data['error_count'] > data['errors'].length) {msg += "\n...";}
+			}
+			alert(msg);
+		},
+		error: function(xhr) {alert('Bulk creation failed: ' + (xhr.responseJSON ? xhr.responseJSON['error'] : xhr.statusText));}
+	});
+}
+
 function render_automation(data, type, row, meta) {
 	return (data['Auto Create'] ? 'C' : ' ')
 		 + (data['Auto Start'] ? 'S' : ' ')
 		 + (data['Auto Retrieve'] ? 'R' : ' ');
 }
 function render_hyperlink(data, type, row, meta) {return '<a href="'+data['URL']+'">'+data['Name']+'</a>';}
+function render_health(data, type, row, meta) {
+	if (data['Reachable'] === null) return 'Not probed';
+	if (!data['Reachable']) return 'Down';
+	let health = 'Up';
+	if (data['Latency p50'] !== null) {health += ' (p50 ' + Math.round(data['Latency p50'] * 1000) + ' ms, p95 ' + Math.round(data['Latency p95'] * 1000) + ' ms)';}
+	if (data['Running Scans'] !== null) {health += ', ' + data['Running Scans'] + ' running';}
+	return health;
+}
 function render_datetime(data, type, row, meta) {if (data !== null) {return moment(new Date(data)).format("YYYY-MM-DD HH:mm:ss");} else return '-';}
 var create_date_start;
 var create_date_end;
 var start_date_start;
 var start_date_end;
 var end_date_start;
-var end_date_end;
\ No newline at end of file
+var end_date_end;
+
+//Adds the date range filters to the parameters of a serverSide DataTables request.
+//The DateTime pickers return dates whose UTC fields hold the picked local time, so they are formatted in UTC to send the local time as picked.
+function add_date_filters(d) {
+	var pickers = {
+		'create_date_start': create_date_start, 'create_date_end': create_date_end,
+		'start_date_start': start_date_start, 'start_date_end': start_date_end,
+		'end_date_start': end_date_start, 'end_date_end': end_date_end
+	};
+	for (var name in pickers) {
+		if (pickers[name] && pickers[name].val()) {
+			d[name] = moment.utc(pickers[name].val()).format('YYYY-MM-DDTHH:mm:ss');
+		}
+	}
+}
+
+//Incremental updates. Every list response carries a "cursor", and the list endpoints only return the rows that changed or were deleted since a cursor when asked with "since".
+//Changed rows that are on the current page are updated in place. New rows, deleted rows and changes outside the current page re-fetch the current page only.
+//Deltas overlap the previous one by a few seconds (see CURSOR_OVERLAP in views.py), so rows that come back unchanged from the previous delta are skipped.
+var list_cursor = null;
+var delta_rows = {};
+function track_cursor(table) {
+	table.on('xhr', function(e, settings, json) {
+		if (json && json['cursor']) {list_cursor = json['cursor'];}
+	});
+}
+function refresh_deltas(table, url) {
+	if (list_cursor === null) {
+		table.ajax.reload(null, false);
+		return;
+	}
+	$.get(url, {'since': list_cursor}, function(data) {
+		if (data['reset']) {
+			table.ajax.reload(null, false);
+			return;
+		}
+		let reload = false;
+		let seen = delta_rows;
+		delta_rows = {};
+		for (let i = 0; i < data['data'].length; i++) {
+			let key = JSON.stringify(data['data'][i]);
+			delta_rows[data['data'][i]['PK']] = key;
+			if (seen[data['data'][i]['PK']] === key) {continue;}
+			let row = table.row('#' + data['data'][i]['PK']);
+			if (row.any()) {row.data(data['data'][i]);}
+			else {reload = true;}
+		}
+		for (let i = 0; i < data['deleted'].length; i++) {
+			if (table.row('#' + data['deleted'][i]).any()) {reload = true;}
+		}
+		if (data['cursor']) {list_cursor = data['cursor'];}
+		if (reload) {table.ajax.reload(null, false);}
+	});
+}
+//Pushed updates. Scan events from the server-sent event stream trigger a delta refresh, instead of polling the list on a fixed interval.
+//Bursts of events are merged into one refresh. A slow poll remains as a safety net for scanner changes, which aren't pushed, and for events missed while reconnecting.
+function listen_for_events(table, url, events_url) {
+	let pending = null;
+	let refresh = function() {
+		if (pending !== null) {return;}
+		pending = setTimeout(function() {
+			pending = null;
+			refresh_deltas(table, url);
+		}, 500);
+	};
+	if (!window.EventSource) {
+		setInterval(function() {refresh_deltas(table, url);}, 5000);
+		return;
+	}
+	let source = new EventSource(events_url);
+	source.addEventListener('scan', refresh);
+	source.onopen = refresh;
+	setInterval(function() {refresh_deltas(table, url);}, 60000);
+}
@@ -4,6 +4,23 @@ from dd_downloader.models import Scan, Scanner
 from dd_downloader.class_directory import get_scanner_types
 # Create your tests here.
 
+"""
+Creates a Nessus scanner with test credentials, for the test cases that need a scanner of any type.
+"""
+def make_nessus_scanner(scanner_name, **fields):
+	scanner_obj = get_scanner_types()['Nessus']['scanner'](scanner_name=scanner_name,api_url='https://nessus_test.com:8834',access_key='access1',secret_key='secret1',**fields)
+	scanner_obj.save()
+	return scanner_obj
+
+"""
+Drops the call records that health.py and circuit.py keep in memory between writes, so that they don't leak from one test into another.
+"""
+def reset_call_records():
+	from dd_downloader import circuit, health
+	circuit._cache.clear()
+	circuit._pending.clear()
+	health._pending.clear()
+
 class ViewsSimpleTestCase(SimpleTestCase):
 	#For each test method, we check whether the status code is 200, whether the correct page is returned, and whether the correct template is used to build the page.
 	def test_scan_list_page(self):
@@ -33,9 +50,8 @@ class ViewsTestCase(TestCase):
 		self.scanner_pks = {'Nessus':[],'Burp_Suite':[]}
 		self.scan_pks = {'Nessus':[],'Burp_Suite':[]}
 		nessus_classes = scanner_types['Nessus']
-		n1 = nessus_classes['scanner'](scanner_name='Ns_test_1',api_url='https://nessus_test.com:8834',access_key='access1',secret_key='secret1')
+		n1 = make_nessus_scanner('Ns_test_1')
 		n2 = nessus_classes['scanner'](scanner_name='Ns_test_2',api_url='https://nessus_test_2.com:8834',access_key='access2',secret_key='secret2',default_policy_id=123)
-		n1.save()
 		n2.save()
 		self.scanner_pks['Nessus'].append(n1.pk)
 		self.scanner_pks['Nessus'].append(n2.pk)
@@ -97,3 +113,832 @@ class ViewsTestCase(TestCase):
 				child_scan_objs = Scanner.objects.get(pk=scanner_pk).scan_set.all()
 				for child_scan_obj in child_scan_objs:
 					self.assertContains(resp, child_scan_obj.scan_name)
+
+	def test_scan_list_ajax_server_side(self):
+		#Only the requested page of the filtered, ordered list is returned.
+		params = {
+			'draw': 3, 'start': 1, 'length': 2,
+			'columns[0][data]': 'PK', 'columns[1][data]': 'Scan Name', 'columns[2][data]': 'Status', 'columns[3][data]': 'Automation', 'columns[4][data]': 'Parent Scanner',
+			'columns[1][search][value]': 'Scan', 'order[0][column]': 1, 'order[0][dir]': 'desc',
+		}
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), params).json()
+		self.assertEqual((resp['draw'], resp['recordsTotal'], resp['recordsFiltered']), (3, 6, 6))
+		self.assertEqual([row['Scan Name']['Name'] for row in resp['data']], ['NsScan2', 'NsScan1'])
+
+		params.update({'start': 0, 'columns[4][search][value]': 'Ns_test_2'})
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), params).json()
+		self.assertEqual(resp['recordsFiltered'], 1)
+		self.assertEqual(resp['data'][0]['Scan Name']['Name'], 'NsScan3')
+
+		#An invalid regex matches nothing instead of failing.
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), {'draw': 1, 'search[value]': '(', 'search[regex]': 'true'}).json()
+		self.assertEqual((resp['recordsFiltered'], resp['data']), (0, []))
+
+	def test_scanner_list_ajax_server_side(self):
+		params = {'draw': 1, 'start': 0, 'length': 10, 'columns[0][data]': 'PK', 'columns[1][data]': 'Scanner Name', 'search[value]': 'Bs_'}
+		resp = self.client.get(reverse('dd_downloader:scanner list ajax'), params).json()
+		self.assertEqual((resp['recordsTotal'], resp['recordsFiltered']), (4, 2))
+		self.assertEqual([row['PK'] for row in resp['data']], self.scanner_pks['Burp_Suite'])
+
+	def test_scan_list_ajax_since(self):
+		from datetime import timedelta
+		from django.utils import timezone
+		from django.utils.dateparse import parse_datetime
+		from dd_downloader.views import CURSOR_OVERLAP
+		an_hour_ago = timezone.now() - timedelta(hours=1)
+		Scan.objects.update(updated_at=an_hour_ago, create_date=an_hour_ago)
+		Scanner.objects.update(updated_at=an_hour_ago)
+		latest_pk = self.scan_pks['Nessus'][2]
+		Scan.objects.filter(pk=latest_pk).update(updated_at=an_hour_ago + timedelta(minutes=30))
+		#Only scans changed or deleted after the cursor are returned, along with the ones changed shortly before it.
+		cursor = self.client.get(reverse('dd_downloader:scan list ajax')).json()['cursor']
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), {'since': cursor}).json()
+		self.assertEqual(([row['PK'] for row in resp['data']], resp['deleted'], resp['cursor']), ([latest_pk], [], cursor))
+
+		#A change that was stamped before the cursor but committed after it is still returned.
+		late_pk = self.scan_pks['Nessus'][1]
+		Scan.objects.filter(pk=late_pk).update(updated_at=parse_datetime(cursor) - timedelta(seconds=CURSOR_OVERLAP / 2))
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), {'since': cursor}).json()
+		self.assertEqual([row['PK'] for row in resp['data']], [late_pk, latest_pk])
+
+		changed = Scan.objects.get(pk=self.scan_pks['Nessus'][0])
+		changed.notes = 'changed'
+		changed.save()
+		Scan.objects.get(pk=self.scan_pks['Burp_Suite'][0]).delete()
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), {'since': cursor}).json()
+		self.assertEqual([row['PK'] for row in resp['data']], [changed.pk, late_pk, latest_pk])
+		self.assertEqual(resp['deleted'], [self.scan_pks['Burp_Suite'][0]])
+		self.assertNotEqual(resp['cursor'], cursor)
+
+		resp = self.client.get(reverse('dd_downloader:scanner list ajax'), {'since': cursor}).json()
+		self.assertEqual([row['PK'] for row in resp['data']], [self.scanner_pks['Burp_Suite'][0]])
+
+	def test_scan_list_ajax_not_modified(self):
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'))
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 304)
+
+		Scan.objects.get(pk=self.scan_pks['Nessus'][0]).save()
+		resp = self.client.get(reverse('dd_downloader:scan list ajax'), HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 200)
+
+	def test_list_serializers_query_count(self):
+		#Serializing a list takes a fixed number of queries, no matter how many rows or scanner types there are.
+		from django.test import RequestFactory
+		from dd_downloader.serializers import scan_list_to_json, scanner_list_to_json
+		request = RequestFactory().get('/')
+		with self.assertNumQueries(1):
+			scan_json = scan_list_to_json(request, Scan.objects.all())
+		self.assertEqual(len(scan_json['data']), 6)
+		row = next(row for row in scan_json['data'] if row['PK'] == self.scan_pks['Nessus'][2])
+		self.assertEqual(row['Parent Scanner']['URL'], request.build_absolute_uri(reverse('dd_downloader:scanner detail page', args=[self.scanner_pks['Nessus'][1]])))
+		self.assertEqual(row['Status'], 'New')
+		with self.assertNumQueries(1):
+			scanner_json = scanner_list_to_json(request, Scanner.objects.all())
+		self.assertEqual([row['# of Child Scans'] for row in scanner_json['data']], [2, 1, 2, 1])
+
+	def test_batch_control(self):
+		from unittest import mock
+		from datetime import timedelta
+		from django.utils import timezone
+		from celery.canvas import group, chunks
+		nessus_pks = self.scan_pks['Nessus']
+		Scan.objects.filter(pk=nessus_pks[1]).update(lease_token='busy', lease_expires=timezone.now() + timedelta(minutes=5))
+		url = reverse('dd_downloader:batch control ajax')
+		#The number of queries doesn't grow with the number of scans.
+		with mock.patch.object(group, 'apply_async') as dispatch, self.assertNumQueries(3):
+			resp = self.client.post(url, {'command': 'CR', 'type': 'scan', 'pk_list[]': nessus_pks + [0, 'x']})
+		self.assertEqual(resp.json(), {'status': 'failure', 'unsuccessful': ['NsScan2'], 'unsuccessful_count': 1, 'missing': ['0', 'x']})
+		self.assertEqual([Scan.objects.get(pk=pk).queued_action for pk in nessus_pks], [Scan.ACTION_CREATE, None, Scan.ACTION_CREATE])
+		dispatch.assert_called_once()
+
+		Scan.objects.filter(pk__in=nessus_pks).update(status=Scan.IN_PROGRESS)
+		with mock.patch.object(get_scanner_types()['Nessus']['scan'], 'can_stop', return_value=True), mock.patch.object(chunks, 'apply_async') as dispatch:
+			resp = self.client.post(url, {'command': 'SP', 'type': 'scan', 'pk_list[]': [nessus_pks[0], nessus_pks[2]]})
+		self.assertEqual(resp.json(), {'status': 'success'})
+		dispatch.assert_called_once()
+
+		from dd_downloader.models import ResultBlob, ScanDiff, DeletedObject
+		shared = ResultBlob.objects.create(sha256='a' * 64, file='results/aa/shared.gz', size=1, ref_count=3)
+		changes = ResultBlob.objects.create(sha256='b' * 64, file='results/bb/changes.gz', size=1, ref_count=1)
+		Scan.objects.filter(pk__in=nessus_pks[:2]).update(result=shared)
+		ScanDiff.objects.create(scan_id=nessus_pks[0], previous_scan_id=nessus_pks[1], changes=changes)
+		#Deleted scans are recorded, and their blobs released, in bulk rather than one scan at a time: the number of queries only grows with the number of distinct blobs.
+		with self.assertNumQueries(22):
+			resp = self.client.post(url, {'command': 'DL', 'type': 'scan', 'pk_list[]': nessus_pks + [0]})
+		self.assertEqual(resp.json(), {'status': 'failure', 'missing': ['0']})
+		self.assertFalse(Scan.objects.filter(pk__in=nessus_pks).exists())
+		self.assertFalse(ScanDiff.objects.exists())
+		self.assertEqual(set(DeletedObject.objects.filter(model_name=DeletedObject.SCAN).values_list('object_pk', flat=True)), set(nessus_pks))
+		self.assertEqual(ResultBlob.objects.get(pk=shared.pk).ref_count, 1)
+		self.assertFalse(ResultBlob.objects.filter(pk=changes.pk).exists())
+		self.assertEqual(self.client.post(url, {'command': 'XX', 'type': 'scan', 'pk_list[]': nessus_pks}).json(), {'status': 'invalid command and/or type'})
+
+	def test_batch_control_report_order(self):
+		from unittest import mock
+		from celery.canvas import group
+		nessus_pks = self.scan_pks['Nessus']
+		Scan.objects.filter(pk__in=[nessus_pks[0], nessus_pks[2]]).update(status=Scan.IN_PROGRESS)
+		#A scan that is started by a worker after it was checked isn't queued.
+		def can_create(scan_obj, auto=False):
+			Scan.objects.filter(pk=nessus_pks[1]).update(status=Scan.IN_PROGRESS)
+			return scan_obj.status == Scan.NEW
+		with mock.patch.object(get_scanner_types()['Nessus']['scan'], 'can_create', autospec=True, side_effect=can_create), mock.patch.object(group, 'apply_async') as dispatch:
+			resp = self.client.post(reverse('dd_downloader:batch control ajax'), {'command': 'CR', 'type': 'scan', 'pk_list[]': nessus_pks[::-1]})
+		self.assertEqual(resp.json(), {'status': 'failure', 'unsuccessful': ['NsScan3', 'NsScan2', 'NsScan1'], 'unsuccessful_count': 3})
+		self.assertFalse(Scan.objects.filter(queued_action__isnull=False).exists())
+		dispatch.assert_not_called()
+
+	def test_batch_control_by_filter(self):
+		from unittest import mock
+		from celery.canvas import group
+		url = reverse('dd_downloader:batch control ajax')
+		#The filters of the scan list's last request select the scans, instead of PKs.
+		params = {'command': 'CR', 'type': 'scan', 'scope': 'filter', 'columns[0][data]': 'Scan Name', 'columns[0][search][value]': 'NsScan', 'columns[0][search][regex]': 'false'}
+		with mock.patch.object(group, 'apply_async'):
+			resp = self.client.post(url, dict(params, scanner=self.scanner_pks['Nessus'][0]))
+		self.assertEqual(resp.json(), {'status': 'success'})
+		self.assertEqual(set(Scan.objects.filter(queued_action=Scan.ACTION_CREATE).values_list('pk', flat=True)), set(self.scan_pks['Nessus'][:2]))
+
+		resp = self.client.post(url, dict(params, command='DL'))
+		self.assertEqual(resp.json(), {'status': 'success'})
+		self.assertFalse(Scan.objects.filter(pk__in=self.scan_pks['Nessus']).exists())
+		self.assertEqual(Scan.objects.count(), 3)
+
+		#Filters that select everything need an explicit confirmation, even with an empty column search.
+		unfiltered = {'command': 'DL', 'type': 'scan', 'scope': 'filter', 'columns[0][data]': 'Scan Name', 'columns[0][search][value]': ''}
+		self.assertEqual(self.client.post(url, unfiltered).json(), {'status': 'unconfirmed unfiltered command'})
+		self.assertEqual(self.client.post(url, dict(unfiltered, type='scanner')).json(), {'status': 'unconfirmed unfiltered command'})
+		self.assertEqual(Scan.objects.count(), 3)
+		self.assertEqual(self.client.post(url, dict(unfiltered, confirm='all')).json(), {'status': 'success'})
+		self.assertEqual(Scan.objects.count(), 0)
+
+		resp = self.client.post(reverse('dd_downloader:batch download endpoint'), {'scope': 'filter'})
+		self.assertContains(resp, "No scans with results match the filters")
+
+class SchedulerTestCase(TestCase):
+	def setUp(self):
+		reset_call_records()
+		self.scanner = make_nessus_scanner('Ns_sched')
+		self.scan_class = get_scanner_types()['Nessus']['scan']
+
+	def tearDown(self):
+		reset_call_records()
+
+	def make_scan(self, name, status, **flags):
+		scan_obj = self.scan_class(scanner=self.scanner,scan_name=name,endpoints='https://demo.testfire.net',status=status,**flags)
+		scan_obj.save()
+		return scan_obj.pk
+
+	def test_actionable_scans(self):
+		from datetime import timedelta
+		from django.utils import timezone
+		from dd_downloader.celery_tasks import actionable_scans, RETRIEVE_STEP_TIMEOUT
+		from dd_downloader.models import ScannerPool, ScannerHealth
+		now = timezone.now()
+		pool = ScannerPool.objects.create(pool_name='pool')
+		self.scanner.pool = pool
+		self.scanner.save()
+		ScannerHealth.objects.create(scanner=self.scanner, reachable=False)
+		expected = [
+			self.make_scan('new_auto', Scan.NEW, auto_create=True),
+			self.make_scan('created_auto', Scan.CREATED, auto_start=True),
+			self.make_scan('in_progress', Scan.IN_PROGRESS),
+			self.make_scan('finished_auto', Scan.FINISHED, auto_retrieve=True),
+			self.make_scan('queued', Scan.CREATED, queued_action=Scan.ACTION_START, queued_at=now),
+			#Pooled scans on an unreachable scanner are failed over, whatever their flags.
+			self.make_scan('pooled', Scan.CREATED, pool=pool),
+			self.make_scan('retried', Scan.NEW, auto_create=True, retry_count=1, retry_at=now - timedelta(seconds=1)),
+			self.make_scan('step_overdue', Scan.RETRIEVING, retrieve_step_at=now - timedelta(seconds=RETRIEVE_STEP_TIMEOUT + 1)),
+		]
+		#None of these have anything for the scheduler to do.
+		self.make_scan('new_manual', Scan.NEW)
+		self.make_scan('created_manual', Scan.CREATED, auto_create=True)
+		self.make_scan('finished_manual', Scan.FINISHED)
+		self.make_scan('retrieved', Scan.RETRIEVED, auto_create=True, auto_start=True, auto_retrieve=True)
+		self.make_scan('errors', Scan.ERRORS, auto_create=True, auto_start=True, auto_retrieve=True)
+		self.make_scan('pooled_in_progress', Scan.IN_PROGRESS, pool=pool, next_poll_at=now + timedelta(minutes=1))
+		self.make_scan('retry_pending', Scan.NEW, auto_create=True, retry_count=1, retry_at=now + timedelta(minutes=1))
+		self.make_scan('step_pending', Scan.RETRIEVING, retrieve_step_at=now)
+
+		with self.assertNumQueries(1):
+			planned = list(actionable_scans().values_list('pk', flat=True))
+		self.assertCountEqual(planned, expected)
+		self.assertCountEqual(actionable_scans(self.scanner.pk + 1).values_list('pk', flat=True), [])
+
+	def test_dispatch_batches_polls(self):
+		#In-progress scans of a scanner with poll_many() are polled together, everything else is queued per scan.
+		from unittest import mock
+		from dd_downloader import celery_tasks
+		new_pk = self.make_scan('new_auto', Scan.NEW, auto_create=True)
+		ip_pks = [self.make_scan('in_progress_1', Scan.IN_PROGRESS), self.make_scan('in_progress_2', Scan.IN_PROGRESS)]
+		with mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan, mock.patch.object(celery_tasks.poll_scans, 'delay') as poll_scans:
+			celery_tasks.process_all_scanners()
+		process_scan.assert_called_once_with(new_pk)
+		poll_scans.assert_called_once_with(self.scanner.pk, ip_pks)
+
+	def test_leased_scans_are_skipped(self):
+		from unittest import mock
+		from dd_downloader import celery_tasks
+		scan_pk = self.make_scan('in_progress', Scan.IN_PROGRESS)
+		token = Scan.acquire_lease(scan_pk)
+		self.assertIsNotNone(token)
+		self.assertIsNone(Scan.acquire_lease(scan_pk))
+		self.assertCountEqual(celery_tasks.actionable_scans().values_list('pk', flat=True), [])
+		with mock.patch.object(self.scan_class, 'poll') as poll:
+			celery_tasks.process_scan(scan_pk)
+			poll.assert_not_called()
+			Scan.release_leases(token)
+			celery_tasks.process_scan(scan_pk)
+			poll.assert_called_once_with()
+		#The task's own lease is released once it is done.
+		self.assertFalse(Scan.objects.get(pk=scan_pk).is_leased())
+
+	def test_dispatch_respects_scanner_limits(self):
+		from unittest import mock
+		from dd_downloader import celery_tasks
+		self.scanner.max_running_scans = 2
+		self.scanner.save()
+		self.make_scan('running', Scan.IN_PROGRESS)
+		#Stopped scans don't take up a running slot.
+		self.make_scan('stopped', Scan.STOPPED)
+		self.assertEqual(self.scanner.running_scan_count(), 1)
+		low_pk = self.make_scan('created_low', Scan.CREATED, auto_start=True, priority=Scan.LOW)
+		normal_pk = self.make_scan('created_normal', Scan.CREATED, auto_start=True)
+		queued = Scan.objects.get(pk=self.make_scan('created_queued', Scan.CREATED))
+		queued.queue_action(Scan.ACTION_START)
+		retrieve_pk = self.make_scan('finished_auto', Scan.FINISHED, auto_retrieve=True)
+		with mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan, mock.patch.object(celery_tasks.poll_scans, 'delay'):
+			celery_tasks.process_all_scanners()
+		#One running slot is free: the queued command goes first, the other starts stay queued. Retrievals don't need a running slot.
+		self.assertCountEqual([c.args[0] for c in process_scan.call_args_list], [queued.pk, retrieve_pk])
+		self.assertNotIn(low_pk, [c.args[0] for c in process_scan.call_args_list])
+		self.assertNotIn(normal_pk, [c.args[0] for c in process_scan.call_args_list])
+
+		#A command that is released while the scanner is full stays queued instead of failing.
+		from dd_downloader.views import queue_scan_action
+		self.make_scan('running_2', Scan.IN_PROGRESS)
+		with mock.patch.object(celery_tasks.process_scans, 'delay') as process_scans:
+			queue_scan_action(Scan.objects.get(pk=normal_pk), Scan.ACTION_START)
+		process_scans.assert_called_once_with(self.scanner.pk)
+		with mock.patch.object(self.scan_class, 'start') as start:
+			celery_tasks.process_scan(normal_pk)
+			start.assert_not_called()
+		self.assertEqual(Scan.objects.get(pk=normal_pk).queued_action, Scan.ACTION_START)
+
+	def test_pooled_scans_are_placed(self):
+		from unittest import mock
+		from dd_downloader import celery_tasks, health
+		from dd_downloader.models import ScannerPool, ScannerHealth
+		pool = ScannerPool.objects.create(pool_name='pool')
+		members = [self.scanner]
+		for name in ['Ns_sched_2', 'Ns_sched_3']:
+			members.append(make_nessus_scanner(name))
+		for member in members:
+			member.pool = pool
+			member.save()
+		self.make_scan('running', Scan.IN_PROGRESS)
+		health.record_success(members[1].pk, 2.0)
+		health.record_success(members[2].pk, 0.5)
+
+		#The least-loaded members are ranked by latency.
+		scan_pk = self.make_scan('pooled', Scan.NEW, auto_create=True, pool=pool)
+		with mock.patch.object(self.scan_class, 'create') as create:
+			celery_tasks.process_scan(scan_pk)
+			create.assert_called_once_with()
+		self.assertEqual(Scan.objects.get(pk=scan_pk).scanner_id, members[2].pk)
+
+		#Unreachable members are skipped, and scans created on them are failed over.
+		for i in range(ScannerHealth.UNREACHABLE_FAILURES):
+			health.record_failure(members[2].pk)
+		self.assertFalse(ScannerHealth.is_reachable(members[2].pk))
+		Scan.objects.filter(pk=scan_pk).update(status=Scan.CREATED, auto_start=True)
+		with mock.patch.object(self.scan_class, 'start') as start:
+			celery_tasks.process_scan(scan_pk)
+			start.assert_not_called()
+		scan_obj = Scan.objects.get(pk=scan_pk)
+		self.assertEqual((scan_obj.status, scan_obj.scanner_id, scan_obj.queued_action), (Scan.NEW, members[1].pk, Scan.ACTION_CREATE))
+		#Scans that aren't started automatically are failed over by the scheduler as well.
+		idle_pk = self.make_scan('pooled_idle', Scan.CREATED, pool=pool)
+		Scan.objects.filter(pk=idle_pk).update(scanner=members[2])
+		with mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan, mock.patch.object(celery_tasks.poll_scans, 'delay'):
+			celery_tasks.process_all_scanners()
+		self.assertIn(idle_pk, [c.args[0] for c in process_scan.call_args_list])
+		celery_tasks.process_scan(idle_pk)
+		self.assertEqual(Scan.objects.get(pk=idle_pk).scanner_id, members[1].pk)
+		#A success clears the failures.
+		health.record_success(members[2].pk, 0.5)
+		self.assertTrue(ScannerHealth.is_reachable(members[2].pk))
+
+	def test_pools_hold_one_scanner_type(self):
+		from dd_downloader.models import ScannerPool
+		burp_class = get_scanner_types()['Burp_Suite']['scanner']
+		pool = ScannerPool.objects.create(pool_name='pool')
+		self.scanner.pool = pool
+		self.scanner.save()
+		#A scanner of another type can't join the pool, and a scan can't use a pool without members of its type.
+		burp = burp_class(scanner_name='Bs_sched',api_url='https://burp_test.com:1337',api_key='apikey1')
+		form = burp.get_scanner_create_form_class()({'scanner_name': 'Bs_sched', 'api_url': 'https://burp_test.com:1337', 'api_key': 'apikey1', 'pool': pool.pk}, instance=burp)
+		self.assertIn('pool', form.errors)
+		burp.pool = None
+		burp.save()
+		form_class = burp.get_scan_create_form_class()
+		form = form_class({'scan_name': 'burp_pooled', 'endpoints': 'https://demo.testfire.net', 'pool': pool.pk}, instance=form_class._meta.model(scanner=burp))
+		self.assertIn('pool', form.errors)
+		form_class = self.scanner.get_scan_create_form_class()
+		form = form_class({'scan_name': 'nessus_pooled', 'endpoints': '10.0.0.1', 'pool': pool.pk}, instance=form_class._meta.model(scanner=self.scanner))
+		self.assertTrue(form.is_valid(), form.errors)
+
+	def test_unreachable_scanners_are_skipped(self):
+		from unittest import mock
+		from dd_downloader import celery_tasks
+		from dd_downloader.models import ScannerHealth
+		self.make_scan('new_auto', Scan.NEW, auto_create=True)
+		self.make_scan('in_progress', Scan.IN_PROGRESS)
+		ScannerHealth.objects.create(scanner=self.scanner, reachable=False)
+		with mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan, mock.patch.object(celery_tasks.poll_scans, 'delay') as poll_scans:
+			celery_tasks.process_all_scanners()
+			process_scan.assert_not_called()
+			poll_scans.assert_not_called()
+			#The held back work is dispatched once the scanner is back up.
+			ScannerHealth.objects.filter(scanner=self.scanner).update(reachable=True)
+			celery_tasks.process_all_scanners()
+		process_scan.assert_called_once()
+		poll_scans.assert_called_once()
+
+	def test_polls_only_when_due(self):
+		from datetime import timedelta
+		from unittest import mock
+		from django.utils import timezone
+		from dd_downloader import celery_tasks
+		now = timezone.now()
+		due_pk = self.make_scan('due', Scan.IN_PROGRESS, next_poll_at=now - timedelta(seconds=1))
+		self.make_scan('not_due', Scan.IN_PROGRESS, next_poll_at=now + timedelta(minutes=5))
+		self.assertCountEqual(celery_tasks.actionable_scans().values_list('pk', flat=True), [due_pk])
+		#Once dispatched, a poll isn't queued again by the next run.
+		with mock.patch.object(celery_tasks.poll_scans, 'delay') as poll_scans:
+			celery_tasks.process_all_scanners()
+		poll_scans.assert_called_once_with(self.scanner.pk, [due_pk])
+		self.assertCountEqual(celery_tasks.actionable_scans().values_list('pk', flat=True), [])
+
+	def test_lost_retrieve_steps_are_dispatched(self):
+		from datetime import timedelta
+		from unittest import mock
+		from django.utils import timezone
+		from dd_downloader import celery_tasks
+		now = timezone.now()
+		lost_pk = self.make_scan('lost', Scan.RETRIEVING, retrieve_step_at=now - timedelta(seconds=celery_tasks.RETRIEVE_STEP_TIMEOUT + 60))
+		self.make_scan('late', Scan.RETRIEVING, retrieve_step_at=now - timedelta(seconds=60))
+		with mock.patch.object(celery_tasks.continue_scan_retrieval, 'delay') as continue_scan_retrieval:
+			celery_tasks.process_all_scanners()
+		self.assertEqual(continue_scan_retrieval.call_args[0], (lost_pk,))
+		step_at = continue_scan_retrieval.call_args[1]['step_at']
+		self.assertCountEqual(celery_tasks.actionable_scans().values_list('pk', flat=True), [])
+
+		#Once the step has been dispatched again, the lost task does nothing if it turns up after all.
+		old_step_at = (now - timedelta(seconds=celery_tasks.RETRIEVE_STEP_TIMEOUT + 60)).timestamp()
+		with mock.patch.object(self.scan_class, 'continue_retrieve') as continue_retrieve:
+			celery_tasks.continue_scan_retrieval(lost_pk, step_at=old_step_at)
+			continue_retrieve.assert_not_called()
+			celery_tasks.continue_scan_retrieval(lost_pk, step_at=step_at)
+			continue_retrieve.assert_called_once_with()
+
+	def test_next_poll_delay(self):
+		from datetime import timedelta
+		from django.utils import timezone
+		now = timezone.now()
+		scan_obj = self.scan_class(start_date=now - timedelta(seconds=30))
+		self.assertEqual(scan_obj.next_poll_delay(now), Scan.POLL_INTERVAL_MIN)
+		scan_obj.start_date = now - timedelta(hours=10)
+		self.assertEqual(scan_obj.next_poll_delay(now), Scan.POLL_INTERVAL_MAX)
+		#A scan that is nearly done is polled sooner.
+		scan_obj.start_date = now - timedelta(hours=1)
+		scan_obj.progress = 0.95
+		self.assertLess(scan_obj.next_poll_delay(now), 360)
+
+class ThrottleTestCase(TestCase):
+	def setUp(self):
+		self.scanner = make_nessus_scanner('Ns_throttle')
+
+	def test_token_bucket(self):
+		from dd_downloader import throttle
+		#The bucket starts full with one second of calls.
+		for i in range(2):
+			allowed, slot_pk, wait = throttle.try_acquire(self.scanner.pk, requests_per_second=2)
+			self.assertTrue(allowed)
+		allowed, slot_pk, wait = throttle.try_acquire(self.scanner.pk, requests_per_second=2)
+		self.assertFalse(allowed)
+		self.assertGreater(wait, 0)
+		self.assertLessEqual(wait, 0.5)
+
+	def test_concurrent_calls(self):
+		from dd_downloader import throttle
+		allowed, slot_pk, wait = throttle.try_acquire(self.scanner.pk, max_concurrent_calls=1)
+		self.assertTrue(allowed)
+		self.assertFalse(throttle.try_acquire(self.scanner.pk, max_concurrent_calls=1)[0])
+		throttle.release(slot_pk)
+		self.assertTrue(throttle.try_acquire(self.scanner.pk, max_concurrent_calls=1)[0])
+
+class CircuitTestCase(TestCase):
+	def setUp(self):
+		reset_call_records()
+		self.scanner = make_nessus_scanner('Ns_circuit')
+		self.scan_class = get_scanner_types()['Nessus']['scan']
+
+	def tearDown(self):
+		reset_call_records()
+
+	def test_successful_calls_are_batched(self):
+		#Successful calls don't each write the scanner's health and circuit rows, but are written out together.
+		import requests
+		from unittest import mock
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from dd_downloader import circuit, health
+		from dd_downloader.models import ScannerCircuit, ScannerHealth
+		from dd_downloader.transport import Transport
+		transport = Transport(self.scanner.pk, 'https://nessus_test.com:8834', 'access1', 'secret1')
+		response = mock.Mock(status_code=200)
+		with mock.patch.object(requests.Session, 'request', return_value=response):
+			#The scanner's first success is written at once, since it has no health recorded yet.
+			transport.get('https://nessus_test.com:8834/scans')
+			with CaptureQueriesContext(connection) as queries:
+				for i in range(10):
+					transport.get('https://nessus_test.com:8834/scans')
+			self.assertEqual([query['sql'] for query in queries if not query['sql'].startswith('SELECT')], [])
+			health.flush(self.scanner.pk)
+			circuit.flush(self.scanner.pk)
+		self.assertEqual(ScannerCircuit.objects.get(scanner=self.scanner).window_calls, 11)
+		self.assertIsNotNone(ScannerHealth.objects.get(scanner=self.scanner).latency)
+
+		#A failure is written at once, along with the successes before it.
+		with mock.patch.object(requests.Session, 'request', return_value=response):
+			transport.get('https://nessus_test.com:8834/scans')
+		with mock.patch.object(requests.Session, 'request', side_effect=requests.ConnectionError), self.assertRaises(requests.ConnectionError):
+			transport.get('https://nessus_test.com:8834/scans')
+		circuit_obj = ScannerCircuit.objects.get(scanner=self.scanner)
+		self.assertEqual((circuit_obj.window_calls, circuit_obj.window_failures), (13, 1))
+		self.assertEqual(ScannerHealth.objects.get(scanner=self.scanner).consecutive_failures, 1)
+
+	def test_circuit_opens_and_closes(self):
+		import requests
+		from datetime import timedelta
+		from unittest import mock
+		from django.utils import timezone
+		from dd_downloader import circuit
+		from dd_downloader.models import ScannerCircuit
+		from dd_downloader.transport import Transport
+		transport = Transport(self.scanner.pk, 'https://nessus_test.com:8834', 'access1', 'secret1')
+		with mock.patch.object(requests.Session, 'request', side_effect=requests.ConnectionError) as request:
+			for i in range(circuit.MIN_CALLS):
+				with self.assertRaises(requests.ConnectionError):
+					transport.get('https://nessus_test.com:8834/scans')
+			self.assertEqual(ScannerCircuit.objects.get(scanner=self.scanner).state, ScannerCircuit.OPEN)
+			#Calls to the open circuit fail without reaching the scanner, or the database.
+			with self.assertNumQueries(0), self.assertRaises(circuit.CircuitOpenError):
+				transport.get('https://nessus_test.com:8834/scans')
+			self.assertEqual(request.call_count, circuit.MIN_CALLS)
+
+			#Once the cooldown is over, a failed trial call reopens the circuit for longer.
+			ScannerCircuit.objects.filter(scanner=self.scanner).update(open_until=timezone.now() - timedelta(seconds=1))
+			circuit._cache.clear()
+			with self.assertRaises(requests.ConnectionError):
+				transport.get('https://nessus_test.com:8834/scans')
+		circuit_obj = ScannerCircuit.objects.get(scanner=self.scanner)
+		self.assertEqual((circuit_obj.state, circuit_obj.cooldown), (ScannerCircuit.OPEN, circuit.COOLDOWN_MIN * 2))
+
+		#A successful trial call closes it.
+		ScannerCircuit.objects.filter(scanner=self.scanner).update(open_until=timezone.now() - timedelta(seconds=1))
+		circuit._cache.clear()
+		with mock.patch.object(requests.Session, 'request', return_value=mock.Mock(status_code=200)):
+			transport.get('https://nessus_test.com:8834/scans')
+		self.assertEqual(ScannerCircuit.objects.get(scanner=self.scanner).state, ScannerCircuit.CLOSED)
+
+	def test_work_is_rescheduled_while_open(self):
+		from datetime import timedelta
+		from unittest import mock
+		from django.utils import timezone
+		from dd_downloader import celery_tasks
+		from dd_downloader.models import ScannerCircuit
+		scan_obj = self.scan_class(scanner=self.scanner,scan_name='circuit',endpoints='https://demo.testfire.net',status=Scan.CREATED,auto_start=True)
+		scan_obj.save()
+		ScannerCircuit.objects.create(scanner=self.scanner, state=ScannerCircuit.OPEN, window_start=timezone.now(), open_until=timezone.now() + timedelta(seconds=30))
+		with mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan:
+			celery_tasks.process_all_scanners()
+		process_scan.assert_not_called()
+		#A manual command stays queued while the circuit is open.
+		from dd_downloader.views import queue_scan_action
+		with mock.patch.object(celery_tasks.process_scans, 'delay'):
+			queue_scan_action(scan_obj, Scan.ACTION_START)
+		with mock.patch.object(self.scan_class, 'start') as start, mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan:
+			celery_tasks.process_scan(scan_obj.pk)
+			celery_tasks.process_all_scanners()
+			start.assert_not_called()
+		process_scan.assert_not_called()
+		self.assertEqual(Scan.objects.get(pk=scan_obj.pk).queued_action, Scan.ACTION_START)
+
+		#Once the cooldown is over, one scan is let through for the trial call.
+		ScannerCircuit.objects.filter(scanner=self.scanner).update(open_until=timezone.now() - timedelta(seconds=1))
+		self.scan_class(scanner=self.scanner,scan_name='circuit_2',endpoints='https://demo.testfire.net',status=Scan.CREATED,auto_start=True).save()
+		with mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan:
+			celery_tasks.process_all_scanners()
+		process_scan.assert_called_once_with(scan_obj.pk)
+
+class TransitionTestCase(TestCase):
+	def setUp(self):
+		self.scanner = make_nessus_scanner('Ns_transition')
+		self.scan_obj = get_scanner_types()['Nessus']['scan'](scanner=self.scanner,scan_name='Transition',endpoints='https://demo.testfire.net',status=Scan.FINISHED)
+		self.scan_obj.save()
+
+	def test_only_one_transition_wins(self):
+		first = Scan.objects.get(pk=self.scan_obj.pk)
+		second = Scan.objects.get(pk=self.scan_obj.pk)
+		self.assertTrue(first.transition(Scan.RETRIEVING))
+		#The second worker still sees FINISHED, but can no longer claim the scan.
+		self.assertFalse(second.transition(Scan.RETRIEVING))
+		self.assertEqual(second.status, Scan.FINISHED)
+		#Fields of the scanner type's table are written along with the status.
+		self.assertTrue(first.transition(Scan.ERRORS, scan_id=5, end_date=None))
+		scan_obj = Scan.objects.get(pk=self.scan_obj.pk)
+		self.assertEqual((scan_obj.status, scan_obj.scan_id), (Scan.ERRORS, 5))
+
+	def test_next_step_is_chained(self):
+		from unittest import mock
+		from dd_downloader import celery_tasks
+		scan_obj = Scan.objects.get(pk=self.scan_obj.pk)
+		scan_obj.transition(Scan.IN_PROGRESS)
+		Scan._base_manager.filter(pk=scan_obj.pk).update(auto_retrieve=True)
+		token = Scan.acquire_lease(scan_obj.pk)
+		scan_obj = Scan.objects.get(pk=scan_obj.pk)
+		#on_commit callbacks never run inside a TestCase, so they are run right away here.
+		with mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func()), \
+			mock.patch.object(celery_tasks.process_scan, 'delay') as process_scan:
+			scan_obj.transition(Scan.FINISHED)
+		process_scan.assert_called_once_with(scan_obj.pk, handoff_token=token)
+		#The chained task takes over the lease that is still held by the task that queued it.
+		self.assertIsNone(Scan.acquire_lease(scan_obj.pk))
+		self.assertIsNotNone(Scan.acquire_lease(scan_obj.pk, handoff=token))
+
+class TransportTestCase(SimpleTestCase):
+	def test_sessions_are_pooled_per_scanner(self):
+		from dd_downloader.transport import Transport
+		t1 = Transport(1, 'https://nessus_test.com:8834', 'access1', 'secret1')
+		t2 = Transport(1, 'https://nessus_test.com:8834', 'access1', 'secret1')
+		self.assertIs(t1.session, t2.session)
+		self.assertIsNot(t1.session, Transport(2, 'https://nessus_test.com:8834', 'access1', 'secret1').session)
+		#Changed credentials replace the scanner's session.
+		old_session = t1.session
+		self.assertIsNot(Transport(1, 'https://nessus_test.com:8834', 'access2', 'secret2').session, old_session)
+		#Transports without a scanner keep a session per URL and credentials.
+		standalone = Transport(None, 'https://nessus_test.com:8834', 'access1', 'secret1').session
+		self.assertIsNot(Transport(None, 'https://nessus_test_2.com:8834', 'access2', 'secret2').session, standalone)
+		self.assertIs(Transport(None, 'https://nessus_test.com:8834', 'access1', 'secret1').session, standalone)
+
+class EventStreamTestCase(SimpleTestCase):
+	def test_event_stream(self):
+		from django.test import override_settings
+		from dd_downloader import events
+		with override_settings(EVENT_BACKEND='memory', EVENT_HEARTBEAT_INTERVAL=0):
+			resp = self.client.get(reverse('dd_downloader:event stream'), {'scanner': 1})
+			self.assertEqual(resp['Content-Type'], 'text/event-stream')
+			stream = iter(resp.streaming_content)
+			self.assertEqual(next(stream), b'retry: 5000\n\n')
+			#Events of other scanners are filtered out.
+			events.publish({'type': 'status', 'pk': 5, 'scanner_pk': 2, 'status': 'IP'})
+			self.assertEqual(next(stream), b': keep-alive\n\n')
+			events.publish({'type': 'status', 'pk': 6, 'scanner_pk': 1, 'status': 'IP'})
+			self.assertEqual(next(stream), b'event: scan\ndata: {"type": "status", "pk": 6, "scanner_pk": 1, "status": "IP"}\n\n')
+			#Events about several scans match any of their scanners.
+			events.publish({'type': 'deleted', 'pks': [7, 8], 'scanner_pks': [1, 3]})
+			self.assertEqual(next(stream), b'event: scan\ndata: {"type": "deleted", "pks": [7, 8], "scanner_pks": [1, 3]}\n\n')
+			resp.close()
+
+class ResultStorageTestCase(TestCase):
+	def setUp(self):
+		import tempfile
+		from django.test import override_settings
+		self.media_root = tempfile.TemporaryDirectory()
+		self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+		self.settings_override.enable()
+		self.scan_obj = get_scanner_types()['Nessus']['scan'](scanner=make_nessus_scanner('Ns_result'),scan_name='NsResult',endpoints='https://demo.testfire.net')
+		self.scan_obj.save()
+
+	def tearDown(self):
+		self.settings_override.disable()
+		self.media_root.cleanup()
+
+	def test_save_result_streams_chunks(self):
+		self.scan_obj.save_result(iter([b'Plugin ID,Host\r\n', b'1,10.0.0.1\r', b'\n2,10.0.0.2\r\n']))
+		scan_obj = Scan.objects.get(pk=self.scan_obj.pk)
+		with scan_obj.result.open() as f:
+			self.assertEqual(f.read(), b'Plugin ID,Host\n1,10.0.0.1\n2,10.0.0.2\n')
+
+	def test_delete_legacy_results(self):
+		#Files kept by the blob migration are only deleted by the command, and only once their content is in a blob.
+		from io import StringIO
+		from django.core.files.base import ContentFile
+		from django.core.management import call_command
+		from dd_downloader.models import fs
+		migrated = fs.save('legacy_1.csv', ContentFile(b'Plugin ID,Host\n'))
+		unmigrated = fs.save('legacy_2.csv', ContentFile(b'Plugin ID,Host\n'))
+		self.scan_obj.save_result(iter([b'Plugin ID,Host\n']))
+		Scan.objects.filter(pk=self.scan_obj.pk).update(legacy_result=migrated)
+		other = type(self.scan_obj)(scanner=self.scan_obj.scanner,scan_name='NsLegacy',endpoints='https://demo.testfire.net',legacy_result=unmigrated)
+		other.save()
+		call_command('delete_legacy_results', stdout=StringIO(), stderr=StringIO())
+		self.assertFalse(fs.exists(migrated))
+		self.assertEqual(Scan.objects.get(pk=self.scan_obj.pk).legacy_result.name, '')
+		self.assertTrue(fs.exists(unmigrated))
+
+	def test_failed_stream_keeps_previous_result(self):
+		def broken_stream():
+			yield b'partial'
+			raise IOError('connection reset')
+		self.scan_obj.save_result('old result')
+		with self.assertRaises(IOError):
+			self.scan_obj.save_result(broken_stream())
+		with Scan.objects.get(pk=self.scan_obj.pk).result.open() as f:
+			self.assertEqual(f.read(), b'old result')
+
+	def test_identical_results_are_stored_once(self):
+		from dd_downloader.models import ResultBlob
+		other_scan = type(self.scan_obj)(scanner=self.scan_obj.scanner, scan_name='NsResult2', endpoints='https://demo.testfire.net')
+		other_scan.save()
+		self.scan_obj.save_result('Plugin ID,Host\n1,10.0.0.1\n')
+		other_scan.save_result(['Plugin ID,Host\r\n', '1,10.0.0.1\r\n'])
+		self.assertEqual(self.scan_obj.result_id, other_scan.result_id)
+		self.assertEqual(ResultBlob.objects.get().ref_count, 2)
+
+		#Blobs are deleted once their last reference is released.
+		self.scan_obj.save_result('Plugin ID,Host\n2,10.0.0.2\n')
+		self.assertEqual(ResultBlob.objects.get(pk=other_scan.result_id).ref_count, 1)
+		other_scan.delete()
+		self.assertEqual(ResultBlob.objects.count(), 1)
+		self.scan_obj.delete_result()
+		self.assertFalse(ResultBlob.objects.exists())
+
+	def test_result_is_served_compressed(self):
+		import gzip
+		self.scan_obj.save_result('Plugin ID,Host\n1,10.0.0.1\n')
+		url = reverse('dd_downloader:scan result endpoint', args=[self.scan_obj.pk])
+		resp = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		self.assertEqual(gzip.decompress(b''.join(resp.streaming_content)), b'Plugin ID,Host\n1,10.0.0.1\n')
+		resp = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+		self.assertFalse(resp.has_header('Content-Encoding'))
+		self.assertEqual(b''.join(resp.streaming_content), b'Plugin ID,Host\n1,10.0.0.1\n')
+
+	def test_ingest_findings(self):
+		from unittest import mock
+		from dd_downloader.models import Finding
+		self.scan_obj.save_result(
+			'Plugin ID,CVE,CVSS,Risk,Host,Protocol,Port,Name\n'
+			'10107,,,None,10.0.0.1,tcp,80,HTTP Server Type and Version\n'
+			'97833,CVE-2017-0143,9.3,Critical,10.0.0.2,tcp,445,MS17-010\n'
+			'97833,CVE-2017-0144,9.3,Critical,10.0.0.2,tcp,445,MS17-010\n'
+		)
+		scan_obj = Scan.objects.get(pk=self.scan_obj.pk)
+		with mock.patch.object(Scan, 'FINDING_BATCH_SIZE', 2):
+			self.assertEqual(scan_obj.ingest_findings(), 3)
+		#Ingesting again replaces the findings instead of duplicating them.
+		self.assertEqual(scan_obj.ingest_findings(), 3)
+		self.assertEqual(Finding.objects.filter(scan=scan_obj).count(), 3)
+
+		resp = self.client.get(reverse('dd_downloader:findings'), {'plugin_id': '97833', 'severity': Finding.HIGH})
+		data = resp.json()
+		self.assertFalse(data['truncated'])
+		self.assertEqual(sorted(f['cve'] for f in data['data']), ['CVE-2017-0143', 'CVE-2017-0144'])
+		self.assertEqual({(f['host'], f['port']) for f in data['data']}, {('10.0.0.2', 445)})
+		self.assertEqual(self.client.get(reverse('dd_downloader:findings'), {'port': 'http'}).status_code, 400)
+
+	def test_scan_diff(self):
+		import datetime, gzip
+		from dd_downloader.models import ScanDiff
+		header = 'Plugin ID,CVE,CVSS,Risk,Host,Protocol,Port,Name\n'
+		kept = '10107,,,None,10.0.0.1,tcp,80,HTTP Server Type and Version\n'
+		fixed = '97833,CVE-2017-0143,9.3,Critical,10.0.0.2,tcp,445,MS17-010\n'
+		found = '57608,,5.0,Medium,10.0.0.2,tcp,445,SMB Signing not required\n'
+		end_date = datetime.datetime(2021, 1, 1)
+		next_scan = type(self.scan_obj)(scanner=self.scan_obj.scanner, scan_name='NsResultNextWeek', endpoints=self.scan_obj.endpoints)
+		next_scan.save()
+		for scan_obj, result, days in [(self.scan_obj, header + kept + fixed, 0), (next_scan, header + found + kept, 7)]:
+			scan_obj.save_result(result)
+			Scan.objects.filter(pk=scan_obj.pk).update(status=Scan.RETRIEVED, end_date=end_date + datetime.timedelta(days=days))
+			Scan.objects.get(pk=scan_obj.pk).ingest_findings()
+		self.assertIsNone(ScanDiff.compute(Scan.objects.get(pk=self.scan_obj.pk)))
+
+		diff = ScanDiff.compute(Scan.objects.get(pk=next_scan.pk))
+		self.assertEqual((diff.previous_scan_id, diff.new_count, diff.resolved_count, diff.unchanged_count), (self.scan_obj.pk, 1, 1, 1))
+		resp = self.client.get(reverse('dd_downloader:scan diff endpoint', args=[next_scan.pk]))
+		self.assertEqual(resp.json()['resolved'], 1)
+		resp = self.client.get(resp.json()['changes'], HTTP_ACCEPT_ENCODING='gzip')
+		lines = gzip.decompress(b''.join(resp.streaming_content)).decode().splitlines()
+		self.assertEqual(sorted(lines[1:]), [
+			'New,10.0.0.2,445,tcp,57608,SMB Signing not required,,,Medium',
+			'Resolved,10.0.0.2,445,tcp,97833,MS17-010,CVE-2017-0143,,Critical',
+		])
+		self.assertContains(self.client.get(reverse('dd_downloader:scan detail page', args=[next_scan.pk])), '1 new, 1 resolved, 1 unchanged')
+		self.assertEqual(self.client.get(reverse('dd_downloader:scan diff endpoint', args=[self.scan_obj.pk])).status_code, 404)
+
+	def test_batch_download_streams_zip(self):
+		import io, zipfile
+		self.scan_obj.save_result('Plugin ID,Host\n1,10.0.0.1\n')
+		resp = self.client.post(reverse('dd_downloader:batch download endpoint'), {'pk_list[]': [self.scan_obj.pk]})
+		self.assertTrue(resp.streaming)
+		with zipfile.ZipFile(io.BytesIO(b''.join(resp.streaming_content))) as z:
+			self.assertEqual(z.read(Scan.objects.get(pk=self.scan_obj.pk).result_filename()), b'Plugin ID,Host\n1,10.0.0.1\n')
+
+		resp = self.client.post(reverse('dd_downloader:batch download endpoint'), {'pk_list[]': [self.scan_obj.pk, self.scan_obj.pk + 1]})
+		self.assertContains(resp, "Nonexistent scan in batch download")
+
+class BulkCreateTestCase(TestCase):
+	def setUp(self):
+		scanner_types = get_scanner_types()
+		self.nessus_classes = scanner_types['Nessus']
+		self.burp_classes = scanner_types['Burp_Suite']
+		self.nessus = make_nessus_scanner('Ns_bulk')
+		self.burp = self.burp_classes['scanner'](scanner_name='Bs_bulk',api_url='https://burp_test.com:1337',api_key='apikey1')
+		self.burp.save()
+		self.nessus_classes['scan'](scanner=self.nessus,scan_name='Taken',endpoints='10.0.0.1').save()
+
+	def test_bulk_create_json(self):
+		import json
+		rows = [
+			{'scanner': self.nessus.pk, 'scan_name': 'Weekly 1', 'endpoints': '10.0.0.1', 'auto_create': True, 'priority': Scan.HIGH},
+			{'scanner': 'Bs_bulk', 'scan_name': 'Weekly 2', 'endpoints': 'https://demo.testfire.net', 'auto_create': 'true'},
+			{'scanner': 'Nobody', 'scan_name': 'Weekly 3', 'endpoints': '10.0.0.3'},
+			{'scanner': self.nessus.pk, 'scan_name': 'Weekly 1', 'endpoints': '10.0.0.4'},
+			{'scanner': self.nessus.pk, 'scan_name': 'Taken', 'endpoints': '10.0.0.5'},
+			{'scanner': self.nessus.pk, 'endpoints': '10.0.0.6', 'colour': 'blue'},
+			{'scanner': self.nessus.pk, 'scan_name': 'Weekly 7', 'endpoints': '10.0.0.7', 'override_policy_id': 'x'},
+		]
+		resp = self.client.post(reverse('dd_downloader:bulk scan create'), json.dumps(rows), content_type='application/json')
+		data = resp.json()
+		self.assertEqual((data['created'], data['error_count']), (2, 5))
+		self.assertEqual([error['row'] for error in data['errors']], [3, 4, 5, 6, 7])
+
+		#Scans are created with the child table of their scanner type.
+		nessus_scan = Scan.objects.get(scan_name='Weekly 1')
+		self.assertIsInstance(nessus_scan, self.nessus_classes['scan'])
+		self.assertEqual((nessus_scan.endpoints, nessus_scan.auto_create, nessus_scan.priority, nessus_scan.status), ('10.0.0.1', True, Scan.HIGH, Scan.NEW))
+		burp_scan = Scan.objects.get(scan_name='Weekly 2')
+		self.assertIsInstance(burp_scan, self.burp_classes['scan'])
+		self.assertEqual((burp_scan.scanner_id, burp_scan.endpoints, burp_scan.auto_create), (self.burp.pk, 'https://demo.testfire.net', True))
+
+	def test_bulk_create_events(self):
+		from unittest import mock
+		from django.test import override_settings
+		from dd_downloader import bulk, events
+		rows = [{'scanner': 'Ns_bulk' if i % 2 else 'Bs_bulk', 'scan_name': f'Event {i}', 'endpoints': f'https://10.2.0.{i}'} for i in range(4)]
+		with override_settings(EVENT_BACKEND='memory'):
+			subscription = events.get_broker().subscribe()
+			#on_commit callbacks never run inside a TestCase, so they are run right away here.
+			with mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func()):
+				bulk.create_scans(rows)
+			published = subscription.get(timeout=0)
+		scans = Scan.objects.filter(scan_name__startswith='Event ')
+		self.assertEqual(sorted((event['type'], event['scanner_pk'], tuple(event['pks'])) for event in published), sorted([
+			('created', self.nessus.pk, tuple(scans.filter(scanner=self.nessus).order_by('pk').values_list('pk', flat=True))),
+			('created', self.burp.pk, tuple(scans.filter(scanner=self.burp).order_by('pk').values_list('pk', flat=True))),
+		]))
+
+	def test_bulk_create_csrf(self):
+		import json
+		from django.test import Client
+		client = Client(enforce_csrf_checks=True)
+		rows = [{'scanner': 'Ns_bulk', 'scan_name': f'Tool {i}', 'endpoints': f'10.1.0.{i}'} for i in range(3)]
+		resp = client.post(reverse('dd_downloader:bulk scan create'), json.dumps(rows), content_type='application/json')
+		self.assertEqual(resp.status_code, 403)
+		self.assertFalse(self.nessus_classes['scan'].objects.filter(scan_name__startswith='Tool ').exists())
+		#With the token that the scan list page hands out, as its import button sends it.
+		#The PKs of deleted scans are never given to new ones.
+		deleted = self.nessus_classes['scan'](scanner=self.nessus,scan_name='Deleted',endpoints='10.0.0.9')
+		deleted.save()
+		deleted_pk = deleted.pk
+		deleted.delete()
+		client.get(reverse('dd_downloader:index'))
+		resp = client.post(reverse('dd_downloader:bulk scan create'), json.dumps(rows), content_type='application/json', HTTP_X_CSRFTOKEN=client.cookies['csrftoken'].value)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['created'], 3)
+		scans = self.nessus_classes['scan'].objects.filter(scan_name__startswith='Tool ').order_by('pk')
+		self.assertEqual([scan.endpoints for scan in scans], ['10.1.0.0', '10.1.0.1', '10.1.0.2'])
+		self.assertGreater(scans[0].pk, deleted_pk)
+
+	def test_bulk_create_command(self):
+		import tempfile, os
+		from io import StringIO
+		from django.core.management import call_command
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'scans.csv')
+			with open(path, 'w', newline='') as f:
+				f.write('scanner,scan_name,endpoints,auto_create,auto_retrieve\n')
+				for i in range(25):
+					f.write(f"Ns_bulk,CSV {i},\"10.0.{i}.1,10.0.{i}.2\",true,false\n")
+				f.write('Ns_bulk,,10.0.99.1,true,false\n')
+			out, err = StringIO(), StringIO()
+			call_command('bulk_create_scans', path, chunk_size=10, stdout=out, stderr=err)
+		self.assertIn('Created 25 scans, 1 rows were invalid.', out.getvalue())
+		self.assertIn('Row 26: scan_name:', err.getvalue())
+		scans = self.nessus_classes['scan'].objects.filter(scan_name__startswith='CSV ')
+		self.assertEqual(scans.count(), 25)
+		self.assertEqual(scans.get(scan_name='CSV 3').endpoints, '10.0.3.1,10.0.3.2')
@@ -0,0 +1,65 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ScannerThrottle, ScannerCall
+
+#Enforcement of a scanner's API call limits (Scanner.requests_per_second and Scanner.max_concurrent_calls), shared by every worker process through the database.
+import logging
+logger = logging.getLogger(__name__)
+
+#Lifetime (in seconds) of a call slot. Slots are normally released as soon as the call returns; this only reclaims the slots of workers that died during a call.
+CALL_SLOT_EXPIRY = 5 * 60
+#Delay (in seconds) between checks for a free call slot.
+CALL_SLOT_POLL_INTERVAL = 0.25
+
+class ThrottleTimeout(Exception):
+	pass
+
+def get_max_wait():
+	return getattr(settings, 'SCANNER_THROTTLE_MAX_WAIT', 60)
+
+"""
+Tries to take a token from the scanner's bucket and a call slot, in one transaction. Returns a tuple of whether the call may go ahead, the PK of the call slot that it took (if max_concurrent_calls is set), and how long to wait before trying again.
+The bucket holds up to one second of calls (and at least one call), so short bursts are smoothed out.
+"""
+def try_acquire(scanner_pk, requests_per_second=None, max_concurrent_calls=None):
+	now = timezone.now()
+	with transaction.atomic():
+		ScannerThrottle.objects.get_or_create(scanner_id=scanner_pk, defaults={'tokens': max(requests_per_second or 1, 1), 'refilled_at': now})
+		throttle = ScannerThrottle.objects.select_for_update().get(scanner_id=scanner_pk)
+		if requests_per_second:
+			elapsed = max((now - throttle.refilled_at).total_seconds(), 0)
+			tokens = min(max(requests_per_second, 1), throttle.tokens + elapsed * requests_per_second)
+			if tokens < 1:
+				return False, None, (1 - tokens) / requests_per_second
+		slot_pk = None
+		if max_concurrent_calls:
+			ScannerCall.objects.filter(scanner_id=scanner_pk, expires_at__lte=now).delete()
+			if ScannerCall.objects.filter(scanner_id=scanner_pk).count() >= max_concurrent_calls:
+				return False, None, CALL_SLOT_POLL_INTERVAL
+			slot_pk = ScannerCall.objects.create(scanner_id=scanner_pk, expires_at=now + timedelta(seconds=CALL_SLOT_EXPIRY)).pk
+		if requests_per_second:
+			throttle.tokens = tokens - 1
+			throttle.refilled_at = now
+			throttle.save(update_fields=['tokens', 'refilled_at'])
+	return True, slot_pk, 0
+
+"""
+Blocks until an API call to the scanner is allowed by its limits, and returns the PK of the call slot to release afterwards (or None).
+Raises ThrottleTimeout if the call can't go ahead within SCANNER_THROTTLE_MAX_WAIT seconds. The scheduler only dispatches as much work as a scanner's limits allow, so calls are only expected to wait briefly.
+"""
+def acquire(scanner_pk, requests_per_second=None, max_concurrent_calls=None):
+	deadline = time.monotonic() + get_max_wait()
+	while True:
+		allowed, slot_pk, wait = try_acquire(scanner_pk, requests_per_second, max_concurrent_calls)
+		if allowed:
+			return slot_pk
+		if time.monotonic() + wait > deadline:
+			raise ThrottleTimeout(f"Scanner {scanner_pk} stayed at its API call limits for {get_max_wait()}s")
+		time.sleep(wait)
+
+def release(slot_pk):
+	if slot_pk is not None:
+		ScannerCall.objects.filter(pk=slot_pk).delete()
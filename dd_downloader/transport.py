@@ -0,0 +1,159 @@
+import os, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+#Shared HTTP transport for the scanner_types modules.
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+Each worker process keeps one requests.Session per scanner, so that every API call made to the same scanner reuses its pooled keep-alive connections instead of paying for a new TCP+TLS handshake.
+Sessions are keyed by scanner PK; if the scanner's credentials change (e.g. the scanner was edited), the old session is closed and replaced.
+Transports that aren't tied to a scanner (scanner_pk None, e.g. an API helper used on its own) are keyed by their URL and credentials instead, so that they never replace each other's sessions.
+"""
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+#Size of the chunks in which response bodies (e.g. scan results) are streamed.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class ScannerAPIError(Exception):
+	"""Raised by the scanner API helpers when a call gets an unsuccessful response, so that the failure can be classified by its status code (see is_transient)."""
+	def __init__(self, status_code, message):
+		super().__init__(f"{message} ({status_code})")
+		self.status_code = status_code
+
+class TransientScannerError(Exception):
+	"""Raised by the scanner types when an API call failed in a way that is expected to go away by itself, so that the scan retries later (see Scan.retry_later) instead of going to ERRORS."""
+	pass
+
+"""
+Returns whether an exception raised by an API call is a transient failure: a timeout, a dropped or refused connection, a 5xx response, or a call held back by the scanner's circuit breaker or API call limits.
+Anything else (e.g. a 4xx response, or a scan that failed on the scanning tool) is permanent, since retrying it would fail the same way.
+"""
+def is_transient(e):
+	from .circuit import CircuitOpenError
+	from .throttle import ThrottleTimeout
+	if isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, CircuitOpenError, ThrottleTimeout)):
+		return True
+	return isinstance(e, ScannerAPIError) and e.status_code >= 500
+
+"""
+Raises TransientScannerError from an exception that is a transient failure, and does nothing otherwise. Meant to be called first in the scanner types' exception handlers, which then handle the permanent failures as before.
+"""
+def raise_if_transient(e, transient=is_transient):
+	if transient(e):
+		raise TransientScannerError(str(e)) from e
+
+def get_pool_size():
+	return getattr(settings, 'SCANNER_HTTP_POOL_SIZE', 10)
+
+def get_default_timeout():
+	return getattr(settings, 'SCANNER_HTTP_TIMEOUT', 5)
+
+def new_session():
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=get_pool_size(), pool_maxsize=get_pool_size())
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	session.headers['Connection'] = 'keep-alive'
+	return session
+
+"""
+Returns the session for a scanner from the registry of the current process, creating it if needed.
+"""
+def get_session(scanner_pk, credentials=()):
+	global _sessions_pid
+	with _sessions_lock:
+		#Connections must never be shared with a parent process, e.g. after a Celery prefork worker forks.
+		if _sessions_pid != os.getpid():
+			_sessions.clear()
+			_sessions_pid = os.getpid()
+		key = scanner_pk if scanner_pk is not None else (None, credentials)
+		entry = _sessions.get(key)
+		if entry is None or entry[0] != credentials:
+			if entry is not None:
+				entry[1].close()
+			entry = (credentials, new_session())
+			_sessions[key] = entry
+		return entry[1]
+
+class Transport:
+	"""Thin wrapper around the pooled session of one scanner, which applies a per-call timeout and TLS verification default to every request, and the scanner's API call limits (see throttle.py)."""
+	"""The session is only looked up when a request is actually made, so instantiating scanners (e.g. in list views) costs nothing."""
+	def __init__(self, scanner_pk, *credentials, timeout: int = None, verify = True, requests_per_second: float = None, max_concurrent_calls: int = None):
+		self.scanner_pk = scanner_pk
+		self.credentials = tuple(credentials)
+		self.timeout = get_default_timeout() if timeout is None else timeout
+		self.verify = verify
+		self.requests_per_second = requests_per_second
+		self.max_concurrent_calls = max_concurrent_calls
+
+	@property
+	def session(self):
+		return get_session(self.scanner_pk, self.credentials)
+
+	@property
+	def limited(self):
+		return self.scanner_pk is not None and bool(self.requests_per_second or self.max_concurrent_calls)
+
+	def request(self, method: str, url: str, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		kwargs.setdefault('verify', self.verify)
+		if self.scanner_pk is None:
+			return self.session.request(method, url, **kwargs)
+		#Calls to a scanner whose circuit is open fail here, before they wait for the API call limits or the network.
+		from . import circuit
+		trial = circuit.before_call(self.scanner_pk)
+		if not self.limited:
+			return self.send(method, url, trial, **kwargs)
+		from . import throttle
+		slot_pk = throttle.acquire(self.scanner_pk, self.requests_per_second, self.max_concurrent_calls)
+		try:
+			response = self.send(method, url, trial, **kwargs)
+		except Exception:
+			throttle.release(slot_pk)
+			raise
+		if kwargs.get('stream') and slot_pk is not None:
+			#A streamed call is in flight until its body has been read and the response is closed.
+			close = response.close
+			def close_and_release():
+				close()
+				throttle.release(slot_pk)
+			response.close = close_and_release
+		else:
+			throttle.release(slot_pk)
+		return response
+
+	def send(self, method: str, url: str, trial: bool = False, **kwargs):
+		"""Makes the call, and records its outcome in the scanner's health (see health.py) and circuit breaker (see circuit.py)."""
+		from . import circuit, health
+		started = time.monotonic()
+		try:
+			response = self.session.request(method, url, **kwargs)
+		except (requests.ConnectionError, requests.Timeout):
+			health.record_failure(self.scanner_pk)
+			circuit.record_call(self.scanner_pk, False, trial)
+			raise
+		except Exception:
+			circuit.record_call(self.scanner_pk, False, trial)
+			raise
+		health.record_success(self.scanner_pk, time.monotonic() - started)
+		circuit.record_call(self.scanner_pk, response.status_code < 500, trial)
+		return response
+
+	def get(self, url: str, **kwargs):
+		return self.request('GET', url, **kwargs)
+
+	def post(self, url: str, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+"""
+Yields the body of a response that was requested with stream=True in chunks, and releases the connection back to the pool once it has been read.
+"""
+def iter_response(response, chunk_size=STREAM_CHUNK_SIZE):
+	with response:
+		for chunk in response.iter_content(chunk_size):
+			yield chunk
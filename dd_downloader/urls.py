@@ -19,6 +19,8 @@ urlpatterns = [
 	path('scan/<int:scan_pk>/', views.scan_detail_endpoint, name='scan detail page'), #scanner-specific
 	path('scan/<int:scan_pk>/edit', views.scan_edit_endpoint, name='scan edit page'), #scanner-specific
 	path('scan/<int:scan_pk>/result', views.scan_result_endpoint, name='scan result endpoint'), #scanner-specific
+	path('scan/<int:scan_pk>/diff', views.scan_diff_endpoint, name='scan diff endpoint'),
+	path('scan/<int:scan_pk>/diff/changes', views.scan_diff_changes_endpoint, name='scan diff changes endpoint'),
 	path('scan/<int:scan_pk>/delete', views.scan_delete_endpoint, name='scan delete page'), #ViewsTestCase
 
 	path('scan/<int:scan_pk>/create', views.scan_manual_create_endpoint, name='scan manual create endpoint'),
@@ -33,6 +35,9 @@ urlpatterns = [
 	path('api/scanner/', views.scanner_list_ajax_endpoint, name='scanner list ajax'), #ViewsTestCase
 	path('api/scanner/<int:scanner_pk>/scan', views.child_scan_list_ajax_endpoint, name='child scan list ajax'), #ViewsTestCase
 	path('api/batch/', views.batch_control_endpoint, name='batch control ajax'),
+	path('api/scan/bulk/', views.bulk_scan_create_endpoint, name='bulk scan create'),
+	path('api/events/', views.event_stream_endpoint, name='event stream'),
+	path('api/findings/', views.findings_endpoint, name='findings'),
 
 	#batch downloading
 	path('api/download/', views.batch_download_endpoint, name='batch download endpoint'),
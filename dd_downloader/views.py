@@ -1,14 +1,18 @@
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse, HttpResponseRedirect, FileResponse
+from django.http import HttpResponse, JsonResponse, HttpResponseRedirect, FileResponse, StreamingHttpResponse
 from django.urls import reverse
-from .celery_tasks import manual_create_scan,manual_start_scan,manual_pause_scan,manual_resume_scan,manual_stop_scan,manual_retrieve_scan
-from .models import Scanner, Scan
+from celery import group
+from .celery_tasks import manual_pause_scan,manual_resume_scan,manual_stop_scan,process_scans
+from .models import Scanner, Scan, DeletedObject, Finding, ScanDiff
+from . import datatables, events, bulk
+from .serializers import scan_list_to_json, scanner_list_to_json, annotate_scanners
 
 #Common error messages
 SCANNER_FETCH_ERROR = "An error occured while fetching scanner {pk} from the database."
 SCAN_FETCH_ERROR = "An error occured while fetching scan {item} from the database."
 INVALID_PARAMETERS_ERROR = "The necessary parameter(s) in a request ({params}) were missing or invalid."
 GENERIC_ERROR = "An unknown error occured."
+SCAN_BUSY_ERROR = "Scan {item} is already being worked on. Try again once the current task has finished."
 
 import logging
 logger = logging.getLogger(__name__)
@@ -157,12 +161,10 @@ def scan_create_endpoint(request, scanner_pk):
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 	if request.method == 'POST':
 		form_class = scanner_obj.get_scan_create_form_class()
-		f = form_class(request.POST)
+		#The scan is bound to its scanner before validation, so that its pool can be checked against the scanner's type.
+		f = form_class(request.POST, instance=form_class._meta.model(scanner=scanner_obj))
 		if f.is_valid():
-			#this just takes care of the scanner ForeignKey field
-			s = f.save(commit=False)
-			s.scanner = scanner_obj
-			s.save()
+			f.save()
 			return HttpResponseRedirect(reverse('dd_downloader:index'))
 		else:
 			logger.error('Scan creation unsuccessful')
@@ -171,6 +173,25 @@ def scan_create_endpoint(request, scanner_pk):
 		form_class = scanner_obj.get_scan_create_form_class()
 		return render(request, 'dd_downloader/scan_create.html',{'form':form_class().as_p(),'scanner':scanner_obj})
 
+"""
+Creates scans in bulk from a CSV or JSON document (see bulk.create_scans), sent as the request body or as an uploaded "file". The format is given by the "format" parameter, or guessed from the file name or content type.
+Invalid rows are reported by row number, and don't stop the other rows from being created.
+Requests need a CSRF token like every other POST, since the app has no authentication to stop a forged one; scripts can use the bulk_create_scans command instead.
+"""
+def bulk_scan_create_endpoint(request):
+	import codecs
+	if request.method != 'POST':
+		return JsonResponse({'status': 'invalid method'})
+	upload = request.FILES.get('file')
+	fmt = request.GET.get('format') or bulk.guess_format(upload.name if upload else None, request.content_type)
+	if fmt not in bulk.FORMATS:
+		return JsonResponse({'error': INVALID_PARAMETERS_ERROR.format(params='format')}, status=400)
+	#The document is decoded as it is read, instead of being loaded into memory first.
+	stream = codecs.getreader('utf-8')(upload if upload else request)
+	result = bulk.create_scans(bulk.iter_rows(stream, fmt))
+	logger.info(f"Bulk created {result.created} scans, {result.error_count} rows were invalid")
+	return JsonResponse(result.to_json())
+
 """
 Return a scan's detail page. Template is provided by the static get_scan_detail_template_path method in the Scanner class.
 """
@@ -205,7 +226,9 @@ def scan_edit_endpoint(request, scan_pk):
 		form_class = scan_obj.scanner.get_scan_create_form_class()
 		f = form_class(request.POST, instance=scan_obj)
 		if f.is_valid():
-			f.save()
+			#Only the edited fields are written, so that an edit never overwrites a status change made by a worker in the meantime.
+			scan_obj = f.save(commit=False)
+			scan_obj.save(update_fields=list(f.fields) + ['updated_at'])
 			return HttpResponseRedirect(reverse('dd_downloader:index'))
 		else:
 			logger.error('Scan edit unsuccessful')
@@ -249,12 +272,74 @@ def scan_result_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan result')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
-	return FileResponse(scan_obj.result.file,filename='results')
+	if scan_obj.result is None:
+		return render(request, 'dd_downloader/error.html', {'error_msg': "The scan has no results"})
+	return blob_response(request, scan_obj.result, scan_obj.result_filename().replace('/', '_'))
+
+"""
+Returns a stored blob as a file download. Blobs are stored compressed, so clients that accept gzip get the stored bytes as they are.
+"""
+def blob_response(request, blob, filename, content_type='application/octet-stream'):
+	if accepts_gzip(request):
+		resp = FileResponse(blob.file.file, content_type=content_type)
+		resp['Content-Encoding'] = 'gzip'
+	else:
+		resp = StreamingHttpResponse(blob.chunks(), content_type=content_type)
+		resp['Content-Length'] = blob.size
+	resp['Content-Disposition'] = f'filename="{filename}"'
+	resp['Vary'] = 'Accept-Encoding'
+	return resp
+
+"""
+Returns whether the client accepts gzip-encoded responses, according to the Accept-Encoding header.
+"""
+def accepts_gzip(request):
+	for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+		name, _, params = coding.partition(';')
+		if name.strip().lower() in ('gzip', '*'):
+			params = params.strip().lower()
+			try:
+				return not params.startswith('q=') or float(params[2:]) > 0
+			except ValueError:
+				return False
+	return False
+
+"""
+Returns the comparison of the scan's findings with those of its previous run, as computed after it was retrieved.
+"""
+def scan_diff_endpoint(request, scan_pk):
+	try:
+		diff = ScanDiff.objects.get(scan_id=scan_pk)
+	except ScanDiff.DoesNotExist as e:
+		return JsonResponse({'error': "The scan has not been compared with a previous run"}, status=404)
+	return JsonResponse({
+		'scan': diff.scan_id,
+		'previous_scan': diff.previous_scan_id,
+		'new': diff.new_count,
+		'resolved': diff.resolved_count,
+		'unchanged': diff.unchanged_count,
+		'compute_date': diff.compute_date,
+		'changes': reverse('dd_downloader:scan diff changes endpoint', args=[scan_pk]),
+	})
+
+"""
+Returns the new and resolved findings of the scan's diff as a CSV download.
+"""
+def scan_diff_changes_endpoint(request, scan_pk):
+	diff = ScanDiff.objects.select_related('changes').filter(scan_id=scan_pk).first()
+	if diff is None or diff.changes is None:
+		return render(request, 'dd_downloader/error.html', {'error_msg': "The scan has not been compared with a previous run"})
+	return blob_response(request, diff.changes, f"changes-{scan_pk}.csv", content_type='text/csv')
 
 #Manual scan control endpoints
 """
-Each manual scan control endpoint checks if the scan object is eligible to have the command run on them. If they are not eligible, an error page is returned.
+Each manual scan control endpoint checks if the scan object is eligible to have the command run on them. If they are not eligible, or a task is already working on them, an error page is returned.
+Commands that need capacity on the scanner (create, start, retrieve) are queued, and released by the scheduler within the scanner's limits.
 """
+def queue_scan_action(scan_obj, action):
+	scan_obj.queue_action(action)
+	process_scans.delay(scan_obj.scanner_id)
+
 def scan_manual_create_endpoint(request, scan_pk):
 	try:
 		scan_obj = Scan.objects.get(pk=scan_pk)
@@ -265,11 +350,13 @@ def scan_manual_create_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan for manual creation')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
+	if scan_obj.is_leased():
+		return render(request, 'dd_downloader/error.html', {'error_msg': SCAN_BUSY_ERROR.format(item=scan_obj.scan_name)})
 	if not scan_obj.can_create():
 		error_msg = "Scan could not be created."
 		logger.warning(error_msg)
 		return render(request, 'dd_downloader/error.html', {'error_msg': error_msg})
-	manual_create_scan.delay(scan_obj.pk)
+	queue_scan_action(scan_obj, Scan.ACTION_CREATE)
 	return HttpResponseRedirect(reverse('dd_downloader:index'))
 
 def scan_manual_start_endpoint(request, scan_pk):
@@ -282,10 +369,12 @@ def scan_manual_start_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan for manual start')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
+	if scan_obj.is_leased():
+		return render(request, 'dd_downloader/error.html', {'error_msg': SCAN_BUSY_ERROR.format(item=scan_obj.scan_name)})
 	if not scan_obj.can_start():
 		error_msg = "Scan could not be started."
 		return render(request, 'dd_downloader/error.html', {'error_msg': error_msg})
-	manual_start_scan.delay(scan_obj.pk)
+	queue_scan_action(scan_obj, Scan.ACTION_START)
 	return HttpResponseRedirect(reverse('dd_downloader:index'))
 
 def scan_manual_pause_endpoint(request, scan_pk):
@@ -298,6 +387,8 @@ def scan_manual_pause_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan for manual pause')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
+	if scan_obj.is_leased():
+		return render(request, 'dd_downloader/error.html', {'error_msg': SCAN_BUSY_ERROR.format(item=scan_obj.scan_name)})
 	if not scan_obj.can_pause():
 		error_msg = "Scan could not be paused."
 		logger.warning(error_msg)
@@ -315,6 +406,8 @@ def scan_manual_resume_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan for manual resume')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
+	if scan_obj.is_leased():
+		return render(request, 'dd_downloader/error.html', {'error_msg': SCAN_BUSY_ERROR.format(item=scan_obj.scan_name)})
 	if not scan_obj.can_resume():
 		error_msg = "Scan could not be resumed."
 		logger.warning(error_msg)
@@ -332,6 +425,8 @@ def scan_manual_stop_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan for manual stop')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
+	if scan_obj.is_leased():
+		return render(request, 'dd_downloader/error.html', {'error_msg': SCAN_BUSY_ERROR.format(item=scan_obj.scan_name)})
 	if not scan_obj.can_stop():
 		error_msg = "Scan could not be stopped."
 		logger.warning(error_msg)
@@ -349,48 +444,48 @@ def scan_manual_retrieve_endpoint(request, scan_pk):
 		logger.exception('Unknown error while fetching scan for manual retrieval')
 		return render(request, 'dd_downloader/error.html', {'error_msg': GENERIC_ERROR})
 
+	if scan_obj.is_leased():
+		return render(request, 'dd_downloader/error.html', {'error_msg': SCAN_BUSY_ERROR.format(item=scan_obj.scan_name)})
 	if not scan_obj.can_retrieve():
 		error_msg = "Scan could not be retrieved."
 		logger.warning(error_msg)
 		return render(request, 'dd_downloader/error.html', {'error_msg': error_msg})
-	manual_retrieve_scan.delay(scan_obj.pk)
+	queue_scan_action(scan_obj, Scan.ACTION_RETRIEVE)
 	return HttpResponseRedirect(reverse('dd_downloader:index'))
 
 #Batch control endpoints
 """
-Accepts a JSON object containing a list of scan PKs. If the result attribute of each scan object contains a file, they are zipped and the zipped result is returned as a file download.
+Accepts a JSON object containing a list of scan PKs. If the result attribute of each scan object contains a file, they are zipped and the zipped result is streamed back as a file download, one entry at a time.
+With "scope" set to "filter", the scans are instead selected by the filters of a list page (see datatables.filter_scans), and those without results are skipped.
 """
 def batch_download_endpoint(request):
 	if request.method == 'POST':
+		if is_filter_scope(request):
+			results = list(datatables.filter_scans(request.POST, Scan.objects.all()).non_polymorphic().filter(result__isnull=False).select_related('result', 'scanner'))
+			if not results:
+				return render(request, 'dd_downloader/error.html', {'error_msg': "No scans with results match the filters"})
+			resp = StreamingHttpResponse(stream_zip(results), content_type="application/zip")
+			resp['Content-Disposition'] = 'filename=result.zip'
+			return resp
 		try:
-			pk_list = request.POST.getlist('pk_list[]')
+			pk_list = set(request.POST.getlist('pk_list[]'))
 		except Exception as e:
 			logger.exception('Could not retrieve list of scan PKs for batch download')
 			return render(request, 'dd_downloader/error.html', {'error_msg': "Could not retrieve list of scan PKs for batch download"})
-		
-		results = []
-		for pk in pk_list:
-			try:
-				scan_obj = Scan.objects.get(pk=pk)
-			except Exception as e:
-				logger.exception('Scan could not be found for batch download')
-				return render(request, 'dd_downloader/error.html', {'error_msg': "Nonexistent scan in batch download"})
-			else:
-				if not scan_obj.result:
-					return render(request, 'dd_downloader/error.html', {'error_msg': "Scan with no results discovered while batch downloading"})
-				else:
-					results.append(scan_obj)
-		import zipfile
-		import io
-		temp_zip = io.BytesIO()
+
 		try:
-			with zipfile.ZipFile(temp_zip, "w") as z:
-				for scan_obj in results:
-					z.write(scan_obj.result.path, arcname=scan_obj.result.name)
+			results = list(Scan.objects.non_polymorphic().filter(pk__in=pk_list).select_related('result', 'scanner'))
 		except Exception as e:
-			logger.exception('Zipping failed')
-			return render(request, 'dd_downloader/error.html', {'error_msg': "An error occurred while archiving the scan results"})
-		resp = HttpResponse(temp_zip.getvalue(), content_type="application/zip")
+			logger.exception('Scan could not be found for batch download')
+			return render(request, 'dd_downloader/error.html', {'error_msg': "Nonexistent scan in batch download"})
+		if len(results) != len(pk_list):
+			logger.error('Scan could not be found for batch download')
+			return render(request, 'dd_downloader/error.html', {'error_msg': "Nonexistent scan in batch download"})
+		for scan_obj in results:
+			if not scan_obj.result:
+				return render(request, 'dd_downloader/error.html', {'error_msg': "Scan with no results discovered while batch downloading"})
+
+		resp = StreamingHttpResponse(stream_zip(results), content_type="application/zip")
 		resp['Content-Disposition'] = 'filename=result.zip'
 		return resp
 	else:
@@ -399,6 +494,7 @@ def batch_download_endpoint(request):
 
 """
 Accepts a JSON object containing a list of scan PKs, and a command. All scan objects that are eligible for the command will have the command run on them. Any scan objects that were not eligible or were missing will not have any command run on them, and will be placed in a list that is returned to the user as JSON object.
+With "scope" set to "filter", the targets are instead selected by the filters of a list page. Filters that select everything are refused unless "confirm" is set to "all".
 """
 def batch_control_endpoint(request):
 	if request.method == 'POST':
@@ -409,132 +505,341 @@ def batch_control_endpoint(request):
 		except Exception as e:
 			logger.error('Command, type, and/or pk_list not found')
 			return JsonResponse({'status': 'invalid params'})
-		if command not in ['CR','ST','PS','RS','SP','RT','DL'] and target_type not in ['scanner','scan']:
+		if command not in BATCH_SCAN_CHECKS and command != 'DL' or target_type not in ['scanner','scan']:
 			logger.error('Invalid command and/or type')
 			return JsonResponse({'status': 'invalid command and/or type'})
 
+		#Targets are either listed by PK, or selected by the filters of a list page so that actions on an entire filtered view don't depend on how many rows the browser holds.
+		filter_scope = is_filter_scope(request)
+		if filter_scope:
+			pk_list = []
+			#Without any filters, the command would run on every scan (or scanner), which has to be asked for explicitly with "confirm" set to "all", so that a request that lost its filters can't do so.
+			has_filters = datatables.has_scan_filters(request.POST) if target_type == 'scan' else datatables.has_scanner_filters(request.POST)
+			if not has_filters and request.POST.get('confirm') != 'all':
+				logger.error('Unfiltered batch command without confirmation')
+				return JsonResponse({'status': 'unconfirmed unfiltered command'})
+		pks = {parse_pk(pk) for pk in pk_list} - {None}
 		if (target_type == 'scan'):
-			missing_scan_pks = []
+			eligible_scans = []
 			unsuccessful_scans = []
-			for pk in pk_list:
-				try:
-					scan_obj = Scan.objects.get(pk=pk)
-				except Exception as e:
-					logger.error('Nonexistent scan in batch command')
-					missing_scan_pks.append(pk)
+			if command == 'DL':
+				#Deleted scans aren't checked, so they are deleted in bulk without being loaded.
+				targets = datatables.filter_scans(request.POST, Scan.objects.all()) if filter_scope else Scan.objects.filter(pk__in=list(pks))
+				found_pks = set(bulk.delete_scans(targets))
+				logger.info(f"Batch deleted {len(found_pks)} scans")
+			else:
+				#All scans are fetched at once, and checked in memory.
+				if filter_scope:
+					scans = {scan_obj.pk: scan_obj for scan_obj in datatables.filter_scans(request.POST, Scan.objects.all())}
+					scan_list = list(scans.values())
 				else:
-					if command == 'CR' and scan_obj.can_create():
-						manual_create_scan.delay(scan_obj.pk)
-					elif command == 'ST' and scan_obj.can_start():
-						manual_start_scan.delay(scan_obj.pk)
-					elif command == 'PS' and scan_obj.can_pause():
-						manual_pause_scan.delay(scan_obj.pk)
-					elif command == 'RS' and scan_obj.can_resume():
-						manual_resume_scan.delay(scan_obj.pk)
-					elif command == 'SP' and scan_obj.can_stop():
-						manual_stop_scan.delay(scan_obj.pk)
-					elif command == 'RT' and scan_obj.can_retrieve():
-						manual_retrieve_scan.delay(scan_obj.pk)
-					elif command == 'DL':
-						scan_obj.delete()
-					else:
+					scans = Scan.objects.in_bulk(list(pks))
+					#Scans are checked and reported in the order they were requested in, rather than the order the database returned them in.
+					scan_list = [scans[pk] for pk in dict.fromkeys(parse_pk(pk) for pk in pk_list) if pk in scans]
+				found_pks = set(scans)
+				for scan_obj in scan_list:
+					#Scans that a task holds a live lease on are busy.
+					if scan_obj.is_leased() or not getattr(scan_obj, BATCH_SCAN_CHECKS[command])():
 						unsuccessful_scans.append(scan_obj)
+					else:
+						eligible_scans.append(scan_obj)
+			missing_pks = [pk for pk in pk_list if parse_pk(pk) not in found_pks]
+
+			if eligible_scans:
+				eligible_pks = [scan_obj.pk for scan_obj in eligible_scans]
+				if command in BATCH_QUEUED_ACTIONS:
+					#Create, start and retrieve commands are queued, and released by the scheduler within each scanner's limits.
+					#Scans that changed since they were checked are not queued, and are reported as unsuccessful.
+					queued_pks = Scan.queue_actions(eligible_scans, BATCH_QUEUED_ACTIONS[command])
+					unsuccessful_scans = [scan_obj for scan_obj in scan_list if scan_obj.pk not in queued_pks]
+					eligible_scans = [scan_obj for scan_obj in eligible_scans if scan_obj.pk in queued_pks]
+					if eligible_scans:
+						group(process_scans.s(scanner_pk) for scanner_pk in {scan_obj.scanner_id for scan_obj in eligible_scans}).apply_async()
+				else:
+					BATCH_SCAN_TASKS[command].chunks([(pk,) for pk in eligible_pks], BATCH_TASK_CHUNK_SIZE).apply_async()
+
 			resp = {}
 			if unsuccessful_scans:
-				unsuccessful_names = []
 				logger.info(f"These scans failed to {command}: {unsuccessful_scans}")
-				for scan_obj in unsuccessful_scans:
-					unsuccessful_names.append(scan_obj.scan_name)
-				resp['unsuccessful'] = unsuccessful_names
-			if missing_scan_pks:
-				resp['missing'] = missing_scan_pks
+				resp['unsuccessful'] = [scan_obj.scan_name for scan_obj in unsuccessful_scans[:BATCH_REPORT_LIMIT]]
+				resp['unsuccessful_count'] = len(unsuccessful_scans)
+			if missing_pks:
+				logger.error('Nonexistent scans in batch command')
+				resp['missing'] = missing_pks
 
-			resp['status'] = 'failure' if (unsuccessful_scans or missing_scan_pks) else 'success'
+			resp['status'] = 'failure' if (unsuccessful_scans or missing_pks) else 'success'
 			return JsonResponse(resp)
 
 		elif (target_type == 'scanner'):
-			missing_scanner_pks = []
-			for pk in pk_list:
-				try:
-					scanner_obj = Scanner.objects.get(pk=pk)
-				except Exception as e:
-					logger.error('Nonexistent scanner in batch command')
-					missing_scanner_pks.append(pk)
-				else:
-					if command == 'DL':			
-						logger.info(f"delete {pk}")
-						scanner_obj.delete()
+			if filter_scope:
+				found_pks = set(datatables.filter_scanners(request.POST, Scanner.objects.all()).values_list('pk', flat=True))
+			else:
+				found_pks = set(Scanner.objects.filter(pk__in=list(pks)).values_list('pk', flat=True))
+			missing_pks = [pk for pk in pk_list if parse_pk(pk) not in found_pks]
+			if missing_pks:
+				logger.error('Nonexistent scanners in batch command')
+			if command == 'DL' and found_pks:
+				logger.info(f"delete {sorted(found_pks)}")
+				Scanner.objects.filter(pk__in=found_pks).delete()
 			resp = {}
-			if missing_scanner_pks:
-				resp['missing'] = missing_scanner_pks
-			resp['status'] = 'failure' if (missing_scanner_pks) else 'success'
+			if missing_pks:
+				resp['missing'] = missing_pks
+			resp['status'] = 'failure' if (missing_pks) else 'success'
 			return JsonResponse(resp)
 	else:
 		return JsonResponse({'status': 'invalid method'})
 
-"""
-Helper functions for serializing scan/scanner lists
-"""
-def scan_list_to_json(request, scan_list):
-	from django.utils.html import escape
-	scan_json = {'data':[]}
-	for scan in scan_list:
-		scan_json['data'].append ({
-			'PK':scan.pk,
-			'Scan Name': {
-				'URL': request.build_absolute_uri(reverse('dd_downloader:scan detail page',args=[scan.pk])),
-				'Name': escape(scan.scan_name)
-			},
-			'Status':escape(scan.get_status_display()),
-			'Automation': {
-				'Auto Create': scan.auto_create,
-				'Auto Start': scan.auto_start,
-				'Auto Retrieve': scan.auto_retrieve,
-			},
-			'Parent Scanner': {
-				'URL': request.build_absolute_uri(reverse('dd_downloader:scanner detail page',args=[scan.scanner.pk])),
-				'Name': escape(scan.scanner.scanner_name)
-			},
-			'Created On':scan.create_date,
-			'Started On':scan.start_date,
-			'Ended On':scan.end_date
-		})
-	return scan_json
-
-def scanner_list_to_json(request, scanner_list):
-	from django.utils.html import escape
-	scanner_json = {'data':[]}
-	for scanner in scanner_list:
-		scanner_json['data'].append ({
-			'PK':scanner.pk,
-			'Scanner Name': {
-				'URL':request.build_absolute_uri(reverse('dd_downloader:scanner detail page',args=[scanner.pk])),
-				'Name':escape(scanner.scanner_name)
-			},
-			'# of Child Scans': len(scanner.scan_set.all()),
-			'Created On':scanner.create_date
-		})
-	return scanner_json
+#Names of the Scan methods that check whether each batch command can be run on a scan.
+BATCH_SCAN_CHECKS = {
+	'CR': 'can_create',
+	'ST': 'can_start',
+	'PS': 'can_pause',
+	'RS': 'can_resume',
+	'SP': 'can_stop',
+	'RT': 'can_retrieve',
+}
+#Batch commands that are queued on the scans, and the commands that are sent to Celery as tasks.
+BATCH_QUEUED_ACTIONS = {
+	'CR': Scan.ACTION_CREATE,
+	'ST': Scan.ACTION_START,
+	'RT': Scan.ACTION_RETRIEVE,
+}
+BATCH_SCAN_TASKS = {
+	'PS': manual_pause_scan,
+	'RS': manual_resume_scan,
+	'SP': manual_stop_scan,
+}
+#Number of scans handled by each Celery task of a batch command.
+BATCH_TASK_CHUNK_SIZE = 100
+#Maximum number of unsuccessful scans named in the response to a batch command.
+BATCH_REPORT_LIMIT = 100
+
+def is_filter_scope(request):
+	return request.POST.get('scope') == 'filter'
+
+"""
+Returns a PK sent by a client as an int, or None if it is invalid.
+"""
+def parse_pk(pk):
+	try:
+		return int(pk)
+	except ValueError:
+		return None
+
+"""
+Helper functions for streaming a zip archive of scan results. ZipStream is a write-only file object that zipfile writes into, and stream_zip() hands out whatever has been written after every chunk, so the archive never has to be held in memory.
+"""
+class ZipStream:
+	def __init__(self):
+		self.buffer = []
+		self.position = 0
+	def write(self, data):
+		self.buffer.append(bytes(data))
+		self.position += len(data)
+		return len(data)
+	def tell(self):
+		return self.position
+	def flush(self):
+		pass
+	def pop(self):
+		data = b''.join(self.buffer)
+		self.buffer = []
+		return data
+
+def stream_zip(scan_list):
+	import zipfile, time
+	stream = ZipStream()
+	try:
+		with zipfile.ZipFile(stream, "w") as z:
+			for scan_obj in scan_list:
+				zinfo = zipfile.ZipInfo(scan_obj.result_filename(), date_time=time.localtime()[:6])
+				zinfo.file_size = scan_obj.result.size
+				with z.open(zinfo, 'w') as dest:
+					for chunk in scan_obj.result.chunks():
+						dest.write(chunk)
+						yield stream.pop()
+	except Exception as e:
+		#Headers have already been sent at this point, so the archive can only be cut short.
+		logger.exception('Zipping failed')
+		return
+	yield stream.pop()
+
+"""
+Helper functions for incremental list updates. Every list response carries a cursor (the time of the latest change to any scan or scanner), and requests with a "since" cursor only get the rows that changed or were deleted after it.
+List responses also carry an ETag and Last-Modified header derived from the same state, so that a client polling an unchanged list gets a 304 Not Modified.
+"""
+#Clients are told to reload their list instead of merging changes when more than this many rows changed.
+MAX_DELTA_ROWS = 1000
+#Seconds before a "since" cursor from which changes are sent again (see parse_since).
+CURSOR_OVERLAP = 10
+
+def list_state():
+	from django.db.models import Max, Count
+	scans = Scan.objects.non_polymorphic().aggregate(last=Max('updated_at'), count=Count('pk'))
+	scanners = Scanner.objects.non_polymorphic().aggregate(last=Max('updated_at'), count=Count('pk'))
+	deleted = DeletedObject.objects.aggregate(last=Max('deleted_at'))['last']
+	last_modified = max([d for d in [scans['last'], scanners['last'], deleted] if d is not None], default=None)
+	return last_modified, f"{scans['last']}|{scans['count']}|{scanners['last']}|{scanners['count']}|{deleted}"
+
+def conditional_list_response(request, build_json):
+	import hashlib
+	from django.utils.cache import get_conditional_response
+	from django.utils.http import http_date
+	last_modified, state = list_state()
+	etag = '"' + hashlib.md5((state + request.get_full_path()).encode()).hexdigest() + '"'
+	timestamp = int(last_modified.timestamp()) if last_modified else None
+	resp = get_conditional_response(request, etag=etag, last_modified=timestamp)
+	if resp is None:
+		data = build_json()
+		data['cursor'] = last_modified.isoformat() if last_modified else None
+		resp = JsonResponse(data)
+	resp['ETag'] = etag
+	if timestamp is not None:
+		resp['Last-Modified'] = http_date(timestamp)
+	#Browsers must revalidate every time, so that they can reuse their cached copy on a 304.
+	resp['Cache-Control'] = 'private, no-cache'
+	return resp
+
+"""
+Returns the "since" cursor of a request as a datetime, or None if the client has to reload its whole list (no cursor, or a cursor older than the record of deletions).
+Rows are stamped with updated_at before their transaction commits, so a row can become visible after a later stamp has already been handed out as a cursor. The cursor is moved back by CURSOR_OVERLAP so that such rows are still sent, and clients skip the rows they already have.
+"""
+def parse_since(request):
+	from datetime import timedelta
+	from django.utils import timezone
+	from django.utils.dateparse import parse_datetime
+	since = parse_datetime(request.GET.get('since', '') or '')
+	if since is None or since < timezone.now() - timedelta(seconds=DeletedObject.DELETED_OBJECT_RETENTION):
+		return None
+	return since - timedelta(seconds=CURSOR_OVERLAP)
+
+def scan_delta_json(request, scan_list, since, scanner_pk=None):
+	from django.db.models import Q
+	changed = scan_list.filter(Q(updated_at__gt=since) | Q(scanner__updated_at__gt=since)).order_by('pk')[:MAX_DELTA_ROWS + 1]
+	deleted = DeletedObject.objects.filter(model_name=DeletedObject.SCAN, deleted_at__gt=since)
+	if scanner_pk is not None:
+		deleted = deleted.filter(scanner_pk=scanner_pk)
+	delta = scan_list_to_json(request, changed)
+	if len(delta['data']) > MAX_DELTA_ROWS:
+		return {'reset': True}
+	delta['deleted'] = list(deleted.values_list('object_pk', flat=True))
+	return delta
+
+def scanner_delta_json(request, scanner_list, since):
+	from django.db.models import Q
+	deleted_scans = DeletedObject.objects.filter(model_name=DeletedObject.SCAN, deleted_at__gt=since).values('scanner_pk')
+	#Child scan counts change when scans are added or deleted.
+	changed = annotate_scanners(scanner_list).filter(
+		Q(updated_at__gt=since) | Q(pk__in=Scan.objects.non_polymorphic().filter(create_date__gt=since).values('scanner_id')) | Q(pk__in=deleted_scans)
+	).order_by('pk')[:MAX_DELTA_ROWS + 1]
+	delta = scanner_list_to_json(request, changed)
+	if len(delta['data']) > MAX_DELTA_ROWS:
+		return {'reset': True}
+	delta['deleted'] = list(DeletedObject.objects.filter(model_name=DeletedObject.SCANNER, deleted_at__gt=since).values_list('object_pk', flat=True))
+	return delta
 
 #AJAX endpoints
 """
-Returns a JSON object with details of all scan objects in the web application.
+Returns a JSON object with details of all scan objects in the web application. When requested by a DataTable in serverSide mode, only the requested page of the filtered and ordered list is returned.
+When requested with a "since" cursor, only the scans that changed or were deleted since then are returned.
 """
 def scan_list_ajax_endpoint(request):
 	scan_list = Scan.objects.all()
-	return JsonResponse(scan_list_to_json(request,scan_list))
+	return scan_list_response(request, scan_list)
 
 """
-Returns a JSON object with details of all scan objects under a scanner.
+Returns a JSON object with details of all scan objects under a scanner. Supports serverSide mode and "since" cursors like scan_list_ajax_endpoint.
 """
 def child_scan_list_ajax_endpoint(request, scanner_pk):
-	scanner_obj = Scanner.objects.get(pk=scanner_pk)
-	scan_list = scanner_obj.scan_set.all()
-	return JsonResponse(scan_list_to_json(request,scan_list))
+	scan_list = Scan.objects.filter(scanner_id=scanner_pk)
+	return scan_list_response(request, scan_list, scanner_pk)
 
 """
-Returns a JSON object with details of all scanner objects in the web application.
+Returns a JSON object with details of all scanner objects in the web application. Supports serverSide mode and "since" cursors like scan_list_ajax_endpoint.
 """
 def scanner_list_ajax_endpoint(request):
-	scanner_list = Scanner.objects.all()		
-	return JsonResponse(scanner_list_to_json(request,scanner_list))
+	scanner_list = Scanner.objects.all()
+	def build_json():
+		if 'since' in request.GET:
+			since = parse_since(request)
+			return scanner_delta_json(request, scanner_list, since) if since else {'reset': True}
+		if datatables.is_server_side(request):
+			page, resp = datatables.process_scanners(request.GET, scanner_list)
+			resp.update(scanner_list_to_json(request, page))
+			return resp
+		return scanner_list_to_json(request,scanner_list)
+	return conditional_list_response(request, build_json)
+
+def scan_list_response(request, scan_list, scanner_pk=None):
+	def build_json():
+		if 'since' in request.GET:
+			since = parse_since(request)
+			return scan_delta_json(request, scan_list, since, scanner_pk) if since else {'reset': True}
+		if datatables.is_server_side(request):
+			page, resp = datatables.process_scans(request.GET, scan_list)
+			resp.update(scan_list_to_json(request, page))
+			return resp
+		return scan_list_to_json(request,scan_list)
+	return conditional_list_response(request, build_json)
+
+#Maximum number of findings returned by the findings endpoint.
+FINDINGS_LIMIT = 1000
+
+"""
+Queries the findings index of retrieved scans. Findings can be filtered by "scan", "host", "port", "plugin_id", "cve" and "severity" (minimum severity); every filter is served by an index on Finding.
+At most FINDINGS_LIMIT findings are returned, with "truncated" set if there were more.
+"""
+def findings_endpoint(request):
+	filters = {}
+	try:
+		for param, lookup in (('scan', 'scan_id'), ('port', 'port'), ('severity', 'severity__gte')):
+			if param in request.GET:
+				filters[lookup] = int(request.GET[param])
+	except ValueError:
+		return JsonResponse({'error': INVALID_PARAMETERS_ERROR.format(params='scan, port, severity')}, status=400)
+	for param in ('host', 'plugin_id', 'cve'):
+		if param in request.GET:
+			filters[param] = request.GET[param]
+	rows = list(Finding.objects.filter(**filters).order_by('pk').values('scan_id', 'host', 'port', 'protocol', 'plugin_id', 'name', 'path', 'cve', 'severity')[:FINDINGS_LIMIT + 1])
+	return JsonResponse({'data': rows[:FINDINGS_LIMIT], 'truncated': len(rows) > FINDINGS_LIMIT})
+
+"""
+Server-sent event stream of scan status changes, which the list and detail pages listen to instead of polling.
+The stream can be narrowed down to a single scan ("scan") or to the scans of a scanner ("scanner"). Events only say which scan changed; clients fetch the change itself from the list endpoints.
+Streams are closed after EVENT_STREAM_DURATION seconds; browsers reconnect automatically after the advertised retry delay.
+"""
+def event_stream_endpoint(request):
+	from django.conf import settings
+	try:
+		scan_pk = int(request.GET['scan']) if 'scan' in request.GET else None
+		scanner_pk = int(request.GET['scanner']) if 'scanner' in request.GET else None
+	except ValueError:
+		return JsonResponse({'error': INVALID_PARAMETERS_ERROR.format(params='scan, scanner')}, status=400)
+	resp = StreamingHttpResponse(
+		event_stream(scan_pk, scanner_pk, getattr(settings, 'EVENT_STREAM_DURATION', 300), getattr(settings, 'EVENT_HEARTBEAT_INTERVAL', 15)),
+		content_type='text/event-stream',
+	)
+	resp['Cache-Control'] = 'no-cache'
+	#Stops reverse proxies (e.g. nginx) from buffering events.
+	resp['X-Accel-Buffering'] = 'no'
+	return resp
+
+def event_stream(scan_pk, scanner_pk, duration, heartbeat):
+	import json, time
+	subscription = events.get_broker().subscribe()
+	try:
+		yield 'retry: 5000\n\n'
+		deadline = time.monotonic() + duration
+		while time.monotonic() < deadline:
+			batch = subscription.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+			sent = False
+			for event in batch:
+				if not events.event_matches(event, scan_pk, scanner_pk):
+					continue
+				yield f"event: scan\ndata: {json.dumps(event)}\n\n"
+				sent = True
+			if not sent:
+				#Comment lines keep idle connections from being dropped by proxies.
+				yield ': keep-alive\n\n'
+	finally:
+		subscription.close()
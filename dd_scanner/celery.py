@@ -24,10 +24,21 @@ def debug_task(self):
 from celery.schedules import crontab
 
 app.conf.beat_schedule = {
-    # Executes every day at  12:30 pm.
+    # Runs every few seconds, and only queues the scans that are due (see Scan.next_poll_at), so that short scans are noticed soon after they finish.
     'process-scan-queue-task': {
         'task': 'process-all-scanners',
-        'schedule': crontab(minute='*'),
+        'schedule': settings.SCHEDULER_INTERVAL,
+        'args': (),
+    },
+    # Keeps the health snapshot of every scanner current (see ScannerHealth).
+    'probe-scanners-task': {
+        'task': 'probe-all-scanners',
+        'schedule': settings.SCANNER_PROBE_INTERVAL,
+        'args': (),
+    },
+    'prune-deleted-objects-task': {
+        'task': 'prune-deleted-objects',
+        'schedule': crontab(minute=0),
         'args': (),
     },
 }
\ No newline at end of file
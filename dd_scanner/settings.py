@@ -178,3 +178,24 @@ MEDIA_ROOT = '/var/www/ddownload/media/'
 # CELERY STUFF
 CELERY_BROKER_URL = 'redis://localhost:6379/'
 CELERY_TIMEZONE = 'Asia/Hong_Kong'
+
+# SCHEDULER
+# Interval (in seconds) at which Celery beat plans the scan work. Each run only queues the scans that have something due.
+SCHEDULER_INTERVAL = 15.0
+
+# SCANNER TRANSPORT
+# Size of the keep-alive connection pool kept per scanner in each worker process, and the default timeout (in seconds) of scanner API calls.
+SCANNER_HTTP_POOL_SIZE = 10
+SCANNER_HTTP_TIMEOUT = 5
+# Longest time (in seconds) that an API call waits for its scanner's API call limits before failing.
+SCANNER_THROTTLE_MAX_WAIT = 60
+# Interval (in seconds) between health probes of each scanner.
+SCANNER_PROBE_INTERVAL = 60.0
+
+# SCAN EVENTS
+# Backend of the scan status event stream: 'redis' (shared by all web and worker processes) or 'memory' (single process only).
+# Event streams are closed after EVENT_STREAM_DURATION seconds and reopened by the browser, so that they don't hold a web worker forever.
+EVENT_BACKEND = 'redis'
+EVENT_REDIS_URL = CELERY_BROKER_URL
+EVENT_STREAM_DURATION = 300
+EVENT_HEARTBEAT_INTERVAL = 15